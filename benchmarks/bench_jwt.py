@@ -0,0 +1,49 @@
+"""
+Bearer token verification latency.
+
+    python benchmarks/bench_jwt.py --seconds 2
+
+"decode" checks the signature and claims on every call; "verify (cached)" is the
+require_auth hot path, where a token already seen is answered from the digest cache.
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.services.jwt_keys import JWTKeyRing
+from src.services.security import SecurityService
+
+def measure(operation, seconds):
+    count = 0
+    started = time.perf_counter()
+    deadline = started + seconds
+    while time.perf_counter() < deadline:
+        operation()
+        count += 1
+    return count / (time.perf_counter() - started)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--seconds', type=float, default=2.0, help='time spent on each operation')
+    args = parser.parse_args()
+
+    keyring = JWTKeyRing({'k1': 'bench-signing-key'}, 'k1')
+    token = keyring.sign({'user_id': '42', 'role': 'merchant', 'exp': int(time.time()) + 3600})
+    service = SecurityService()
+    service_token = service.generate_jwt_token('42', role='merchant')
+
+    results = [
+        ('decode (uncached)', measure(lambda: keyring.decode(token), args.seconds)),
+        ('verify (cached)', measure(lambda: keyring.verify(token), args.seconds)),
+        ('verify_jwt_token (cached)', measure(lambda: service.verify_jwt_token(service_token), args.seconds)),
+    ]
+
+    for name, ops in results:
+        print(f"{name:>30}: {ops:12.1f} ops/sec ({1e6 / ops:10.1f} us/op)")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+"""
+Authorizations/sec for one worker against a local stub card network.
+
+    python benchmarks/bench_payment_dispatch.py --payments 500 --latency 0.05
+
+"blocking" reproduces the old inline time.sleep() path, one authorization at a time.
+"threads" is a gthread-style worker calling the synchronous facade from N threads.
+"engine" hands the whole batch to the dispatch engine (PaymentProcessor.process_payments).
+"""
+
+import argparse
+import os
+import sys
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.services.network_dispatch import DispatchEngine, StubCardNetwork
+from src.services.payment_processor import PaymentProcessor
+
+def make_payments(count):
+    brands = ['Visa', 'Mastercard', 'Amex']
+    return [
+        SimpleNamespace(
+            transaction_id=str(uuid.uuid4()),
+            merchant_id='merchant_bench',
+            amount_minor=2500,
+            currency='EUR',
+            card_token=f"tok_{uuid.uuid4().hex}",
+            card_brand=brands[i % len(brands)]
+        )
+        for i in range(count)
+    ]
+
+def bench_blocking(payments, latency):
+    started = time.perf_counter()
+    for _ in payments:
+        time.sleep(latency)
+    return time.perf_counter() - started
+
+def bench_threads(processor, payments, threads):
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        list(pool.map(processor.process_payment, payments))
+    return time.perf_counter() - started
+
+def bench_engine(processor, payments):
+    started = time.perf_counter()
+    processor.process_payments(payments)
+    return time.perf_counter() - started
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--payments', type=int, default=500)
+    parser.add_argument('--latency', type=float, default=0.05, help='stub network round trip in seconds')
+    parser.add_argument('--threads', type=int, default=4, help='threads per worker for the threads mode')
+    parser.add_argument('--max-in-flight', type=int, default=500)
+    args = parser.parse_args()
+
+    payments = make_payments(args.payments)
+    processor = PaymentProcessor(
+        network=StubCardNetwork(args.latency),
+        engine=DispatchEngine(max_in_flight=args.max_in_flight)
+    )
+    # Start the loop thread outside the measured section
+    processor.engine.run(processor.network.call('warmup', {}, (0, 0)))
+
+    blocking_count = min(args.payments, max(1, int(5 / args.latency)))
+    results = [
+        ('blocking', blocking_count, bench_blocking(payments[:blocking_count], args.latency)),
+        (f'threads x{args.threads}', args.payments, bench_threads(processor, payments, args.threads)),
+        ('engine', args.payments, bench_engine(processor, payments)),
+    ]
+
+    print(f"stub latency {args.latency * 1000:.0f} ms, {args.payments} payments")
+    for mode, count, elapsed in results:
+        print(f"{mode:>12}: {count / elapsed:10.1f} authorizations/sec ({count} in {elapsed:.2f}s)")
+
+if __name__ == '__main__':
+    main()
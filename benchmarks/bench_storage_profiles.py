@@ -0,0 +1,105 @@
+"""
+Payment write/read throughput for each SQLite storage profile (DATABASE_PROFILE).
+
+    python benchmarks/bench_storage_profiles.py --threads 8 --payments 2000
+
+Each profile gets a fresh database file. Writers insert payments with one commit per
+payment, as POST /api/payments does; readers then fetch payments by transaction_id.
+"""
+
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from src.database import STORAGE_PROFILES, db, init_db
+from src.models.payment import Payment, PaymentMethod
+
+def make_app(profile, path):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{path}'
+    app.config['DATABASE_PROFILE'] = profile
+    init_db(app)
+    return app
+
+def run_threads(app, threads, work):
+    errors = []
+
+    def worker(index):
+        with app.app_context():
+            try:
+                work(index)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                db.session.remove()
+
+    pool = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    started = time.perf_counter()
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    return time.perf_counter() - started, errors
+
+def bench_profile(profile, threads, payments, workdir):
+    app = make_app(profile, os.path.join(workdir, f'{profile}.db'))
+    per_thread = payments // threads
+    transaction_ids = [[] for _ in range(threads)]
+
+    def write(index):
+        for _ in range(per_thread):
+            payment = Payment(
+                transaction_id=uuid.uuid4().hex, merchant_id='merchant_bench',
+                amount_minor=1999, currency='EUR', payment_method=PaymentMethod.CREDIT_CARD
+            )
+            db.session.add(payment)
+            db.session.commit()
+            transaction_ids[index].append(payment.transaction_id)
+
+    def read(index):
+        ids = transaction_ids[index]
+        for _ in range(per_thread * 5):
+            Payment.query.filter_by(transaction_id=random.choice(ids)).first()
+
+    write_seconds, write_errors = run_threads(app, threads, write)
+    read_seconds, read_errors = run_threads(app, threads, read)
+    with app.app_context():
+        db.engine.dispose()
+
+    return {
+        'writes_per_sec': per_thread * threads / write_seconds,
+        'reads_per_sec': per_thread * threads * 5 / read_seconds,
+        'errors': len(write_errors) + len(read_errors)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--threads', type=int, default=8, help='concurrent writer/reader threads')
+    parser.add_argument('--payments', type=int, default=2000, help='payments written per profile')
+    parser.add_argument('--profiles', nargs='*', default=list(STORAGE_PROFILES), help='profiles to compare')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    try:
+        results = [(profile, bench_profile(profile, args.threads, args.payments, workdir)) for profile in args.profiles]
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print()
+    for profile, result in results:
+        print(
+            f"{profile:>12}: {result['writes_per_sec']:10.1f} payments/sec written, "
+            f"{result['reads_per_sec']:10.1f} reads/sec, {result['errors']} errors"
+        )
+
+if __name__ == '__main__':
+    main()
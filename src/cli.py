@@ -0,0 +1,189 @@
+"""
+Operational commands, run with: flask --app src.main <command>
+"""
+
+from datetime import datetime, timedelta
+
+import click
+
+def _parse_date(value: str) -> datetime:
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        raise click.BadParameter(f"expected an ISO date or datetime, got {value!r}")
+
+def register_commands(app):
+    """
+    Register the CLI commands on the Flask app
+    """
+
+    @app.cli.command('rescore-fraud')
+    @click.option('--start', required=True, help='Rescore payments created at or after this date (ISO format)')
+    @click.option('--end', default=None, help='Rescore payments created before this date (default: now)')
+    @click.option('--chunk-size', default=50000, show_default=True, help='Payments scored per chunk')
+    @click.option('--dry-run', is_flag=True, help='Score payments without writing fraud_score back')
+    def rescore_fraud(start, end, chunk_size, dry_run):
+        """Recompute fraud scores for a date range with the batch scorer."""
+        from src.services.fraud_detection import FraudDetectionService
+
+        start_at = _parse_date(start)
+        end_at = _parse_date(end) if end else datetime.utcnow() + timedelta(seconds=1)
+        if end_at <= start_at:
+            raise click.BadParameter('--end must be after --start')
+
+        def report(progress):
+            click.echo(f"  {progress['scored']} scored (through {progress['last_created_at']})")
+
+        summary = FraudDetectionService().analyze_batch(
+            start_at, end_at, chunk_size=chunk_size, dry_run=dry_run, progress=report
+        )
+        rate = summary['scored'] / summary['elapsed_seconds'] if summary['elapsed_seconds'] else 0
+        click.echo(
+            f"Rescored {summary['scored']} payments in {summary['elapsed_seconds']}s ({rate:.0f}/s), "
+            f"{summary['updated']} updated, {summary['high_risk']} high risk, "
+            f"mean score {summary['mean_score']:.3f}"
+        )
+
+    @app.cli.command('rebuild-revenue-rollups')
+    @click.option('--start', default=None, help='First day to rebuild (ISO date; default: all history)')
+    @click.option('--end', default=None, help='Rebuild days before this date (ISO date; default: all history)')
+    def rebuild_revenue_rollups(start, end):
+        """Recompute the daily revenue rollups from fee transactions."""
+        from src.services.billing_service import BillingService
+
+        start_at = _parse_date(start) if start else None
+        end_at = _parse_date(end) if end else None
+        if start_at and end_at and end_at <= start_at:
+            raise click.BadParameter('--end must be after --start')
+
+        written = BillingService().rebuild_revenue_rollups(start_at, end_at)
+        click.echo(f"Wrote {written} daily revenue rollups")
+
+    @app.cli.command('rebuild-payment-stats')
+    @click.option('--merchant-id', default=None, help='Rebuild one merchant only (default: all merchants)')
+    def rebuild_payment_stats(merchant_id):
+        """Recompute the per-merchant payment counters from the payments table."""
+        from src.database import db
+        from src.services.payment_stats import PaymentStatsService
+
+        with db.engine.begin() as connection:
+            written = PaymentStatsService().rebuild(connection, merchant_id)
+        click.echo(f"Wrote {written} payment counter rows")
+
+    @app.cli.command('run-invoices')
+    @click.option('--date', 'run_date', default=None, help='Invoice everything due up to this date (ISO date; default: today)')
+    @click.option('--workers', default=4, show_default=True, help='Worker processes invoicing merchants in parallel (SQLite runs in-process)')
+    @click.option('--chunk-size', default=200, show_default=True, help='Merchants handed to a worker at a time')
+    def run_invoices(run_date, workers, chunk_size):
+        """Invoice every auto-billed merchant that is due, catching up missed dates; re-running resumes."""
+        from src.services.invoice_run import InvoiceRunService
+
+        billing_date = _parse_date(run_date).date() if run_date else datetime.utcnow().date()
+
+        def report(progress):
+            click.echo(f"  {progress['handled']}/{progress['pending']} merchants handled")
+
+        summaries = InvoiceRunService().run_due(billing_date, workers=workers, chunk_size=chunk_size, progress=report)
+        if not summaries:
+            click.echo(f"No merchants due for billing up to {billing_date.isoformat()}")
+
+        failed = 0
+        for summary in summaries:
+            timings = summary['timings_ms']
+            click.echo(
+                f"Invoice run {summary['run_date']}: {summary['merchants_due']} merchants due "
+                f"({summary['resumed']} already done), {summary['invoiced']} invoiced, "
+                f"{summary['nothing_to_invoice']} with nothing to invoice, {summary['failed']} failed "
+                f"in {summary['elapsed_seconds']}s with {summary['workers']} worker(s)"
+            )
+            click.echo(f"Per-merchant time: p50 {timings['p50']}ms, p95 {timings['p95']}ms, max {timings['max']}ms")
+            for slow in summary['slowest']:
+                click.echo(f"  slowest: merchant billing {slow['merchant_billing_id']} took {slow['elapsed_ms']}ms")
+            for failure in summary['errors']:
+                click.echo(f"  failed: merchant billing {failure['merchant_billing_id']}: {failure['error']}")
+            failed += summary['failed']
+
+        if failed:
+            raise click.ClickException(f"{failed} merchant invoices failed; run again to retry them")
+
+    @app.cli.command('archive-transaction-logs')
+    @click.option('--retention-days', default=None, type=int, help='Drop months older than this (default: GDPR_RETENTION_DAYS)')
+    def archive_transaction_logs(retention_days):
+        """Move closed months of transaction logs into compressed segments and drop expired months."""
+        from src.services.log_archive import TransactionLogArchive, get_transaction_log_archive
+
+        archive = get_transaction_log_archive()
+        if retention_days is not None:
+            archive = TransactionLogArchive(archive.directory, retention_days=retention_days)
+
+        def report(result):
+            click.echo(f"  {result['month']}: {result['archived']} logs archived ({result['bytes']} bytes), "
+                       f"{result['deleted']} deleted from the database")
+
+        summary = archive.archive_closed_months(progress=report)
+        click.echo(f"Archived {len(summary['archived'])} months; deleted {summary['expired_rows']} expired logs "
+                   f"and dropped {len(summary['dropped'])} expired segments")
+
+    @app.cli.command('query-audit-log')
+    @click.option('--event-type', default=None, help='Only this compliance event type')
+    @click.option('--merchant-id', default=None, help='Only events for this merchant')
+    @click.option('--start', default=None, help='Events at or after this time (ISO date or datetime, UTC)')
+    @click.option('--end', default=None, help='Events before this time (ISO date or datetime, UTC)')
+    @click.option('--customer-email', default=None, help="Only data subject requests for this customer (matched by the email's keyed hash)")
+    @click.option('--limit', default=None, type=int, help='Stop after this many events')
+    def query_audit_log(event_type, merchant_id, start, end, customer_email, limit):
+        """Print matching compliance audit events as NDJSON, oldest first."""
+        import itertools
+        import json
+        from src.services.audit_log import get_audit_log, subject_hash
+
+        start_at = _parse_date(start) if start else None
+        end_at = _parse_date(end) if end else None
+        if start_at and end_at and end_at <= start_at:
+            raise click.BadParameter('--end must be after --start')
+
+        events = get_audit_log().query(event_type, merchant_id, start_at, end_at, limit=None if customer_email else limit)
+        if customer_email:
+            subject = subject_hash(customer_email)
+            events = itertools.islice((event for event in events if event['details'].get('subject') == subject), limit)
+        for event in events:
+            click.echo(json.dumps(event, separators=(',', ':')))
+
+    @app.cli.command('verify-audit-log')
+    @click.option('--expect-head', default=None, help='A head hash recorded earlier that the chain must still contain')
+    def verify_audit_log(expect_head):
+        """Re-hash the compliance audit log's chain; fails on any altered, missing or reordered block."""
+        from src.services.audit_log import get_audit_log
+
+        result = get_audit_log().verify(expected_head=expect_head)
+        click.echo(
+            f"{result['events']} events in {result['blocks']} blocks across {result['segments']} segments, "
+            f"{result['bytes']} bytes in {result['elapsed_seconds']}s ({result['mb_per_second']} MB/s); "
+            f"head {result['head']}"
+        )
+        if not result['ok']:
+            error = result['error']
+            if error['segment'] is None:
+                raise click.ClickException(f"Audit log check failed: {error['reason']}")
+            raise click.ClickException(f"Audit log chain broken at {error['segment']} offset {error['offset']}: {error['reason']}")
+        click.echo('Audit log chain intact')
+
+    @app.cli.command('check-query-plans')
+    def check_query_plans_command():
+        """Fail if any hot query's plan contains a full table scan (SQLite only)."""
+        from src.database import db
+        from src.query_plans import check_query_plans
+
+        if db.engine.dialect.name != 'sqlite':
+            raise click.ClickException('Query plan checks run against SQLite only')
+
+        results = check_query_plans(db.engine)
+        for result in results:
+            status = 'ok  ' if result['ok'] else 'SCAN'
+            note = ' (temp sort)' if result['temp_sort'] else ''
+            click.echo(f"[{status}] {result['name']}{note}: {' | '.join(result['plan'])}")
+
+        failed = [result['name'] for result in results if not result['ok']]
+        if failed:
+            raise click.ClickException(f"{len(failed)} hot queries use a full table scan: {', '.join(failed)}")
+        click.echo(f"All {len(results)} hot queries are index-backed")
@@ -1,27 +1,132 @@
 import os
+from datetime import date, datetime
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event, func
 
 # Initialize SQLAlchemy instance
 db = SQLAlchemy()
 
+# Directory for the local stores that live next to the main database (token vault, etc.)
+DATA_DIR = os.environ.get('DIGIPAY_DATA_DIR', os.path.join(os.path.dirname(__file__), 'database'))
+
+def data_path(filename):
+    """Return the path of a file in the data directory, creating the directory if needed"""
+    os.makedirs(DATA_DIR, exist_ok=True)
+    return os.path.join(DATA_DIR, filename)
+
+# SQLite storage profiles, picked with DATABASE_PROFILE. PRAGMAs are applied to every new
+# connection; pool settings apply to any backend.
+STORAGE_PROFILES = {
+    # Local development: WAL so the dev server and CLI commands can share the file
+    'dev': {
+        'pragmas': {
+            'journal_mode': 'WAL',
+            'synchronous': 'NORMAL',
+            'busy_timeout': 5000,
+            'cache_size': -16000,  # negative = KiB, so 16 MB
+            'mmap_size': 0,
+        },
+        'pool': {'pool_size': 5, 'max_overflow': 10, 'pool_timeout': 30},
+    },
+    # Many concurrent workers: WAL with NORMAL sync (commits survive a crash of the
+    # process, not necessarily of the host), memory-mapped reads and a large page cache
+    'throughput': {
+        'pragmas': {
+            'journal_mode': 'WAL',
+            'synchronous': 'NORMAL',
+            'busy_timeout': 10000,
+            'cache_size': -64000,
+            'mmap_size': 268435456,
+            'temp_store': 'MEMORY',
+            'wal_autocheckpoint': 4000,
+        },
+        'pool': {'pool_size': 20, 'max_overflow': 20, 'pool_timeout': 10},
+    },
+    # Every commit is fsynced before it returns; use when losing the last transactions
+    # on power loss is unacceptable
+    'durable': {
+        'pragmas': {
+            'journal_mode': 'WAL',
+            'synchronous': 'FULL',
+            'busy_timeout': 15000,
+            'cache_size': -16000,
+            'mmap_size': 0,
+        },
+        'pool': {'pool_size': 5, 'max_overflow': 10, 'pool_timeout': 30},
+    },
+}
+
+DEFAULT_DATABASE_URI = 'sqlite:///digipay_eu.db'
+
+def database_url_from_environment():
+    """Return DATABASE_URL, accepting the postgres:// scheme some hosts hand out"""
+    url = os.environ.get('DATABASE_URL')
+    if url and url.startswith('postgres://'):
+        url = 'postgresql://' + url[len('postgres://'):]
+    return url
+
+def day_bucket(column, dialect_name):
+    """SQL expression truncating a timestamp column to its day, for GROUP BY in rollups"""
+    if dialect_name == 'postgresql':
+        return func.date_trunc('day', column)
+    return func.date(column)
+
+def bucket_date(value):
+    """The date of a day_bucket() result (a string on SQLite, a date or datetime elsewhere)"""
+    if isinstance(value, str):
+        return date.fromisoformat(value)
+    return value.date() if isinstance(value, datetime) else value
+
+def _storage_profile(app):
+    name = app.config.get('DATABASE_PROFILE') or os.environ.get('DATABASE_PROFILE', 'dev')
+    if name not in STORAGE_PROFILES:
+        raise ValueError(f"Unknown DATABASE_PROFILE {name!r}, expected one of {', '.join(STORAGE_PROFILES)}")
+    return name, STORAGE_PROFILES[name]
+
+def _apply_pragmas(engine, pragmas):
+    """Run the profile's PRAGMAs on every new SQLite connection"""
+    @event.listens_for(engine, 'connect')
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+
 def init_db(app):
     """Initialize database with Flask app - SQLite optimized"""
     
-    # Use SQLite for maximum compatibility and simplicity
+    # Use SQLite for maximum compatibility and simplicity, unless DATABASE_URL points elsewhere
     # SQLite is perfect for payment processing platforms and scales well
-    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///digipay_eu.db'
+    app.config.setdefault('SQLALCHEMY_DATABASE_URI', DEFAULT_DATABASE_URI)
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
     
-    print("Using SQLite database - optimized for Digipay EU")
+    profile_name, profile = _storage_profile(app)
+    database_uri = app.config['SQLALCHEMY_DATABASE_URI']
+    is_sqlite = database_uri.startswith('sqlite')
+    # In-memory SQLite runs on a single shared connection, so pool sizing does not apply
+    in_memory = is_sqlite and (database_uri in ('sqlite://', 'sqlite:///:memory:') or 'mode=memory' in database_uri)
+    engine_options = {} if in_memory else dict(profile['pool'])
+    if not is_sqlite:
+        engine_options['pool_pre_ping'] = True
+    engine_options.update(app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {}))
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options
+    
+    if is_sqlite:
+        print(f"Using SQLite database ({profile_name} profile) - optimized for Digipay EU")
+    else:
+        print(f"Using database at {database_uri.split('://', 1)[0]}:// ({profile_name} pool profile)")
     
     db.init_app(app)
     
     with app.app_context():
+        if is_sqlite:
+            _apply_pragmas(db.engine, profile['pragmas'])
+        
         try:
             # Import all models to ensure they are registered
             from src.models.user import User, Merchant
-            from src.models.payment import Payment, TransactionLog
-            from src.models.billing import MerchantBilling, Invoice, InvoiceItem, FeeTransaction, RevenueReport
+            from src.models.payment import Payment, TransactionLog, TransactionLogPayload
+            from src.models.billing import MerchantBilling, Invoice, InvoiceItem, FeeTransaction, RevenueReport, InvoiceRun, InvoiceRunItem
             from src.models.auth import MerchantAuth, LoginSession
             
             # Configure registry to ensure all relationships are properly mapped
@@ -30,6 +135,12 @@ def init_db(app):
             # Create all database tables
             db.create_all()
             
+            # Bring existing databases up to date (indexes, columns added since they were created)
+            from src.migrations import run_migrations
+            applied = run_migrations(db.engine)
+            if applied:
+                print(f"Applied database migrations: {', '.join(applied)}")
+            
             # Create default admin user if it doesn't exist
             admin_user = User.query.filter_by(username='admin').first()
             if not admin_user:
@@ -0,0 +1,177 @@
+"""
+Streaming exports of payment and fee history.
+
+An export selects only the exported columns (no ORM objects, no identity map) and reads
+them through a server-side cursor in batches of EXPORT_BATCH_SIZE rows. Rows are encoded
+as NDJSON or CSV and sent in chunks of about EXPORT_CHUNK_BYTES, so memory stays flat
+however many rows the export covers.
+"""
+
+import csv
+import io
+import json
+import logging
+from datetime import datetime
+
+from flask import Response, stream_with_context
+from sqlalchemy import select
+from sqlalchemy.sql import sqltypes
+
+from src.database import db
+
+logger = logging.getLogger(__name__)
+
+EXPORT_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv'
+}
+EXPORT_BATCH_SIZE = 2000
+EXPORT_CHUNK_BYTES = 64 * 1024
+
+class InvalidExport(ValueError):
+    pass
+
+def export_format(value):
+    """Validate the ?format= argument; NDJSON unless asked otherwise"""
+    value = (value or 'ndjson').lower()
+    if value not in EXPORT_FORMATS:
+        raise InvalidExport(f"Unsupported export format: {value} (expected one of {', '.join(EXPORT_FORMATS)})")
+    return value
+
+def parse_date_filter(name, value):
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        raise InvalidExport(f"Invalid {name}: expected an ISO date or datetime")
+
+def _converter(column):
+    """
+    How to turn one column's values into what the JSON and CSV encoders accept, or None
+    when they already are; decided once per column rather than once per value
+    """
+    sql_type = column.type
+    if isinstance(sql_type, sqltypes.Enum):
+        return lambda value: value.value
+    if isinstance(sql_type, (sqltypes.DateTime, sqltypes.Date)):
+        return lambda value: value.isoformat()
+    if isinstance(sql_type, sqltypes.Numeric) and sql_type.asdecimal:
+        return float
+    return None
+
+def _row_encoder(columns):
+    """Return a function converting a result row into a list of plain values"""
+    converters = [(index, convert) for index, convert in enumerate(map(_converter, columns)) if convert]
+
+    def encode(row):
+        values = list(row)
+        for index, convert in converters:
+            if values[index] is not None:
+                values[index] = convert(values[index])
+        return values
+    return encode
+
+def payment_export_columns():
+    from src.models.payment import Payment
+
+    return [
+        Payment.id, Payment.transaction_id, Payment.merchant_id, Payment.amount_minor, Payment.currency,
+        Payment.status, Payment.payment_method, Payment.customer_email, Payment.customer_name,
+        Payment.card_last_four, Payment.card_brand, Payment.description, Payment.reference_number,
+        Payment.created_at, Payment.updated_at, Payment.processed_at, Payment.fraud_score,
+        Payment.settlement_date, Payment.settlement_amount_minor, Payment.fees_minor
+    ]
+
+def fee_transaction_export_columns():
+    from src.models.billing import FeeTransaction, MerchantBilling
+
+    return [
+        FeeTransaction.id, MerchantBilling.merchant_id, FeeTransaction.payment_transaction_id,
+        FeeTransaction.fee_type, FeeTransaction.fee_amount_minor, FeeTransaction.fee_percentage,
+        FeeTransaction.fixed_fee_minor, FeeTransaction.original_amount_minor, FeeTransaction.currency,
+        FeeTransaction.is_european_card, FeeTransaction.is_invoiced, FeeTransaction.invoice_id,
+        FeeTransaction.created_at
+    ]
+
+def payments_export_query(merchant_id=None, status=None, start=None, end=None):
+    """Payments oldest first, so an export reads like a ledger"""
+    from src.models.payment import Payment
+
+    query = select(*payment_export_columns())
+    if merchant_id:
+        query = query.where(Payment.merchant_id == merchant_id)
+    if status is not None:
+        query = query.where(Payment.status == status)
+    if start:
+        query = query.where(Payment.created_at >= start)
+    if end:
+        query = query.where(Payment.created_at <= end)
+    return query.order_by(Payment.created_at, Payment.id)
+
+def fee_transactions_export_query(merchant_id=None, fee_type=None, start=None, end=None):
+    from src.models.billing import FeeTransaction, MerchantBilling
+
+    query = select(*fee_transaction_export_columns()).join(
+        MerchantBilling, FeeTransaction.merchant_billing_id == MerchantBilling.id
+    )
+    if merchant_id:
+        query = query.where(MerchantBilling.merchant_id == merchant_id)
+    if fee_type is not None:
+        query = query.where(FeeTransaction.fee_type == fee_type)
+    if start:
+        query = query.where(FeeTransaction.created_at >= start)
+    if end:
+        query = query.where(FeeTransaction.created_at <= end)
+    return query.order_by(FeeTransaction.created_at, FeeTransaction.id)
+
+def iter_export(query, fmt):
+    """
+    Yield the encoded export in chunks of roughly EXPORT_CHUNK_BYTES.
+    Must run inside an app context; the rows are read from a server-side cursor.
+    """
+    result = db.session.execute(query.execution_options(yield_per=EXPORT_BATCH_SIZE))
+    names = list(result.keys())
+    plain = _row_encoder(query.selected_columns)
+    buffer = io.StringIO()
+
+    if fmt == 'csv':
+        writer = csv.writer(buffer, lineterminator='\n')
+        writer.writerow(names)
+
+        def write_row(row):
+            writer.writerow(plain(row))
+    else:
+        encoder = json.JSONEncoder(separators=(',', ':'))
+
+        def write_row(row):
+            buffer.write(encoder.encode(dict(zip(names, plain(row)))))
+            buffer.write('\n')
+
+    try:
+        for partition in result.partitions():
+            for row in partition:
+                write_row(row)
+                if buffer.tell() >= EXPORT_CHUNK_BYTES:
+                    yield buffer.getvalue()
+                    buffer.seek(0)
+                    buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue()
+    except Exception as e:
+        # Headers are already sent, so the client sees a truncated body rather than an error status
+        logger.error(f"Error streaming export: {str(e)}")
+        raise
+    finally:
+        result.close()
+
+def export_response(query, fmt, filename):
+    """Stream a query as an attachment; the database read happens while the body is sent"""
+    return Response(
+        stream_with_context(iter_export(query, fmt)),
+        mimetype=EXPORT_FORMATS[fmt],
+        headers={
+            'Content-Disposition': f'attachment; filename="{filename}.{fmt}"',
+            'X-Accel-Buffering': 'no'
+        }
+    )
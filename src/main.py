@@ -10,13 +10,16 @@ sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
 
 from flask import Flask, send_from_directory, request, session, jsonify
 from flask_cors import CORS
-from src.database import init_db
+from src.database import init_db, database_url_from_environment
 from src.i18n import init_babel
 from src.routes.user import user_bp
 from src.routes.payment import payment_bp
 from src.routes.merchant import merchant_bp
 from src.routes.billing import billing_bp
 from src.routes.auth import auth_bp
+from src.routes.security import security_bp
+from src.services.velocity import init_velocity_store
+from src.cli import register_commands
 
 app = Flask(__name__, static_folder=os.path.join(os.path.dirname(__file__), 'static'))
 
@@ -34,9 +37,12 @@ app.register_blueprint(payment_bp, url_prefix='/api')
 app.register_blueprint(merchant_bp, url_prefix='/api')
 app.register_blueprint(billing_bp)
 app.register_blueprint(auth_bp, url_prefix='/api')
+app.register_blueprint(security_bp, url_prefix='/api')
 
-# Database configuration
-app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("DATABASE_URL", "sqlite:///" + os.path.join(os.path.dirname(__file__), "database", "app.db"))
+# Database configuration (SQLite by default; DATABASE_URL points at another backend,
+# DATABASE_PROFILE picks the storage profile: dev, throughput or durable)
+if database_url_from_environment():
+    app.config["SQLALCHEMY_DATABASE_URI"] = database_url_from_environment()
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
 # Create database directory if it doesn't exist
@@ -45,6 +51,12 @@ os.makedirs(os.path.join(os.path.dirname(__file__), 'database'), exist_ok=True)
 # Initialize database
 init_db(app)
 
+# Warm the shared fraud velocity counters from recent payments
+init_velocity_store(app)
+
+# Operational CLI commands (flask --app src.main ...)
+register_commands(app)
+
 # Language switching endpoint
 @app.route('/api/set-language', methods=['POST'])
 def set_language():
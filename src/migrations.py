@@ -0,0 +1,269 @@
+"""
+Schema migrations for existing databases.
+
+db.create_all() creates missing tables together with their indexes, but never changes a
+table that already exists. Migrations cover those changes: each runs once per database,
+in version order, and is recorded in the schema_migrations table.
+"""
+
+import ast
+import logging
+from datetime import datetime
+from sqlalchemy import bindparam, inspect, select, text, update
+
+logger = logging.getLogger(__name__)
+
+MIGRATIONS = []
+
+def migration(version, description):
+    """Register a migration function taking a connection inside a transaction"""
+    def decorator(func):
+        MIGRATIONS.append((version, description, func))
+        return func
+    return decorator
+
+def _create_indexes(connection, table, names):
+    indexes = {index.name: index for index in table.indexes}
+    for name in names:
+        indexes[name].create(connection, checkfirst=True)
+
+def _column_names(connection, table_name):
+    return {column['name'] for column in inspect(connection).get_columns(table_name)}
+
+def _add_columns(connection, table, names):
+    existing = _column_names(connection, table.name)
+    for name in names:
+        if name in existing:
+            continue
+        column = table.columns[name]
+        column_type = column.type.compile(dialect=connection.dialect)
+        connection.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {name} {column_type}'))
+
+def _convert_to_minor(connection, table, names, currency_column=None, batch_size=10000):
+    """
+    Replace major-unit amount columns with their integer <name>_minor columns: add the new
+    columns, fill them from the old ones in batches of rows, then drop the old columns.
+    Values are converted through their decimal text, as the application read them, so a
+    stored 0.145 becomes 15 cents rather than whatever its binary float rounds to.
+    Amounts are in currency_column's currency, or the billing currency.
+    """
+    from src.money import BILLING_CURRENCY, to_minor
+
+    existing = _column_names(connection, table.name)
+    _add_columns(connection, table, [f'{name}_minor' for name in names])
+    old_names = [name for name in names if name in existing]
+    if not old_names:
+        return
+
+    selected = ', '.join(['id'] + old_names + ([currency_column] if currency_column else []))
+    fill = update(table).where(table.c.id == bindparam('row_id')).values(
+        {f'{name}_minor': bindparam(f'{name}_minor') for name in old_names}
+    )
+    last_id = 0
+    while True:
+        rows = connection.execute(
+            text(f'SELECT {selected} FROM {table.name} WHERE id > :last_id ORDER BY id LIMIT :limit'),
+            {'last_id': last_id, 'limit': batch_size}
+        ).all()
+        if not rows:
+            break
+        values = []
+        for row in rows:
+            currency = getattr(row, currency_column) if currency_column else BILLING_CURRENCY
+            converted = {f'{name}_minor': to_minor(getattr(row, name), currency) for name in old_names}
+            values.append(dict(converted, row_id=row.id))
+        connection.execute(fill, values)
+        last_id = rows[-1].id
+
+    for name in old_names:
+        connection.execute(text(f'ALTER TABLE {table.name} DROP COLUMN {name}'))
+
+@migration('0001', 'Indexes for hot payment, log, billing and auth queries')
+def add_hot_query_indexes(connection):
+    from src.models.payment import Payment, TransactionLog
+    from src.models.billing import Invoice, FeeTransaction
+    from src.models.auth import MerchantAuth
+
+    _create_indexes(connection, Payment.__table__, [
+        'ix_payments_merchant_created', 'ix_payments_created_at', 'ix_payments_status_created'
+    ])
+    _create_indexes(connection, TransactionLog.__table__, ['ix_transaction_logs_transaction_created'])
+    _create_indexes(connection, Invoice.__table__, ['ix_invoices_billing_created'])
+    _create_indexes(connection, FeeTransaction.__table__, [
+        'ix_fee_transactions_billing_created_invoiced', 'ix_fee_transactions_created_at'
+    ])
+    _create_indexes(connection, MerchantAuth.__table__, ['ix_merchant_auth_merchant_id'])
+
+@migration('0002', 'Index merchants.created_at for keyset pagination')
+def add_merchant_created_index(connection):
+    from src.models.user import Merchant
+
+    _create_indexes(connection, Merchant.__table__, ['ix_merchants_created_at'])
+
+@migration('0003', 'Per-merchant daily revenue rollups, backfilled from fee transactions')
+def add_revenue_rollups(connection):
+    from src.models.billing import RevenueReport
+
+    _add_columns(connection, RevenueReport.__table__, ['merchant_billing_id'])
+    _create_indexes(connection, RevenueReport.__table__, [
+        'ix_revenue_reports_type_merchant_period', 'ix_revenue_reports_type_period'
+    ])
+    # The rollups are backfilled by 0007, once fee amounts are in minor units
+
+@migration('0004', 'Per-merchant payment counters, backfilled from payments')
+def add_payment_counters(connection):
+    from src.models.payment import MerchantPaymentDailyStats, MerchantPaymentStats
+
+    MerchantPaymentStats.__table__.create(connection, checkfirst=True)
+    MerchantPaymentDailyStats.__table__.create(connection, checkfirst=True)
+    # The counters are backfilled by 0007, once payment amounts are in minor units
+
+@migration('0005', 'Index fee_transactions.invoice_id for set-based invoice runs')
+def add_fee_invoice_index(connection):
+    from src.models.billing import FeeTransaction
+
+    _create_indexes(connection, FeeTransaction.__table__, ['ix_fee_transactions_invoice_id'])
+
+@migration('0006', 'merchant_billing.next_billing_at, scheduled from today')
+def add_next_billing_at(connection):
+    from src.models.billing import MerchantBilling
+    from src.services.billing_service import BillingService
+
+    table = MerchantBilling.__table__
+    _add_columns(connection, table, ['next_billing_at'])
+    _create_indexes(connection, table, ['ix_merchant_billing_auto_next_billing'])
+
+    billing_service = BillingService()
+    today = datetime.utcnow().date()
+    schedule = [
+        {'row_id': row.id, 'next_billing_at': billing_service.next_billing_date(row, today)}
+        for row in connection.execute(
+            select(table.c.id, table.c.billing_cycle, table.c.billing_day).where(table.c.next_billing_at.is_(None))
+        )
+    ]
+    if schedule:
+        connection.execute(
+            update(table).where(table.c.id == bindparam('row_id')).values(next_billing_at=bindparam('next_billing_at')),
+            schedule
+        )
+
+@migration('0007', 'Money as integer minor units; rollups and payment counters rebuilt from them')
+def convert_money_to_minor_units(connection):
+    from src.models.billing import FeeTransaction, Invoice, InvoiceItem, MerchantBilling, RevenueReport
+    from src.models.payment import MerchantPaymentDailyStats, MerchantPaymentStats, Payment
+    from src.services.payment_stats import PaymentStatsService
+    from src.services.revenue_rollup import RevenueRollupService
+
+    _convert_to_minor(connection, Payment.__table__, ['amount', 'settlement_amount', 'fees'], currency_column='currency')
+    _convert_to_minor(connection, FeeTransaction.__table__, ['fee_amount', 'fixed_fee'])
+    # The original amount is in the payment's currency, which the fee row copies
+    _convert_to_minor(connection, FeeTransaction.__table__, ['original_amount'], currency_column='currency')
+    _convert_to_minor(connection, MerchantBilling.__table__, [
+        'european_card_fixed_fee', 'non_european_card_fixed_fee', 'chargeback_fee', 'refund_fee'
+    ])
+    _convert_to_minor(connection, Invoice.__table__, ['subtotal', 'tax_amount', 'total_amount'])
+    _convert_to_minor(connection, InvoiceItem.__table__, ['unit_price', 'total_price'])
+
+    # Rollups and counters are derived data: recreate them with integer columns and rebuild
+    for table in (RevenueReport.__table__, MerchantPaymentStats.__table__, MerchantPaymentDailyStats.__table__):
+        if not {column.name for column in table.columns} <= _column_names(connection, table.name):
+            table.drop(connection, checkfirst=True)
+            table.create(connection)
+    RevenueRollupService().rebuild(connection)
+    PaymentStatsService().rebuild(connection)
+
+def _parse_gateway_response(text_value):
+    """A gateway response stored as the repr of the processor's dict, or the raw text if it isn't one"""
+    try:
+        response = ast.literal_eval(text_value)
+    except (ValueError, SyntaxError, MemoryError, RecursionError):
+        return {'raw': text_value}
+    return response if isinstance(response, dict) else {'raw': text_value}
+
+@migration('0008', 'Gateway responses moved out of transaction_logs into compact transaction_log_payloads')
+def move_gateway_responses(connection, batch_size=10000):
+    from src.models.payment import TransactionLog, TransactionLogPayload
+    from src.services.gateway_payloads import PAYLOAD_VERSION, encode_payload
+
+    TransactionLogPayload.__table__.create(connection, checkfirst=True)
+    if 'gateway_response' not in _column_names(connection, TransactionLog.__tablename__):
+        return
+
+    payloads = TransactionLogPayload.__table__
+    last_id = 0
+    while True:
+        rows = connection.execute(
+            text('SELECT id, gateway_response FROM transaction_logs WHERE id > :last_id ORDER BY id LIMIT :limit'),
+            {'last_id': last_id, 'limit': batch_size}
+        ).all()
+        if not rows:
+            break
+        values = []
+        for row in rows:
+            if row.gateway_response is None:
+                continue
+            encoding, data = encode_payload(_parse_gateway_response(row.gateway_response))
+            values.append({'log_id': row.id, 'version': PAYLOAD_VERSION, 'encoding': encoding, 'data': data})
+        if values:
+            connection.execute(payloads.insert(), values)
+        last_id = rows[-1].id
+
+    connection.execute(text('ALTER TABLE transaction_logs DROP COLUMN gateway_response'))
+
+@migration('0009', 'Index transaction_logs.created_at for monthly archiving')
+def add_transaction_log_created_index(connection):
+    from src.models.payment import TransactionLog
+
+    _create_indexes(connection, TransactionLog.__table__, ['ix_transaction_logs_created_at'])
+
+@migration('0010', 'Drop revenue_reports.total_transaction_volume_minor, a sum of amounts in mixed currencies')
+def drop_rollup_transaction_volume(connection):
+    if 'total_transaction_volume_minor' in _column_names(connection, 'revenue_reports'):
+        connection.execute(text('ALTER TABLE revenue_reports DROP COLUMN total_transaction_volume_minor'))
+
+@migration('0011', 'Payment counters kept per currency; rebuilt from payments')
+def payment_counters_per_currency(connection):
+    from src.models.payment import MerchantPaymentDailyStats, MerchantPaymentStats
+    from src.services.payment_stats import PaymentStatsService
+
+    tables = (MerchantPaymentStats.__table__, MerchantPaymentDailyStats.__table__)
+    if all('currency' in _column_names(connection, table.name) for table in tables):
+        return
+    # Derived data: recreate both tables keyed by currency and rebuild them
+    for table in tables:
+        table.drop(connection, checkfirst=True)
+        table.create(connection)
+    PaymentStatsService().rebuild(connection)
+
+def applied_versions(engine):
+    with engine.begin() as connection:
+        connection.execute(text(
+            'CREATE TABLE IF NOT EXISTS schema_migrations ('
+            'version VARCHAR(20) PRIMARY KEY, description VARCHAR(255), applied_at TIMESTAMP NOT NULL)'
+        ))
+        return {row[0] for row in connection.execute(text('SELECT version FROM schema_migrations'))}
+
+def run_migrations(engine):
+    """Apply pending migrations; returns the versions applied by this call"""
+    applied = applied_versions(engine)
+    newly_applied = []
+
+    for version, description, func in sorted(MIGRATIONS, key=lambda entry: entry[0]):
+        if version in applied:
+            continue
+        try:
+            with engine.begin() as connection:
+                func(connection)
+                connection.execute(
+                    text('INSERT INTO schema_migrations (version, description, applied_at) VALUES (:v, :d, :t)'),
+                    {'v': version, 'd': description, 't': datetime.utcnow()}
+                )
+        except Exception:
+            # Another worker starting at the same time may have applied it first
+            if version in applied_versions(engine):
+                continue
+            raise
+        newly_applied.append(version)
+        logger.info(f"Applied migration {version}: {description}")
+
+    return newly_applied
@@ -8,6 +8,9 @@ from sqlalchemy.orm import relationship
 class MerchantAuth(db.Model):
     """Authentication model for merchant accounts"""
     __tablename__ = 'merchant_auth'
+    __table_args__ = (
+        db.Index('ix_merchant_auth_merchant_id', 'merchant_id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     merchant_id = db.Column(db.Integer, db.ForeignKey('merchants.id'), nullable=False)
@@ -39,7 +42,8 @@ class MerchantAuth(db.Model):
         self.email = email
         self.set_password(password)
         self.merchant_id = merchant_id
-        self.generate_api_credentials()
+        # Plaintext secret key, kept on the instance only so registration can show it once
+        self.new_api_secret = self.generate_api_credentials()
         self.verification_token = secrets.token_urlsafe(32)
     
     def set_password(self, password):
@@ -51,9 +55,10 @@ class MerchantAuth(db.Model):
         return check_password_hash(self.password_hash, password)
     
     def generate_api_credentials(self):
-        """Generate API key and secret for merchant"""
-        self.api_key = f"pk_{'live' if self.is_verified else 'test'}_{secrets.token_urlsafe(24)}"
-        self.api_secret = f"sk_{'live' if self.is_verified else 'test'}_{secrets.token_urlsafe(32)}"
+        """Generate API key and secret for merchant; only the secret's hash is stored, the secret is returned"""
+        from src.services.api_keys import generate_credentials
+        self.api_key, secret_key, self.api_secret = generate_credentials(live=bool(self.is_verified))
+        return secret_key
     
     def is_account_locked(self):
         """Check if account is locked due to failed login attempts"""
@@ -125,6 +130,8 @@ class LoginSession(db.Model):
     
     def deactivate(self):
         """Deactivate session (logout)"""
+        from src.services.session_store import get_session_store
         self.is_active = False
         db.session.commit()
+        get_session_store().invalidate(self.session_token)
 
@@ -3,7 +3,7 @@ Billing models for PayGateway merchant billing system
 """
 
 from datetime import datetime, timedelta
-from sqlalchemy import Column, Integer, String, Float, DateTime, Boolean, ForeignKey, Text, Enum
+from sqlalchemy import Column, Integer, BigInteger, String, Float, Date, DateTime, Boolean, ForeignKey, Text, Enum
 from sqlalchemy.orm import relationship
 from src.database import db
 import enum
@@ -29,22 +29,27 @@ class BillingStatus(enum.Enum):
 class MerchantBilling(db.Model):
     """Merchant billing configuration and settings"""
     __tablename__ = 'merchant_billing'
+    __table_args__ = (
+        # Automatic billing: merchants whose next invoice date has arrived
+        db.Index('ix_merchant_billing_auto_next_billing', 'auto_billing_enabled', 'next_billing_at'),
+    )
     
     id = Column(Integer, primary_key=True)
     merchant_id = Column(String(100), ForeignKey('merchants.merchant_id'), nullable=False, unique=True)
     
-    # Fee structure
+    # Fee structure; fixed fees in euro cents
     european_card_percentage = Column(Float, default=0.5)  # 0.5%
-    european_card_fixed_fee = Column(Float, default=0.10)  # €0.10
+    european_card_fixed_fee_minor = Column(BigInteger, default=10)  # €0.10
     non_european_card_percentage = Column(Float, default=2.4)  # 2.4%
-    non_european_card_fixed_fee = Column(Float, default=0.20)  # €0.20
-    chargeback_fee = Column(Float, default=9.00)  # €9.00
-    refund_fee = Column(Float, default=0.05)  # €0.05
+    non_european_card_fixed_fee_minor = Column(BigInteger, default=20)  # €0.20
+    chargeback_fee_minor = Column(BigInteger, default=900)  # €9.00
+    refund_fee_minor = Column(BigInteger, default=5)  # €0.05
     
     # Billing settings
     billing_cycle = Column(Enum(BillingCycle), default=BillingCycle.MONTHLY)
     billing_day = Column(Integer, default=1)  # Day of month for monthly billing
     auto_billing_enabled = Column(Boolean, default=True)
+    next_billing_at = Column(DateTime)  # Next automatic invoice date, advanced after each invoice
     
     # Contact and payment info
     billing_email = Column(String(255))
@@ -63,6 +68,10 @@ class MerchantBilling(db.Model):
 class Invoice(db.Model):
     """Billing invoices for merchants"""
     __tablename__ = 'invoices'
+    __table_args__ = (
+        # Merchant invoice list, newest first
+        db.Index('ix_invoices_billing_created', 'merchant_billing_id', 'created_at'),
+    )
     
     id = Column(Integer, primary_key=True)
     invoice_number = Column(String(50), unique=True, nullable=False)
@@ -72,10 +81,10 @@ class Invoice(db.Model):
     billing_period_start = Column(DateTime, nullable=False)
     billing_period_end = Column(DateTime, nullable=False)
     
-    # Amounts
-    subtotal = Column(Float, default=0.0)
-    tax_amount = Column(Float, default=0.0)
-    total_amount = Column(Float, default=0.0)
+    # Amounts in euro cents
+    subtotal_minor = Column(BigInteger, default=0)
+    tax_amount_minor = Column(BigInteger, default=0)
+    total_amount_minor = Column(BigInteger, default=0)
     
     # Status and dates
     status = Column(Enum(BillingStatus), default=BillingStatus.PENDING)
@@ -109,8 +118,8 @@ class InvoiceItem(db.Model):
     description = Column(String(255), nullable=False)
     fee_type = Column(Enum(FeeType), nullable=False)
     quantity = Column(Integer, default=1)
-    unit_price = Column(Float, nullable=False)
-    total_price = Column(Float, nullable=False)
+    unit_price_minor = Column(BigInteger, nullable=False)  # Euro cents
+    total_price_minor = Column(BigInteger, nullable=False)
     
     # Reference to original transaction if applicable
     transaction_id = Column(String(100))
@@ -124,6 +133,15 @@ class InvoiceItem(db.Model):
 class FeeTransaction(db.Model):
     """Individual fee transactions for tracking revenue"""
     __tablename__ = 'fee_transactions'
+    __table_args__ = (
+        # Merchant summaries and invoice runs: equality on the merchant, range on created_at,
+        # is_invoiced checked from the index without visiting the row
+        db.Index('ix_fee_transactions_billing_created_invoiced', 'merchant_billing_id', 'created_at', 'is_invoiced'),
+        # Platform-wide revenue summaries
+        db.Index('ix_fee_transactions_created_at', 'created_at'),
+        # Line item totals for an invoice
+        db.Index('ix_fee_transactions_invoice_id', 'invoice_id'),
+    )
     
     id = Column(Integer, primary_key=True)
     merchant_billing_id = Column(Integer, ForeignKey('merchant_billing.id'), nullable=False)
@@ -131,14 +149,14 @@ class FeeTransaction(db.Model):
     # Transaction reference
     payment_transaction_id = Column(String(100), ForeignKey('payments.transaction_id'))
     
-    # Fee details
+    # Fee details, in euro cents
     fee_type = Column(Enum(FeeType), nullable=False)
-    fee_amount = Column(Float, nullable=False)
+    fee_amount_minor = Column(BigInteger, nullable=False)
     fee_percentage = Column(Float)
-    fixed_fee = Column(Float)
+    fixed_fee_minor = Column(BigInteger)
     
     # Transaction details
-    original_amount = Column(Float)  # Original transaction amount
+    original_amount_minor = Column(BigInteger)  # Original transaction amount, in the minor unit of currency
     currency = Column(String(3), default='EUR')
     is_european_card = Column(Boolean, default=True)
     
@@ -156,25 +174,31 @@ class FeeTransaction(db.Model):
 class RevenueReport(db.Model):
     """Revenue reporting and analytics"""
     __tablename__ = 'revenue_reports'
+    __table_args__ = (
+        # One merchant's rollups for a period; platform-wide rows have no merchant_billing_id
+        db.Index('ix_revenue_reports_type_merchant_period', 'report_type', 'merchant_billing_id', 'period_start'),
+        # Every merchant's rollups for a period (active merchant counts)
+        db.Index('ix_revenue_reports_type_period', 'report_type', 'period_start'),
+    )
     
     id = Column(Integer, primary_key=True)
     
     # Report details
     report_type = Column(String(50), nullable=False)  # daily, weekly, monthly, yearly
+    merchant_billing_id = Column(Integer, ForeignKey('merchant_billing.id'))  # None for platform-wide reports
     report_date = Column(DateTime, nullable=False)
     period_start = Column(DateTime, nullable=False)
     period_end = Column(DateTime, nullable=False)
     
-    # Revenue metrics
-    total_revenue = Column(Float, default=0.0)
-    transaction_fee_revenue = Column(Float, default=0.0)
-    chargeback_fee_revenue = Column(Float, default=0.0)
-    refund_fee_revenue = Column(Float, default=0.0)
-    other_fee_revenue = Column(Float, default=0.0)
+    # Revenue metrics, in euro cents
+    total_revenue_minor = Column(BigInteger, default=0)
+    transaction_fee_revenue_minor = Column(BigInteger, default=0)
+    chargeback_fee_revenue_minor = Column(BigInteger, default=0)
+    refund_fee_revenue_minor = Column(BigInteger, default=0)
+    other_fee_revenue_minor = Column(BigInteger, default=0)
     
     # Transaction metrics
     total_transactions = Column(Integer, default=0)
-    total_transaction_volume = Column(Float, default=0.0)
     european_transactions = Column(Integer, default=0)
     non_european_transactions = Column(Integer, default=0)
     
@@ -186,6 +210,49 @@ class RevenueReport(db.Model):
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
+class InvoiceRun(db.Model):
+    """One automatic billing run; a run interrupted part way resumes where it stopped"""
+    __tablename__ = 'invoice_runs'
+    
+    id = Column(Integer, primary_key=True)
+    run_date = Column(Date, nullable=False, unique=True)
+    status = Column(String(20), nullable=False, default='running')  # running, completed, completed_with_failures
+    workers = Column(Integer, default=1)
+    
+    # Outcome
+    merchants_due = Column(Integer, default=0)
+    invoices_generated = Column(Integer, default=0)
+    failures = Column(Integer, default=0)
+    
+    # Timestamps
+    started_at = Column(DateTime, default=datetime.utcnow)
+    finished_at = Column(DateTime)
+    
+    # Relationships
+    items = relationship("InvoiceRunItem", back_populates="run")
+
+class InvoiceRunItem(db.Model):
+    """Checkpoint for one merchant in an invoice run, written in the same commit as its invoice"""
+    __tablename__ = 'invoice_run_items'
+    __table_args__ = (
+        db.UniqueConstraint('run_id', 'merchant_billing_id', name='uq_invoice_run_items_run_merchant'),
+    )
+    
+    id = Column(Integer, primary_key=True)
+    run_id = Column(Integer, ForeignKey('invoice_runs.id'), nullable=False)
+    merchant_billing_id = Column(Integer, ForeignKey('merchant_billing.id'), nullable=False)
+    
+    status = Column(String(20), nullable=False)  # invoiced, nothing_to_invoice, failed
+    invoice_id = Column(Integer, ForeignKey('invoices.id'))
+    elapsed_ms = Column(Float)
+    error = Column(Text)
+    
+    # Timestamps
+    created_at = Column(DateTime, default=datetime.utcnow)
+    
+    # Relationships
+    run = relationship("InvoiceRun", back_populates="items")
+
 # Add billing relationship to existing Merchant model
 def setup_billing_relationships():
     """Add billing relationship to existing Merchant model"""
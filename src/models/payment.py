@@ -1,4 +1,6 @@
 from src.database import db
+from src.money import from_minor, to_float
+from src.services.gateway_payloads import PAYLOAD_VERSION, decode_payload, encode_payload
 from datetime import datetime
 import uuid
 from enum import Enum
@@ -20,11 +22,18 @@ class PaymentMethod(Enum):
 
 class Payment(db.Model):
     __tablename__ = 'payments'
+    __table_args__ = (
+        # Merchant payment lists (optionally by status), newest first
+        db.Index('ix_payments_merchant_created', 'merchant_id', 'created_at'),
+        # Unfiltered and status-filtered lists, date-range scans (rescoring, velocity warm-up)
+        db.Index('ix_payments_created_at', 'created_at'),
+        db.Index('ix_payments_status_created', 'status', 'created_at'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     transaction_id = db.Column(db.String(36), unique=True, nullable=False, default=lambda: str(uuid.uuid4()))
     merchant_id = db.Column(db.String(100), db.ForeignKey('merchants.merchant_id'), nullable=False)
-    amount = db.Column(db.Numeric(10, 2), nullable=False)
+    amount_minor = db.Column(db.BigInteger, nullable=False)  # In the currency's minor unit (cents for EUR)
     currency = db.Column(db.String(3), nullable=False, default='EUR')
     status = db.Column(db.Enum(PaymentStatus), nullable=False, default=PaymentStatus.PENDING)
     payment_method = db.Column(db.Enum(PaymentMethod), nullable=False)
@@ -54,12 +63,17 @@ class Payment(db.Model):
     
     # Settlement information
     settlement_date = db.Column(db.Date)
-    settlement_amount = db.Column(db.Numeric(10, 2))
-    fees = db.Column(db.Numeric(10, 2))
+    settlement_amount_minor = db.Column(db.BigInteger)
+    fees_minor = db.Column(db.BigInteger)
     
     # Relationships
     merchant = relationship("Merchant", back_populates="payments")
     
+    @property
+    def amount(self):
+        """The amount in major units, as an exact Decimal"""
+        return from_minor(self.amount_minor, self.currency)
+    
     def __repr__(self):
         return f'<Payment {self.transaction_id}>'
     
@@ -68,7 +82,8 @@ class Payment(db.Model):
             'id': self.id,
             'transaction_id': self.transaction_id,
             'merchant_id': self.merchant_id,
-            'amount': float(self.amount),
+            'amount': to_float(self.amount_minor, self.currency),
+            'amount_minor': self.amount_minor,
             'currency': self.currency,
             'status': self.status.value,
             'payment_method': self.payment_method.value,
@@ -83,34 +98,100 @@ class Payment(db.Model):
             'processed_at': self.processed_at.isoformat() if self.processed_at else None,
             'fraud_score': self.fraud_score,
             'settlement_date': self.settlement_date.isoformat() if self.settlement_date else None,
-            'settlement_amount': float(self.settlement_amount) if self.settlement_amount else None,
-            'fees': float(self.fees) if self.fees else None
+            'settlement_amount': to_float(self.settlement_amount_minor, self.currency) if self.settlement_amount_minor else None,
+            'fees': to_float(self.fees_minor, self.currency) if self.fees_minor else None
         }
 
 class TransactionLog(db.Model):
     __tablename__ = 'transaction_logs'
+    __table_args__ = (
+        # GET /payments/<id>/logs, newest first
+        db.Index('ix_transaction_logs_transaction_created', 'transaction_id', 'created_at'),
+        # Monthly archiving: the oldest month still in the table and its rows
+        db.Index('ix_transaction_logs_created_at', 'created_at'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     transaction_id = db.Column(db.String(36), nullable=False)
     event_type = db.Column(db.String(50), nullable=False)  # created, authorized, captured, failed, etc.
     message = db.Column(db.Text)
     response_code = db.Column(db.String(10))
-    gateway_response = db.Column(db.Text)  # JSON response from payment gateway
     
     # Timestamps
     created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     
+    # Gateway response, loaded only when asked for
+    payload = relationship("TransactionLogPayload", uselist=False, cascade="all, delete-orphan")
+    
     def __repr__(self):
         return f'<TransactionLog {self.transaction_id}:{self.event_type}>'
     
-    def to_dict(self):
-        return {
+    def to_dict(self, include_gateway=False):
+        log = {
             'id': self.id,
             'transaction_id': self.transaction_id,
             'event_type': self.event_type,
             'message': self.message,
             'response_code': self.response_code,
-            'gateway_response': self.gateway_response,
             'created_at': self.created_at.isoformat() if self.created_at else None
         }
+        if include_gateway:
+            log['gateway_response'] = self.payload.response if self.payload else None
+        return log
+
+class TransactionLogPayload(db.Model):
+    """A log entry's gateway response as versioned JSON, zlib-compressed when large"""
+    __tablename__ = 'transaction_log_payloads'
+    
+    log_id = db.Column(db.Integer, db.ForeignKey('transaction_logs.id'), primary_key=True)
+    version = db.Column(db.SmallInteger, nullable=False, default=PAYLOAD_VERSION)
+    encoding = db.Column(db.String(10), nullable=False)  # json, json+zlib
+    data = db.Column(db.LargeBinary, nullable=False)
+    
+    @classmethod
+    def from_response(cls, response):
+        encoding, data = encode_payload(response)
+        return cls(version=PAYLOAD_VERSION, encoding=encoding, data=data)
+    
+    @property
+    def response(self):
+        """The decoded gateway response"""
+        return decode_payload(self.version, self.encoding, self.data)
+    
+    def __repr__(self):
+        return f'<TransactionLogPayload {self.log_id}>'
 
+
+class PaymentCounters:
+    """
+    Payment counters shared by the all-time and per-day merchant statistics. Rows are kept per
+    currency, so volumes are in that currency's minor unit; counts add up across currencies.
+    """
+    payment_count = db.Column(db.Integer, nullable=False, default=0)
+    completed_count = db.Column(db.Integer, nullable=False, default=0)
+    completed_volume_minor = db.Column(db.BigInteger, nullable=False, default=0)
+    failed_count = db.Column(db.Integer, nullable=False, default=0)
+    refunded_count = db.Column(db.Integer, nullable=False, default=0)
+    refunded_volume_minor = db.Column(db.BigInteger, nullable=False, default=0)
+
+class MerchantPaymentStats(PaymentCounters, db.Model):
+    """All-time payment counters for a merchant, kept in step with payment status changes"""
+    __tablename__ = 'merchant_payment_stats'
+    
+    merchant_id = db.Column(db.String(100), db.ForeignKey('merchants.merchant_id'), primary_key=True)
+    currency = db.Column(db.String(3), primary_key=True)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<MerchantPaymentStats {self.merchant_id} {self.currency}>'
+
+class MerchantPaymentDailyStats(PaymentCounters, db.Model):
+    """Payment counters for a merchant's payments created on one day"""
+    __tablename__ = 'merchant_payment_daily_stats'
+    
+    merchant_id = db.Column(db.String(100), db.ForeignKey('merchants.merchant_id'), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    currency = db.Column(db.String(3), primary_key=True)
+    
+    def __repr__(self):
+        return f'<MerchantPaymentDailyStats {self.merchant_id} {self.day} {self.currency}>'
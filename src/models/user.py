@@ -21,6 +21,10 @@ class User(db.Model):
 class Merchant(db.Model):
     """Merchant model for business accounts"""
     __tablename__ = 'merchants'
+    __table_args__ = (
+        # Merchant list, newest first (keyset pagination on created_at, id)
+        db.Index('ix_merchants_created_at', 'created_at'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     merchant_id = db.Column(db.String(100), unique=True, nullable=False)
@@ -0,0 +1,71 @@
+"""
+Keyset (cursor) pagination for list endpoints.
+
+Lists are ordered newest first by (created_at, id), and a page ends with an opaque cursor
+naming its last row. The next page starts strictly after that row through the
+(created_at, id) indexes, so page N costs the same as page 1 however deep it is.
+"""
+
+import base64
+import binascii
+from datetime import datetime
+from sqlalchemy import or_
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+class InvalidCursor(ValueError):
+    pass
+
+def encode_cursor(created_at, row_id):
+    raw = f"{created_at.isoformat()}|{row_id}".encode()
+    return base64.urlsafe_b64encode(raw).rstrip(b'=').decode()
+
+def decode_cursor(cursor):
+    """Return (created_at, id) from a cursor, raising InvalidCursor if it was not issued by us"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        created_at, row_id = raw.split('|')
+        return datetime.fromisoformat(created_at), int(row_id)
+    except (binascii.Error, UnicodeDecodeError, ValueError) as e:
+        raise InvalidCursor('Invalid pagination cursor') from e
+
+def page_size(value, default=DEFAULT_PAGE_SIZE):
+    """Parse a limit/per_page argument, clamped to 1..MAX_PAGE_SIZE"""
+    try:
+        size = int(value) if value is not None else default
+    except (TypeError, ValueError):
+        size = default
+    return max(1, min(size, MAX_PAGE_SIZE))
+
+def paginate(query, model, limit, cursor=None, offset=0):
+    """
+    Return (items, next_cursor) for one page of a query, newest first.
+
+    `offset` is only honoured when no cursor is given, for clients still paging by
+    offset; every page carries a next_cursor so they can switch over.
+    """
+    query = query.order_by(model.created_at.desc(), model.id.desc())
+
+    if cursor:
+        created_at, row_id = decode_cursor(cursor)
+        # The plain upper bound lets the database seek straight to the cursor in the index;
+        # the OR then skips rows at the cursor's own timestamp that were already returned
+        query = query.filter(
+            model.created_at <= created_at,
+            or_(model.created_at < created_at, model.id < row_id)
+        )
+    elif offset:
+        query = query.offset(offset)
+
+    # One extra row tells us whether there is a next page without counting
+    items = query.limit(limit + 1).all()
+    if len(items) <= limit:
+        return items, None
+
+    items = items[:limit]
+    return items, encode_cursor(items[-1].created_at, items[-1].id)
+
+def wants_total(args):
+    """Totals cost a full count, so they are only computed when asked for with ?include_total=true"""
+    return args.get('include_total', 'false').lower() == 'true'
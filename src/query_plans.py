@@ -0,0 +1,163 @@
+"""
+Query-plan checks for the hot queries behind the payment, billing and auth routes.
+
+Each query is built the way the route or service builds it, then run through SQLite's
+EXPLAIN QUERY PLAN. A plan step that scans a whole table, or walks a whole index in place
+of a table, fails the check; sorts through a temporary B-tree are reported but allowed.
+Run with: flask --app src.main check-query-plans
+"""
+
+import re
+from datetime import datetime, timedelta
+from sqlalchemy import and_, func, or_, select
+
+# "SCAN payments", "SCAN payments USING INDEX ..." (or "SCAN TABLE ..." before SQLite 3.36)
+FULL_SCAN = re.compile(r'^SCAN (TABLE )?(?!CONSTANT ROW)(?P<table>\w+)')
+
+def hot_queries():
+    """Return (name, statement) pairs for the queries that must stay index-backed"""
+    from src.models.auth import LoginSession, MerchantAuth
+    from src.models.billing import FeeTransaction, Invoice, MerchantBilling, RevenueReport
+    from src.models.payment import MerchantPaymentDailyStats, MerchantPaymentStats, Payment, PaymentStatus, TransactionLog, TransactionLogPayload
+    from src.models.user import Merchant
+
+    now = datetime.utcnow()
+    # Catch-up billing looks between the previous run date and today
+    cutoff = datetime.combine(now.date(), datetime.min.time())
+    last_run = cutoff - timedelta(days=1)
+    return [
+        ('payment by transaction_id',
+         select(Payment).where(Payment.transaction_id == 'txn')),
+        ('payments by merchant, newest first',
+         select(Payment).where(Payment.merchant_id == 'merchant')
+         .order_by(Payment.created_at.desc()).limit(50)),
+        ('payments by merchant and status, newest first',
+         select(Payment).where(Payment.merchant_id == 'merchant', Payment.status == PaymentStatus.COMPLETED)
+         .order_by(Payment.created_at.desc()).limit(50)),
+        ('payments by status, newest first',
+         select(Payment).where(Payment.status == PaymentStatus.PENDING)
+         .order_by(Payment.created_at.desc()).limit(50)),
+        ('payments page after a cursor',
+         select(Payment).where(
+             Payment.merchant_id == 'merchant', Payment.created_at <= now,
+             or_(Payment.created_at < now, Payment.id < 1)
+         ).order_by(Payment.created_at.desc(), Payment.id.desc()).limit(51)),
+        ('merchants page after a cursor',
+         select(Merchant).where(
+             Merchant.created_at <= now, or_(Merchant.created_at < now, Merchant.id < 1)
+         ).order_by(Merchant.created_at.desc(), Merchant.id.desc()).limit(51)),
+        ('payments in a date range',
+         select(Payment.id).where(Payment.created_at >= now, Payment.created_at < now)),
+        ('payments export for a merchant',
+         select(Payment.id).where(Payment.merchant_id == 'merchant', Payment.created_at >= now)
+         .order_by(Payment.created_at, Payment.id)),
+        ('fee transactions export for a merchant',
+         select(FeeTransaction.id, MerchantBilling.merchant_id)
+         .join(MerchantBilling, FeeTransaction.merchant_billing_id == MerchantBilling.id)
+         .where(MerchantBilling.merchant_id == 'merchant', FeeTransaction.created_at >= now)
+         .order_by(FeeTransaction.created_at, FeeTransaction.id)),
+        ('payment counters for a merchant',
+         select(MerchantPaymentStats.payment_count).where(MerchantPaymentStats.merchant_id == 'merchant')),
+        ('recent daily payment counters for a merchant',
+         select(func.sum(MerchantPaymentDailyStats.completed_volume_minor)).where(
+             MerchantPaymentDailyStats.merchant_id == 'merchant', MerchantPaymentDailyStats.day >= now.date()
+         )),
+        ('transaction logs for a payment',
+         select(TransactionLog).where(TransactionLog.transaction_id == 'txn')
+         .order_by(TransactionLog.created_at.desc())),
+        ('gateway response for a transaction log',
+         select(TransactionLogPayload).where(TransactionLogPayload.log_id == 1)),
+        ('oldest transaction log month to archive',
+         select(func.min(TransactionLog.created_at)).where(TransactionLog.created_at >= now)),
+        ('transaction logs in a month, for deletion after archiving',
+         select(TransactionLog.id).where(TransactionLog.created_at >= now, TransactionLog.created_at < now)
+         .order_by(TransactionLog.created_at, TransactionLog.id).limit(5000)),
+        ('merchants due for automatic billing',
+         select(MerchantBilling.id, MerchantBilling.next_billing_at).where(
+             MerchantBilling.auto_billing_enabled == True, MerchantBilling.next_billing_at <= now
+         )),
+        ('earliest missed billing date',
+         select(func.min(MerchantBilling.next_billing_at)).where(
+             MerchantBilling.auto_billing_enabled == True,
+             MerchantBilling.next_billing_at <= cutoff, MerchantBilling.next_billing_at > last_run
+         )),
+        ('merchant billing by merchant',
+         select(MerchantBilling).where(MerchantBilling.merchant_id == 'merchant')),
+        ('merchant revenue summary',
+         select(FeeTransaction).where(and_(
+             FeeTransaction.merchant_billing_id == 1,
+             FeeTransaction.created_at >= now, FeeTransaction.created_at <= now
+         ))),
+        ('uninvoiced fees for an invoice run',
+         select(FeeTransaction).where(and_(
+             FeeTransaction.merchant_billing_id == 1,
+             FeeTransaction.created_at >= now, FeeTransaction.created_at <= now,
+             FeeTransaction.is_invoiced == False
+         ))),
+        ('invoice line items from claimed fees',
+         select(FeeTransaction.fee_type, func.count(FeeTransaction.id), func.sum(FeeTransaction.fee_amount_minor))
+         .where(FeeTransaction.invoice_id == 1).group_by(FeeTransaction.fee_type)),
+        ('fee transactions by merchant, newest first',
+         select(FeeTransaction).where(FeeTransaction.merchant_billing_id == 1)
+         .order_by(FeeTransaction.created_at.desc()).limit(50)),
+        ('platform revenue summary',
+         select(FeeTransaction).where(FeeTransaction.created_at >= now, FeeTransaction.created_at <= now)),
+        ('merchant revenue rollups for a period',
+         select(RevenueReport.total_revenue_minor).where(
+             RevenueReport.report_type == 'daily', RevenueReport.merchant_billing_id == 1,
+             RevenueReport.period_start >= now, RevenueReport.period_start < now
+         )),
+        ('platform revenue rollups for a period',
+         select(RevenueReport.total_revenue_minor).where(
+             RevenueReport.report_type == 'daily', RevenueReport.merchant_billing_id.is_(None),
+             RevenueReport.period_start >= now, RevenueReport.period_start < now
+         )),
+        ('rollup row for a merchant day',
+         select(RevenueReport.id).where(
+             RevenueReport.report_type == 'daily', RevenueReport.merchant_billing_id == 1,
+             RevenueReport.period_start == now
+         )),
+        ('active merchants for a period',
+         select(RevenueReport.merchant_billing_id).distinct().where(
+             RevenueReport.report_type == 'daily', RevenueReport.merchant_billing_id.isnot(None),
+             RevenueReport.period_start >= now, RevenueReport.period_start < now
+         )),
+        ('invoices by merchant, newest first',
+         select(Invoice).where(Invoice.merchant_billing_id == 1).order_by(Invoice.created_at.desc()).limit(20)),
+        ('merchant auth by api key',
+         select(MerchantAuth.id).where(MerchantAuth.api_key == 'pk_test_id')),
+        ('merchant auth by merchant',
+         select(MerchantAuth).where(MerchantAuth.merchant_id == 1)),
+        ('login session with merchant',
+         select(LoginSession.id, MerchantAuth.api_key, Merchant.merchant_id)
+         .join(MerchantAuth, LoginSession.merchant_auth_id == MerchantAuth.id)
+         .join(Merchant, MerchantAuth.merchant_id == Merchant.id)
+         .where(LoginSession.session_token == 'token', LoginSession.is_active == True)),
+    ]
+
+def explain(connection, statement):
+    """Return the EXPLAIN QUERY PLAN detail lines for a statement"""
+    compiled = statement.compile(dialect=connection.dialect)
+    # Plans do not depend on the bound values, so placeholders are bound to NULL
+    params = tuple(None for _ in compiled.positiontup or ())
+    rows = connection.exec_driver_sql('EXPLAIN QUERY PLAN ' + compiled.string, params).fetchall()
+    return [row[-1] for row in rows]
+
+def check_query_plans(engine):
+    """
+    Explain every hot query; returns a list of dicts with the plan and any full scans.
+    Only meaningful on SQLite.
+    """
+    results = []
+    with engine.connect() as connection:
+        for name, statement in hot_queries():
+            plan = explain(connection, statement)
+            scans = [step for step in plan if FULL_SCAN.match(step)]
+            results.append({
+                'name': name,
+                'plan': plan,
+                'full_scans': scans,
+                'temp_sort': any('TEMP B-TREE' in step for step in plan),
+                'ok': not scans
+            })
+    return results
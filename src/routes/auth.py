@@ -3,11 +3,18 @@ from src.database import db
 from src.models.user import Merchant
 from src.models.auth import MerchantAuth, LoginSession
 from src.models.payment import Payment
-from datetime import datetime, timedelta
+from src.services.security import SecurityService
+from src.services.session_store import get_session_store
+from src.services.payment_stats import PaymentStatsService
+from src.pagination import InvalidCursor, page_size, paginate, wants_total
+from src.money import to_float
+from datetime import datetime
 import secrets
 import re
 
 auth_bp = Blueprint('auth', __name__)
+security_service = SecurityService()
+payment_stats = PaymentStatsService()
 
 def validate_email(email):
     """Validate email format"""
@@ -26,6 +33,12 @@ def validate_password(password):
         return False, "Password must contain at least one number"
     return True, "Password is valid"
 
+def current_session():
+    """Resolve the logged-in session, or return None if it is missing or expired"""
+    if not session.get('is_authenticated'):
+        return None
+    return get_session_store().resolve(session.get('session_token'))
+
 @auth_bp.route('/register', methods=['POST'])
 def register_merchant():
     """Register a new merchant account"""
@@ -82,6 +95,7 @@ def register_merchant():
             'merchant_id': merchant.merchant_id,
             'email': merchant_auth.email,
             'api_key': merchant_auth.api_key,
+            'api_secret': merchant_auth.new_api_secret,  # Shown only once
             'verification_required': True
         }), 201
         
@@ -135,12 +149,21 @@ def login_merchant():
         session['session_token'] = session_record.session_token
         session['is_authenticated'] = True
         
+        # Bearer token for API calls (Authorization: Bearer ...)
+        access_token = security_service.generate_jwt_token(
+            str(merchant_auth.id), role='merchant',
+            additional_claims={'merchant_id': merchant_auth.merchant.merchant_id}
+        )
+        
         return jsonify({
             'message': 'Login successful',
             'merchant_id': merchant_auth.merchant.merchant_id,
             'business_name': merchant_auth.merchant.business_name,
             'session_token': session_record.session_token,
-            'api_key': merchant_auth.api_key
+            'api_key': merchant_auth.api_key,
+            'access_token': access_token,
+            'token_type': 'Bearer',
+            'expires_in': security_service.token_expiry_hours * 3600
         }), 200
         
     except Exception as e:
@@ -173,30 +196,24 @@ def get_merchant_profile():
         if not session.get('is_authenticated'):
             return jsonify({'error': 'Not authenticated'}), 401
         
-        session_token = session.get('session_token')
-        session_record = LoginSession.query.filter_by(
-            session_token=session_token,
-            is_active=True
-        ).first()
-        
-        if not session_record or session_record.is_expired():
+        session_record = current_session()
+        if not session_record:
             return jsonify({'error': 'Session expired'}), 401
         
-        merchant_auth = session_record.merchant_auth
-        merchant = merchant_auth.merchant
+        merchant = session_record['merchant']
         
         return jsonify({
-            'merchant_id': merchant.merchant_id,
-            'business_name': merchant.business_name,
-            'contact_email': merchant.contact_email,
-            'contact_phone': merchant.contact_phone,
-            'business_address': merchant.business_address,
-            'business_type': merchant.business_type,
-            'website_url': merchant.website_url,
-            'status': merchant.status,
-            'is_verified': merchant.is_verified,
-            'api_key': merchant_auth.api_key,
-            'created_at': merchant.created_at.isoformat()
+            'merchant_id': merchant['merchant_id'],
+            'business_name': merchant['business_name'],
+            'contact_email': merchant['contact_email'],
+            'contact_phone': merchant['contact_phone'],
+            'business_address': merchant['business_address'],
+            'business_type': merchant['business_type'],
+            'website_url': merchant['website_url'],
+            'status': merchant['status'],
+            'is_verified': merchant['is_verified'],
+            'api_key': session_record['api_key'],
+            'created_at': merchant['created_at'].isoformat()
         }), 200
         
     except Exception as e:
@@ -209,26 +226,22 @@ def get_merchant_transactions():
         if not session.get('is_authenticated'):
             return jsonify({'error': 'Not authenticated'}), 401
         
-        session_token = session.get('session_token')
-        session_record = LoginSession.query.filter_by(
-            session_token=session_token,
-            is_active=True
-        ).first()
-        
-        if not session_record or session_record.is_expired():
+        session_record = current_session()
+        if not session_record:
             return jsonify({'error': 'Session expired'}), 401
         
-        merchant = session_record.merchant_auth.merchant
+        merchant = session_record['merchant']
         
-        # Get query parameters
+        # Get query parameters (cursor from the previous page's next_cursor; page is the legacy offset form)
         page = request.args.get('page', 1, type=int)
-        per_page = request.args.get('per_page', 20, type=int)
+        per_page = page_size(request.args.get('per_page'), default=20)
+        cursor = request.args.get('cursor')
         status = request.args.get('status')
         start_date = request.args.get('start_date')
         end_date = request.args.get('end_date')
         
         # Build query
-        query = Payment.query.filter_by(merchant_id=merchant.merchant_id)
+        query = Payment.query.filter_by(merchant_id=merchant['merchant_id'])
         
         if status:
             query = query.filter_by(status=status)
@@ -241,24 +254,25 @@ def get_merchant_transactions():
             end_date = datetime.fromisoformat(end_date)
             query = query.filter(Payment.created_at <= end_date)
         
-        # Order by most recent first
-        query = query.order_by(Payment.created_at.desc())
+        # Most recent first, one page past the cursor; totals only on request
+        total = query.count() if wants_total(request.args) else None
+        transactions, next_cursor = paginate(query, Payment, per_page, cursor, (page - 1) * per_page)
         
-        # Paginate
-        transactions = query.paginate(
-            page=page,
-            per_page=per_page,
-            error_out=False
-        )
-        
-        return jsonify({
-            'transactions': [transaction.to_dict() for transaction in transactions.items],
-            'total': transactions.total,
-            'pages': transactions.pages,
-            'current_page': page,
+        response = {
+            'transactions': [transaction.to_dict() for transaction in transactions],
+            'next_cursor': next_cursor,
             'per_page': per_page
-        }), 200
+        }
+        if not cursor:
+            response['current_page'] = page
+        if total is not None:
+            response['total'] = total
+            response['pages'] = (total + per_page - 1) // per_page
+        
+        return jsonify(response), 200
         
+    except InvalidCursor as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': 'Failed to get transactions', 'details': str(e)}), 500
 
@@ -269,46 +283,33 @@ def get_merchant_dashboard_stats():
         if not session.get('is_authenticated'):
             return jsonify({'error': 'Not authenticated'}), 401
         
-        session_token = session.get('session_token')
-        session_record = LoginSession.query.filter_by(
-            session_token=session_token,
-            is_active=True
-        ).first()
-        
-        if not session_record or session_record.is_expired():
+        session_record = current_session()
+        if not session_record:
             return jsonify({'error': 'Session expired'}), 401
         
-        merchant = session_record.merchant_auth.merchant
-        
-        # Calculate date ranges
-        today = datetime.utcnow().date()
-        last_30_days = today - timedelta(days=30)
-        last_7_days = today - timedelta(days=7)
-        
-        # Get transactions for this merchant
-        all_transactions = Payment.query.filter_by(merchant_id=merchant.merchant_id)
-        recent_transactions = all_transactions.filter(Payment.created_at >= last_30_days)
-        
-        # Calculate statistics
-        total_transactions = all_transactions.count()
-        total_revenue = sum([t.amount for t in all_transactions if t.status == 'completed'])
+        merchant = session_record['merchant']
         
-        recent_count = recent_transactions.count()
-        recent_revenue = sum([t.amount for t in recent_transactions if t.status == 'completed'])
+        # Counters are kept up to date as payments change status, so this is two indexed reads
+        totals, recent = payment_stats.dashboard(db.session, merchant['merchant_id'], days=30)
         
+        total_transactions = totals['payment_count']
         success_rate = 0
         if total_transactions > 0:
-            successful = all_transactions.filter_by(status='completed').count()
-            success_rate = (successful / total_transactions) * 100
+            success_rate = (totals['completed_count'] / total_transactions) * 100
         
+        # Revenue is reported per currency ({"EUR": 26.0, "JPY": 5}), each in its own unit
         return jsonify({
             'total_transactions': total_transactions,
-            'total_revenue': total_revenue,
-            'recent_transactions_30d': recent_count,
-            'recent_revenue_30d': recent_revenue,
+            'total_revenue': {
+                currency: to_float(minor, currency) for currency, minor in totals['completed_volume_minor'].items()
+            },
+            'recent_transactions_30d': recent['payment_count'],
+            'recent_revenue_30d': {
+                currency: to_float(minor, currency) for currency, minor in recent['completed_volume_minor'].items()
+            },
             'success_rate': round(success_rate, 1),
-            'merchant_status': merchant.status,
-            'is_verified': merchant.is_verified
+            'merchant_status': merchant['status'],
+            'is_verified': merchant['is_verified']
         }), 200
         
     except Exception as e:
@@ -5,14 +5,38 @@ Billing API routes for PayGateway
 from flask import Blueprint, request, jsonify
 from datetime import datetime, timedelta
 from src.services.billing_service import BillingService
-from src.models.billing import MerchantBilling, Invoice, FeeTransaction, BillingStatus
+from src.models.billing import MerchantBilling, Invoice, FeeTransaction, BillingStatus, FeeType
 from src.database import db
-from src.services.security import require_auth
+from src.money import to_float, to_minor
+from src.services.pricing import amounts_to_cents, get_pricing_table
+from src.services.security import authorized_merchant_id, require_auth
+from src.pagination import InvalidCursor, page_size, paginate, wants_total
+from src.exports import InvalidExport, export_format, export_response, fee_transactions_export_query, parse_date_filter
+import numpy as np
 import traceback
+import logging
 
 billing_bp = Blueprint('billing', __name__)
+logger = logging.getLogger(__name__)
 billing_service = BillingService()
 
+# Largest batch accepted by the fee quote endpoint
+MAX_FEE_QUOTES = 10000
+
+def _pagination_info(page, per_page, cursor, next_cursor, total=None):
+    """Pagination block for list responses; total and pages only when include_total=true was asked for"""
+    info = {
+        'per_page': per_page,
+        'next_cursor': next_cursor,
+        'has_more': next_cursor is not None
+    }
+    if not cursor:
+        info['page'] = page
+    if total is not None:
+        info['total'] = total
+        info['pages'] = (total + per_page - 1) // per_page
+    return info
+
 @billing_bp.route('/api/billing/merchants/<merchant_id>/config', methods=['GET'])
 @require_auth
 def get_merchant_billing_config(merchant_id):
@@ -25,11 +49,11 @@ def get_merchant_billing_config(merchant_id):
             'data': {
                 'merchant_id': merchant_billing.merchant_id,
                 'european_card_percentage': merchant_billing.european_card_percentage,
-                'european_card_fixed_fee': merchant_billing.european_card_fixed_fee,
+                'european_card_fixed_fee': to_float(merchant_billing.european_card_fixed_fee_minor),
                 'non_european_card_percentage': merchant_billing.non_european_card_percentage,
-                'non_european_card_fixed_fee': merchant_billing.non_european_card_fixed_fee,
-                'chargeback_fee': merchant_billing.chargeback_fee,
-                'refund_fee': merchant_billing.refund_fee,
+                'non_european_card_fixed_fee': to_float(merchant_billing.non_european_card_fixed_fee_minor),
+                'chargeback_fee': to_float(merchant_billing.chargeback_fee_minor),
+                'refund_fee': to_float(merchant_billing.refund_fee_minor),
                 'billing_cycle': merchant_billing.billing_cycle.value,
                 'billing_day': merchant_billing.billing_day,
                 'auto_billing_enabled': merchant_billing.auto_billing_enabled,
@@ -56,15 +80,15 @@ def update_merchant_billing_config(merchant_id):
         if 'european_card_percentage' in data:
             merchant_billing.european_card_percentage = data['european_card_percentage']
         if 'european_card_fixed_fee' in data:
-            merchant_billing.european_card_fixed_fee = data['european_card_fixed_fee']
+            merchant_billing.european_card_fixed_fee_minor = to_minor(data['european_card_fixed_fee'])
         if 'non_european_card_percentage' in data:
             merchant_billing.non_european_card_percentage = data['non_european_card_percentage']
         if 'non_european_card_fixed_fee' in data:
-            merchant_billing.non_european_card_fixed_fee = data['non_european_card_fixed_fee']
+            merchant_billing.non_european_card_fixed_fee_minor = to_minor(data['non_european_card_fixed_fee'])
         if 'chargeback_fee' in data:
-            merchant_billing.chargeback_fee = data['chargeback_fee']
+            merchant_billing.chargeback_fee_minor = to_minor(data['chargeback_fee'])
         if 'refund_fee' in data:
-            merchant_billing.refund_fee = data['refund_fee']
+            merchant_billing.refund_fee_minor = to_minor(data['refund_fee'])
         if 'billing_email' in data:
             merchant_billing.billing_email = data['billing_email']
         if 'billing_address' in data:
@@ -72,15 +96,25 @@ def update_merchant_billing_config(merchant_id):
         if 'payment_method' in data:
             merchant_billing.payment_method = data['payment_method']
         if 'auto_billing_enabled' in data:
+            if data['auto_billing_enabled'] and not merchant_billing.auto_billing_enabled:
+                # Billing resumes from today rather than catching up the days it was off
+                merchant_billing.next_billing_at = billing_service.next_billing_date(merchant_billing, datetime.utcnow().date())
             merchant_billing.auto_billing_enabled = data['auto_billing_enabled']
         
         merchant_billing.updated_at = datetime.utcnow()
         db.session.commit()
+        get_pricing_table().invalidate(merchant_id)
         
         return jsonify({
             'success': True,
             'message': 'Billing configuration updated successfully'
         })
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
     except Exception as e:
         db.session.rollback()
         return jsonify({
@@ -165,9 +199,10 @@ def get_merchant_invoices(merchant_id):
     try:
         merchant_billing = billing_service.get_or_create_merchant_billing(merchant_id)
         
-        # Get pagination parameters
+        # Get pagination parameters (cursor from the previous page's next_cursor; page is the legacy offset form)
+        per_page = page_size(request.args.get('per_page'), default=10)
         page = int(request.args.get('page', 1))
-        per_page = int(request.args.get('per_page', 10))
+        cursor = request.args.get('cursor')
         status = request.args.get('status')
         
         # Build query
@@ -176,12 +211,9 @@ def get_merchant_invoices(merchant_id):
         if status:
             query = query.filter(Invoice.status == BillingStatus(status))
         
-        # Order by most recent first
-        query = query.order_by(Invoice.created_at.desc())
-        
-        # Paginate
-        invoices = query.offset((page - 1) * per_page).limit(per_page).all()
-        total = query.count()
+        # Most recent first, one page past the cursor
+        total = query.count() if wants_total(request.args) else None
+        invoices, next_cursor = paginate(query, Invoice, per_page, cursor, (page - 1) * per_page)
         
         invoice_data = []
         for invoice in invoices:
@@ -190,9 +222,9 @@ def get_merchant_invoices(merchant_id):
                 'invoice_number': invoice.invoice_number,
                 'billing_period_start': invoice.billing_period_start.isoformat(),
                 'billing_period_end': invoice.billing_period_end.isoformat(),
-                'subtotal': invoice.subtotal,
-                'tax_amount': invoice.tax_amount,
-                'total_amount': invoice.total_amount,
+                'subtotal': to_float(invoice.subtotal_minor),
+                'tax_amount': to_float(invoice.tax_amount_minor),
+                'total_amount': to_float(invoice.total_amount_minor),
                 'status': invoice.status.value,
                 'issued_date': invoice.issued_date.isoformat(),
                 'due_date': invoice.due_date.isoformat() if invoice.due_date else None,
@@ -205,14 +237,14 @@ def get_merchant_invoices(merchant_id):
             'success': True,
             'data': {
                 'invoices': invoice_data,
-                'pagination': {
-                    'page': page,
-                    'per_page': per_page,
-                    'total': total,
-                    'pages': (total + per_page - 1) // per_page
-                }
+                'pagination': _pagination_info(page, per_page, cursor, next_cursor, total)
             }
         })
+    except InvalidCursor as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
     except Exception as e:
         return jsonify({
             'success': False,
@@ -240,8 +272,8 @@ def get_invoice_details(invoice_id):
                 'description': item.description,
                 'fee_type': item.fee_type.value,
                 'quantity': item.quantity,
-                'unit_price': item.unit_price,
-                'total_price': item.total_price,
+                'unit_price': to_float(item.unit_price_minor),
+                'total_price': to_float(item.total_price_minor),
                 'transaction_id': item.transaction_id
             })
         
@@ -251,9 +283,9 @@ def get_invoice_details(invoice_id):
             'merchant_id': invoice.merchant_billing.merchant_id,
             'billing_period_start': invoice.billing_period_start.isoformat(),
             'billing_period_end': invoice.billing_period_end.isoformat(),
-            'subtotal': invoice.subtotal,
-            'tax_amount': invoice.tax_amount,
-            'total_amount': invoice.total_amount,
+            'subtotal': to_float(invoice.subtotal_minor),
+            'tax_amount': to_float(invoice.tax_amount_minor),
+            'total_amount': to_float(invoice.total_amount_minor),
             'status': invoice.status.value,
             'issued_date': invoice.issued_date.isoformat(),
             'due_date': invoice.due_date.isoformat() if invoice.due_date else None,
@@ -330,7 +362,7 @@ def generate_merchant_invoice(merchant_id):
             'data': {
                 'invoice_id': invoice.id,
                 'invoice_number': invoice.invoice_number,
-                'total_amount': invoice.total_amount
+                'total_amount': to_float(invoice.total_amount_minor)
             }
         })
     except Exception as e:
@@ -347,13 +379,17 @@ def calculate_fee():
         data = request.get_json()
         amount = data['amount']
         is_european_card = data.get('is_european_card', True)
-        merchant_id = data.get('merchant_id')
         
-        merchant_billing = None
-        if merchant_id:
-            merchant_billing = billing_service.get_or_create_merchant_billing(merchant_id)
+        # Quotes use the caller's own rates; another merchant's negotiated rates are not readable
+        merchant_id = authorized_merchant_id(data.get('merchant_id'))
+        if data.get('merchant_id') is not None and not merchant_id:
+            return jsonify({
+                'success': False,
+                'error': 'Forbidden'
+            }), 403
         
-        fee = billing_service.calculate_transaction_fee(amount, is_european_card, merchant_billing)
+        # Quotes come from the cached pricing table; they never create or read a billing row per call
+        fee = get_pricing_table().get(merchant_id).fee(amount, is_european_card)
         
         return jsonify({
             'success': True,
@@ -370,6 +406,60 @@ def calculate_fee():
             'error': str(e)
         }), 500
 
+@billing_bp.route('/api/billing/fee-calculator/batch', methods=['POST'])
+@require_auth
+def calculate_fees_batch():
+    """Quote fees for many amounts at once, e.g. every line of a cart"""
+    try:
+        data = request.get_json(silent=True) or {}
+        amounts = data.get('amounts')
+        is_european_card = data.get('is_european_card', True)
+        
+        merchant_id = authorized_merchant_id(data.get('merchant_id'))
+        if data.get('merchant_id') is not None and not merchant_id:
+            return jsonify({'success': False, 'error': 'Forbidden'}), 403
+        if not isinstance(amounts, list) or not amounts:
+            return jsonify({'success': False, 'error': 'amounts must be a non-empty list'}), 400
+        if len(amounts) > MAX_FEE_QUOTES:
+            return jsonify({'success': False, 'error': f'At most {MAX_FEE_QUOTES} amounts per request'}), 400
+        if isinstance(is_european_card, list):
+            if len(is_european_card) != len(amounts) or not all(isinstance(flag, bool) for flag in is_european_card):
+                return jsonify({'success': False, 'error': 'is_european_card must be a boolean or one boolean per amount'}), 400
+            european = np.array(is_european_card, dtype=bool)
+        elif isinstance(is_european_card, bool):
+            european = np.full(len(amounts), is_european_card)
+        else:
+            return jsonify({'success': False, 'error': 'is_european_card must be a boolean or one boolean per amount'}), 400
+        
+        try:
+            amount_cents = amounts_to_cents(amounts)
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+        
+        fee_cents = get_pricing_table().get(merchant_id).quote_cents(amount_cents, european)
+        net_cents = amount_cents - fee_cents
+        
+        quotes = [
+            {'amount': amount, 'fee': to_float(fee), 'net_amount': to_float(net), 'is_european_card': flag}
+            for amount, fee, net, flag in zip(amounts, fee_cents.tolist(), net_cents.tolist(), european.tolist())
+        ]
+        
+        return jsonify({
+            'success': True,
+            'data': {
+                'quotes': quotes,
+                'count': len(quotes),
+                'total_amount': to_float(amount_cents.sum()),
+                'total_fee': to_float(fee_cents.sum()),
+                'total_net_amount': to_float(net_cents.sum())
+            }
+        })
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
 @billing_bp.route('/api/billing/fee-transactions', methods=['GET'])
 @require_auth
 def get_fee_transactions():
@@ -380,8 +470,9 @@ def get_fee_transactions():
         fee_type = request.args.get('fee_type')
         start_date = request.args.get('start_date')
         end_date = request.args.get('end_date')
+        per_page = page_size(request.args.get('per_page'), default=20)
         page = int(request.args.get('page', 1))
-        per_page = int(request.args.get('per_page', 20))
+        cursor = request.args.get('cursor')
         
         # Build query
         query = db.session.query(FeeTransaction)
@@ -399,12 +490,9 @@ def get_fee_transactions():
         if end_date:
             query = query.filter(FeeTransaction.created_at <= datetime.fromisoformat(end_date))
         
-        # Order by most recent first
-        query = query.order_by(FeeTransaction.created_at.desc())
-        
-        # Paginate
-        fee_transactions = query.offset((page - 1) * per_page).limit(per_page).all()
-        total = query.count()
+        # Most recent first, one page past the cursor
+        total = query.count() if wants_total(request.args) else None
+        fee_transactions, next_cursor = paginate(query, FeeTransaction, per_page, cursor, (page - 1) * per_page)
         
         transaction_data = []
         for fee_tx in fee_transactions:
@@ -413,10 +501,10 @@ def get_fee_transactions():
                 'merchant_id': fee_tx.merchant_billing.merchant_id,
                 'payment_transaction_id': fee_tx.payment_transaction_id,
                 'fee_type': fee_tx.fee_type.value,
-                'fee_amount': fee_tx.fee_amount,
+                'fee_amount': to_float(fee_tx.fee_amount_minor),
                 'fee_percentage': fee_tx.fee_percentage,
-                'fixed_fee': fee_tx.fixed_fee,
-                'original_amount': fee_tx.original_amount,
+                'fixed_fee': to_float(fee_tx.fixed_fee_minor),
+                'original_amount': to_float(fee_tx.original_amount_minor, fee_tx.currency),
                 'currency': fee_tx.currency,
                 'is_european_card': fee_tx.is_european_card,
                 'is_invoiced': fee_tx.is_invoiced,
@@ -428,17 +516,55 @@ def get_fee_transactions():
             'success': True,
             'data': {
                 'fee_transactions': transaction_data,
-                'pagination': {
-                    'page': page,
-                    'per_page': per_page,
-                    'total': total,
-                    'pages': (total + per_page - 1) // per_page
-                }
+                'pagination': _pagination_info(page, per_page, cursor, next_cursor, total)
             }
         })
+    except InvalidCursor as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
     except Exception as e:
         return jsonify({
             'success': False,
             'error': str(e)
         }), 500
 
+@billing_bp.route('/api/billing/fee-transactions/export', methods=['GET'])
+@require_auth
+def export_fee_transactions():
+    """Stream the authenticated merchant's fee transactions oldest first as NDJSON (default) or CSV (?format=csv)"""
+    try:
+        merchant_id = authorized_merchant_id(request.args.get('merchant_id'))
+        if not merchant_id:
+            return jsonify({
+                'success': False,
+                'error': 'Forbidden'
+            }), 403
+        
+        fmt = export_format(request.args.get('format'))
+        fee_type = request.args.get('fee_type')
+        try:
+            fee_type = FeeType(fee_type) if fee_type else None
+        except ValueError:
+            raise InvalidExport(f"Invalid fee_type: {fee_type}")
+        
+        query = fee_transactions_export_query(
+            merchant_id=merchant_id,
+            fee_type=fee_type,
+            start=parse_date_filter('start_date', request.args.get('start_date')),
+            end=parse_date_filter('end_date', request.args.get('end_date'))
+        )
+        
+        return export_response(query, fmt, 'fee_transactions')
+    except InvalidExport as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+    except Exception as e:
+        logger.error(f"Error exporting fee transactions: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': 'Internal server error'
+        }), 500
@@ -1,6 +1,8 @@
 from flask import Blueprint, jsonify, request
 from src.database import db
 from src.models.user import Merchant
+from src.pagination import InvalidCursor, page_size, paginate
+from src.services.api_keys import get_api_key_authenticator
 import uuid
 import hashlib
 import secrets
@@ -76,13 +78,14 @@ def get_merchant(merchant_id):
 @merchant_bp.route('/merchants', methods=['GET'])
 def get_merchants():
     """
-    Get all merchants with optional filtering
+    Get all merchants with optional filtering, newest first
+    The next page's cursor is returned in the X-Next-Cursor header (absent on the last page)
     """
     try:
         is_active = request.args.get('is_active')
         is_verified = request.args.get('is_verified')
         country = request.args.get('country')
-        limit = int(request.args.get('limit', 50))
+        limit = page_size(request.args.get('limit'))
         offset = int(request.args.get('offset', 0))
         
         query = Merchant.query
@@ -96,10 +99,13 @@ def get_merchants():
         if country:
             query = query.filter_by(country=country.upper())
         
-        merchants = query.order_by(Merchant.created_at.desc()).offset(offset).limit(limit).all()
+        merchants, next_cursor = paginate(query, Merchant, limit, request.args.get('cursor'), offset)
         
-        return jsonify([merchant.to_dict() for merchant in merchants]), 200
+        headers = {'X-Next-Cursor': next_cursor} if next_cursor else {}
+        return jsonify([merchant.to_dict() for merchant in merchants]), 200, headers
         
+    except InvalidCursor as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         logger.error(f"Error retrieving merchants: {str(e)}")
         return jsonify({'error': 'Internal server error'}), 500
@@ -186,19 +192,21 @@ def regenerate_api_keys(merchant_id):
         if not merchant:
             return jsonify({'error': 'Merchant not found'}), 404
         
-        # Generate new API credentials
-        api_key = f"pk_live_{secrets.token_urlsafe(32)}"
-        api_secret = f"sk_live_{secrets.token_urlsafe(32)}"
+        auth_record = merchant.auth_records[0] if merchant.auth_records else None
+        if not auth_record:
+            return jsonify({'error': 'Merchant has no API credentials'}), 404
         
-        merchant.api_key = api_key
-        merchant.api_secret = hashlib.sha256(api_secret.encode()).hexdigest()
+        # Generate new API credentials; the old key stops working immediately in this worker
+        old_api_key = auth_record.api_key
+        api_secret = auth_record.generate_api_credentials()
         
         db.session.commit()
+        get_api_key_authenticator().invalidate(old_api_key)
         
         # Return new credentials (api_secret shown only once)
         return jsonify({
             'merchant_id': merchant.merchant_id,
-            'api_key': api_key,
+            'api_key': auth_record.api_key,
             'api_secret': api_secret,
             'message': 'API keys regenerated successfully. Please store the secret key securely.'
         }), 200
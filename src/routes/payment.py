@@ -1,15 +1,21 @@
 from flask import Blueprint, jsonify, request
 from flask_babel import gettext, ngettext
 from src.database import db
-from src.models.payment import Payment, TransactionLog, PaymentStatus, PaymentMethod
+from src.models.payment import Payment, TransactionLog, TransactionLogPayload, PaymentStatus, PaymentMethod
 from src.models.user import Merchant
 from src.services.payment_processor import PaymentProcessor
 from src.services.fraud_detection import FraudDetectionService
 from src.services.encryption import EncryptionService
 from src.services.compliance import ComplianceService
-from src.services.security import SecurityService, require_auth, rate_limit
+from src.services.payment_stats import PaymentStatsService
+from src.services.log_archive import get_transaction_log_archive
+from src.services.security import SecurityService, authorized_merchant_id, require_auth, rate_limit
+from src.pagination import InvalidCursor, page_size, paginate
+from src.money import UnsupportedCurrency, currency_exponent, from_minor, to_minor
+from src.exports import InvalidExport, export_format, export_response, parse_date_filter, payments_export_query
 import uuid
 from datetime import datetime
+from decimal import Decimal, InvalidOperation
 import logging
 
 payment_bp = Blueprint('payment', __name__)
@@ -18,6 +24,127 @@ logger = logging.getLogger(__name__)
 # Initialize services
 compliance_service = ComplianceService()
 security_service = SecurityService()
+encryption_service = EncryptionService()
+fraud_service = FraudDetectionService()
+payment_stats = PaymentStatsService()
+
+# Batch endpoints insert and commit in chunks of this many payments
+BATCH_CHUNK_SIZE = 500
+MAX_BATCH_SIZE = 10000
+
+def _is_merchant_active(merchant):
+    """Merchants can take payments unless their account is suspended"""
+    return merchant is not None and merchant.status != 'suspended'
+
+def _build_payment(data, merchant_id):
+    """
+    Validate, tokenize and fraud-score a payment request.
+    Returns the payment and its log entries (not yet added to the session);
+    raises ValueError with a client-facing message if the request is invalid.
+    """
+    required_fields = ['amount', 'currency', 'payment_method']
+    for field in required_fields:
+        if field not in data:
+            raise ValueError(gettext('Missing required field: %(field)s', field=field))
+    
+    try:
+        amount = Decimal(str(data['amount']))
+    except InvalidOperation:
+        raise ValueError('Invalid amount')
+    if not amount.is_finite() or amount <= 0:
+        raise ValueError('Invalid amount')
+    
+    try:
+        currency_exponent(data['currency'])
+    except UnsupportedCurrency as e:
+        raise ValueError(str(e))
+    try:
+        # Stored as integer minor units; amounts finer than the currency's minor unit are refused
+        amount_minor = to_minor(amount, data['currency'], exact=True)
+    except ValueError:
+        raise ValueError('Invalid amount')
+    
+    try:
+        payment_method = PaymentMethod(data['payment_method'])
+    except ValueError:
+        raise ValueError('Invalid payment method')
+    
+    # Create payment record
+    payment = Payment(
+        transaction_id=str(uuid.uuid4()),
+        merchant_id=merchant_id,
+        amount_minor=amount_minor,
+        currency=data['currency'],
+        status=PaymentStatus.PENDING,
+        payment_method=payment_method,
+        customer_email=data.get('customer_email'),
+        customer_name=data.get('customer_name'),
+        description=data.get('description'),
+        reference_number=data.get('reference_number'),
+        ip_address=request.remote_addr,
+        user_agent=request.headers.get('User-Agent')
+    )
+    
+    # Handle card information (tokenization)
+    if 'card_number' in data:
+        payment.card_token = encryption_service.tokenize_card(data['card_number'])
+        payment.card_last_four = data['card_number'][-4:]
+        payment.card_brand = data.get('card_brand', 'Unknown')
+    
+    # Fraud detection
+    fraud_score = fraud_service.analyze_transaction(payment, data)
+    payment.fraud_score = fraud_score
+    
+    log_entries = []
+    if fraud_score > 0.8:  # High fraud risk
+        payment.status = PaymentStatus.FAILED
+        log_entries.append(TransactionLog(
+            transaction_id=payment.transaction_id,
+            event_type='fraud_detected',
+            message=f'High fraud score: {fraud_score}',
+            response_code='FRAUD'
+        ))
+    
+    # Log transaction creation
+    log_entries.append(TransactionLog(
+        transaction_id=payment.transaction_id,
+        event_type='created',
+        message='Payment transaction created',
+        response_code='200'
+    ))
+    
+    return payment, log_entries
+
+def _apply_processing_result(payment, result):
+    """
+    Update a payment from the processor result and return the matching log entry
+    """
+    if result['success']:
+        payment.status = PaymentStatus.COMPLETED
+        payment.processed_at = datetime.utcnow()
+        
+        return TransactionLog(
+            transaction_id=payment.transaction_id,
+            event_type='completed',
+            message='Payment processed successfully',
+            response_code=result.get('response_code', '200'),
+            payload=TransactionLogPayload.from_response(result)
+        )
+    
+    payment.status = PaymentStatus.FAILED
+    
+    return TransactionLog(
+        transaction_id=payment.transaction_id,
+        event_type='failed',
+        message=result.get('error', 'Payment processing failed'),
+        response_code=result.get('response_code', '500'),
+        payload=TransactionLogPayload.from_response(result)
+    )
+
+def _batch_status_code(succeeded, total):
+    if succeeded == total:
+        return 200
+    return 207 if succeeded else 400
 
 @payment_bp.route('/payments', methods=['POST'])
 @require_auth
@@ -29,73 +156,115 @@ def create_payment():
     try:
         data = request.json
         
-        # Validate required fields
-        required_fields = ['merchant_id', 'amount', 'currency', 'payment_method']
-        for field in required_fields:
-            if field not in data:
-                return jsonify({'error': gettext('Missing required field: %(field)s', field=field)}), 400
+        # Payments are always taken for the authenticated merchant
+        merchant_id = authorized_merchant_id(data.get('merchant_id'))
+        if not merchant_id:
+            return jsonify({'error': 'Forbidden'}), 403
         
         # Validate merchant
-        merchant = Merchant.query.filter_by(merchant_id=data['merchant_id']).first()
-        if not merchant or not merchant.is_active:
+        merchant = Merchant.query.filter_by(merchant_id=merchant_id).first()
+        if not _is_merchant_active(merchant):
             return jsonify({'error': gettext('Invalid or inactive merchant')}), 401
         
-        # Create payment record
-        payment = Payment(
-            transaction_id=str(uuid.uuid4()),
-            merchant_id=data['merchant_id'],
-            amount=data['amount'],
-            currency=data['currency'],
-            payment_method=PaymentMethod(data['payment_method']),
-            customer_email=data.get('customer_email'),
-            customer_name=data.get('customer_name'),
-            description=data.get('description'),
-            reference_number=data.get('reference_number'),
-            ip_address=request.remote_addr,
-            user_agent=request.headers.get('User-Agent')
-        )
-        
-        # Handle card information (tokenization)
-        if 'card_number' in data:
-            encryption_service = EncryptionService()
-            payment.card_token = encryption_service.tokenize_card(data['card_number'])
-            payment.card_last_four = data['card_number'][-4:]
-            payment.card_brand = data.get('card_brand', 'Unknown')
-        
-        # Fraud detection
-        fraud_service = FraudDetectionService()
-        fraud_score = fraud_service.analyze_transaction(payment, data)
-        payment.fraud_score = fraud_score
-        
-        if fraud_score > 0.8:  # High fraud risk
-            payment.status = PaymentStatus.FAILED
-            log_entry = TransactionLog(
-                transaction_id=payment.transaction_id,
-                event_type='fraud_detected',
-                message=f'High fraud score: {fraud_score}',
-                response_code='FRAUD'
-            )
-            db.session.add(log_entry)
+        try:
+            payment, log_entries = _build_payment(data, merchant.merchant_id)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
+        # Payment, its log entries and the merchant's counters are written in a single commit
         db.session.add(payment)
-        db.session.commit()
-        
-        # Log transaction creation
-        log_entry = TransactionLog(
-            transaction_id=payment.transaction_id,
-            event_type='created',
-            message='Payment transaction created',
-            response_code='200'
-        )
-        db.session.add(log_entry)
+        db.session.add_all(log_entries)
+        payment_stats.record(db.session, [payment])
         db.session.commit()
         
         return jsonify(payment.to_dict()), 201
         
     except Exception as e:
+        db.session.rollback()
         logger.error(f"Error creating payment: {str(e)}")
         return jsonify({'error': 'Internal server error'}), 500
 
+@payment_bp.route('/payments/batch', methods=['POST'])
+@require_auth
+@rate_limit(max_requests=50, window_minutes=60)
+def create_payments_batch():
+    """
+    Create many payment transactions for one merchant in a single request.
+    Each item is validated independently; valid items are inserted in bulk,
+    one commit per chunk, and the response carries a result per item.
+    """
+    try:
+        data = request.json or {}
+        items = data.get('payments')
+        
+        merchant_id = authorized_merchant_id(data.get('merchant_id'))
+        if not merchant_id:
+            return jsonify({'error': 'Forbidden'}), 403
+        if not isinstance(items, list) or not items:
+            return jsonify({'error': gettext('Missing required field: %(field)s', field='payments')}), 400
+        if len(items) > MAX_BATCH_SIZE:
+            return jsonify({'error': f'Batch size exceeds maximum of {MAX_BATCH_SIZE} payments'}), 400
+        
+        # One merchant lookup for the whole batch
+        merchant = Merchant.query.filter_by(merchant_id=merchant_id).first()
+        if not _is_merchant_active(merchant):
+            return jsonify({'error': gettext('Invalid or inactive merchant')}), 401
+        
+        results = []
+        created = 0
+        
+        for chunk_start in range(0, len(items), BATCH_CHUNK_SIZE):
+            chunk = items[chunk_start:chunk_start + BATCH_CHUNK_SIZE]
+            chunk_payments = []
+            chunk_rows = []
+            chunk_results = []
+            
+            for index, item in enumerate(chunk, start=chunk_start):
+                try:
+                    if not isinstance(item, dict):
+                        raise ValueError('Payment must be an object')
+                    payment, log_entries = _build_payment(item, merchant.merchant_id)
+                except ValueError as e:
+                    chunk_results.append({'index': index, 'success': False, 'error': str(e)})
+                    continue
+                
+                chunk_payments.append(payment)
+                chunk_rows.append(payment)
+                chunk_rows.extend(log_entries)
+                chunk_results.append({'index': index, 'success': True, 'payment': payment})
+            
+            try:
+                db.session.add_all(chunk_rows)
+                payment_stats.record(db.session, chunk_payments)
+                db.session.commit()
+                created += len(chunk_payments)
+                for result in chunk_results:
+                    if result['success']:
+                        result['payment'] = result['payment'].to_dict()
+            except Exception as e:
+                db.session.rollback()
+                logger.error(f"Error committing payment batch chunk at {chunk_start}: {str(e)}")
+                for result in chunk_results:
+                    if result['success']:
+                        result.pop('payment')
+                        result['success'] = False
+                        result['error'] = 'Internal server error'
+            
+            results.extend(chunk_results)
+        
+        return jsonify({
+            'merchant_id': merchant.merchant_id,
+            'total': len(items),
+            'created': created,
+            'failed': len(items) - created,
+            'results': results
+        }), _batch_status_code(created, len(items))
+        
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Error creating payment batch: {str(e)}")
+        return jsonify({'error': 'Internal server error'}), 500
+
 @payment_bp.route('/payments/<transaction_id>/process', methods=['POST'])
 def process_payment(transaction_id):
     """
@@ -117,37 +286,119 @@ def process_payment(transaction_id):
         processor = PaymentProcessor()
         result = processor.process_payment(payment)
         
-        if result['success']:
-            payment.status = PaymentStatus.COMPLETED
-            payment.processed_at = datetime.utcnow()
-            
-            log_entry = TransactionLog(
-                transaction_id=payment.transaction_id,
-                event_type='completed',
-                message='Payment processed successfully',
-                response_code=result.get('response_code', '200'),
-                gateway_response=str(result)
-            )
-        else:
-            payment.status = PaymentStatus.FAILED
-            
-            log_entry = TransactionLog(
-                transaction_id=payment.transaction_id,
-                event_type='failed',
-                message=result.get('error', 'Payment processing failed'),
-                response_code=result.get('response_code', '500'),
-                gateway_response=str(result)
-            )
+        log_entry = _apply_processing_result(payment, result)
         
         db.session.add(log_entry)
+        payment_stats.record(db.session, [payment], previous_status=PaymentStatus.PENDING)
         db.session.commit()
         
         return jsonify(payment.to_dict()), 200
         
     except Exception as e:
+        db.session.rollback()
         logger.error(f"Error processing payment: {str(e)}")
         return jsonify({'error': 'Internal server error'}), 500
 
+@payment_bp.route('/payments/batch/process', methods=['POST'])
+@require_auth
+def process_payments_batch():
+    """
+    Process many pending payments of the authenticated merchant in a single request.
+    Authorizations in a chunk are in flight concurrently on the dispatch engine,
+    and each chunk's status updates and logs are committed together.
+    An item succeeds only if its payment was authorized; declines carry the response code.
+    """
+    try:
+        data = request.json or {}
+        transaction_ids = data.get('transaction_ids')
+        
+        merchant_id = authorized_merchant_id(data.get('merchant_id'))
+        if not merchant_id:
+            return jsonify({'error': 'Forbidden'}), 403
+        if not isinstance(transaction_ids, list) or not transaction_ids:
+            return jsonify({'error': gettext('Missing required field: %(field)s', field='transaction_ids')}), 400
+        if len(transaction_ids) > MAX_BATCH_SIZE:
+            return jsonify({'error': f'Batch size exceeds maximum of {MAX_BATCH_SIZE} payments'}), 400
+        
+        # Each payment is processed once even if it is listed twice
+        transaction_ids = list(dict.fromkeys(str(transaction_id) for transaction_id in transaction_ids))
+        
+        processor = PaymentProcessor()
+        results = []
+        processed = 0
+        authorized = 0
+        
+        for chunk_start in range(0, len(transaction_ids), BATCH_CHUNK_SIZE):
+            chunk = transaction_ids[chunk_start:chunk_start + BATCH_CHUNK_SIZE]
+            # Other merchants' payments are reported as not found
+            payments = {
+                payment.transaction_id: payment
+                for payment in Payment.query.filter(
+                    Payment.transaction_id.in_(chunk), Payment.merchant_id == merchant_id
+                ).all()
+            }
+            
+            pending = []
+            chunk_results = {}
+            for transaction_id in chunk:
+                payment = payments.get(transaction_id)
+                if not payment:
+                    chunk_results[transaction_id] = {'transaction_id': transaction_id, 'success': False, 'error': 'Payment not found'}
+                elif payment.status != PaymentStatus.PENDING:
+                    chunk_results[transaction_id] = {'transaction_id': transaction_id, 'success': False, 'error': 'Payment cannot be processed'}
+                else:
+                    payment.status = PaymentStatus.PROCESSING
+                    payment.updated_at = datetime.utcnow()
+                    pending.append(payment)
+            
+            try:
+                processing_results = processor.process_payments(pending)
+                log_entries = [
+                    _apply_processing_result(payment, result)
+                    for payment, result in zip(pending, processing_results)
+                ]
+                db.session.add_all(log_entries)
+                payment_stats.record(db.session, pending, previous_status=PaymentStatus.PENDING)
+                db.session.commit()
+                processed += len(pending)
+                for payment, result in zip(pending, processing_results):
+                    item = {
+                        'transaction_id': payment.transaction_id,
+                        'success': bool(result['success']),
+                        'response_code': result.get('response_code'),
+                        'payment': payment.to_dict()
+                    }
+                    if result['success']:
+                        authorized += 1
+                    else:
+                        item['error'] = result.get('error', 'Payment processing failed')
+                    chunk_results[payment.transaction_id] = item
+            except Exception as e:
+                db.session.rollback()
+                logger.error(f"Error committing payment processing chunk at {chunk_start}: {str(e)}")
+                for payment in pending:
+                    chunk_results[payment.transaction_id] = {
+                        'transaction_id': payment.transaction_id,
+                        'success': False,
+                        'error': 'Internal server error'
+                    }
+            
+            results.extend(chunk_results[transaction_id] for transaction_id in chunk)
+        
+        return jsonify({
+            'total': len(results),
+            'processed': processed,
+            'authorized': authorized,
+            'declined': processed - authorized,
+            'failed': len(results) - processed,
+            'results': results
+        }), _batch_status_code(processed, len(results))
+        
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Error processing payment batch: {str(e)}")
+        return jsonify({'error': 'Internal server error'}), 500
+
 @payment_bp.route('/payments/<transaction_id>', methods=['GET'])
 def get_payment(transaction_id):
     """
@@ -167,12 +418,13 @@ def get_payment(transaction_id):
 @payment_bp.route('/payments', methods=['GET'])
 def get_payments():
     """
-    Get payments with optional filtering
+    Get payments with optional filtering, newest first
+    The next page's cursor is returned in the X-Next-Cursor header (absent on the last page)
     """
     try:
         merchant_id = request.args.get('merchant_id')
         status = request.args.get('status')
-        limit = int(request.args.get('limit', 50))
+        limit = page_size(request.args.get('limit'))
         offset = int(request.args.get('offset', 0))
         
         query = Payment.query
@@ -183,14 +435,49 @@ def get_payments():
         if status:
             query = query.filter_by(status=PaymentStatus(status))
         
-        payments = query.order_by(Payment.created_at.desc()).offset(offset).limit(limit).all()
+        payments, next_cursor = paginate(query, Payment, limit, request.args.get('cursor'), offset)
         
-        return jsonify([payment.to_dict() for payment in payments]), 200
+        headers = {'X-Next-Cursor': next_cursor} if next_cursor else {}
+        return jsonify([payment.to_dict() for payment in payments]), 200, headers
         
+    except InvalidCursor as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         logger.error(f"Error retrieving payments: {str(e)}")
         return jsonify({'error': 'Internal server error'}), 500
 
+@payment_bp.route('/payments/export', methods=['GET'])
+@require_auth
+@rate_limit(max_requests=30, window_minutes=60, key='api_key', scope='export')
+def export_payments():
+    """
+    Stream the authenticated merchant's payments oldest first as NDJSON (default) or CSV (?format=csv)
+    Accepts the same status filter as the list, plus start_date/end_date
+    """
+    try:
+        merchant_id = authorized_merchant_id(request.args.get('merchant_id'))
+        if not merchant_id:
+            return jsonify({'error': 'Forbidden'}), 403
+        
+        fmt = export_format(request.args.get('format'))
+        status = request.args.get('status')
+        query = payments_export_query(
+            merchant_id=merchant_id,
+            status=PaymentStatus(status) if status else None,
+            start=parse_date_filter('start_date', request.args.get('start_date')),
+            end=parse_date_filter('end_date', request.args.get('end_date'))
+        )
+        
+        return export_response(query, fmt, 'payments')
+        
+    except InvalidExport as e:
+        return jsonify({'error': str(e)}), 400
+    except ValueError:
+        return jsonify({'error': 'Invalid payment status'}), 400
+    except Exception as e:
+        logger.error(f"Error exporting payments: {str(e)}")
+        return jsonify({'error': 'Internal server error'}), 500
+
 @payment_bp.route('/payments/<transaction_id>/refund', methods=['POST'])
 def refund_payment(transaction_id):
     """
@@ -205,14 +492,17 @@ def refund_payment(transaction_id):
             return jsonify({'error': 'Payment cannot be refunded'}), 400
         
         data = request.json
-        refund_amount = data.get('amount', payment.amount)
+        try:
+            refund_minor = to_minor(data.get('amount', payment.amount), payment.currency, exact=True)
+        except ValueError:
+            return jsonify({'error': 'Invalid amount'}), 400
         
-        if refund_amount > payment.amount:
+        if refund_minor > payment.amount_minor:
             return jsonify({'error': 'Refund amount cannot exceed payment amount'}), 400
         
         # Process refund
         processor = PaymentProcessor()
-        result = processor.refund_payment(payment, refund_amount)
+        result = processor.refund_payment(payment, refund_minor)
         
         if result['success']:
             payment.status = PaymentStatus.REFUNDED
@@ -221,17 +511,18 @@ def refund_payment(transaction_id):
             log_entry = TransactionLog(
                 transaction_id=payment.transaction_id,
                 event_type='refunded',
-                message=f'Payment refunded: {refund_amount}',
+                message=f'Payment refunded: {from_minor(refund_minor, payment.currency)}',
                 response_code=result.get('response_code', '200'),
-                gateway_response=str(result)
+                payload=TransactionLogPayload.from_response(result)
             )
+            payment_stats.record(db.session, [payment], previous_status=PaymentStatus.COMPLETED)
         else:
             log_entry = TransactionLog(
                 transaction_id=payment.transaction_id,
                 event_type='refund_failed',
                 message=result.get('error', 'Refund processing failed'),
                 response_code=result.get('response_code', '500'),
-                gateway_response=str(result)
+                payload=TransactionLogPayload.from_response(result)
             )
         
         db.session.add(log_entry)
@@ -240,18 +531,23 @@ def refund_payment(transaction_id):
         return jsonify(payment.to_dict()), 200
         
     except Exception as e:
+        db.session.rollback()
         logger.error(f"Error processing refund: {str(e)}")
         return jsonify({'error': 'Internal server error'}), 500
 
 @payment_bp.route('/payments/<transaction_id>/logs', methods=['GET'])
 def get_payment_logs(transaction_id):
     """
-    Get transaction logs for a payment
+    Get transaction logs for a payment, including archived months
+    Gateway responses are left out unless asked for with ?include=gateway
     """
     try:
-        logs = TransactionLog.query.filter_by(transaction_id=transaction_id).order_by(TransactionLog.created_at.desc()).all()
+        include_gateway = 'gateway' in request.args.get('include', '').split(',')
+        # Logs are never older than their payment, so archived months before it are skipped
+        created_at = db.session.query(Payment.created_at).filter_by(transaction_id=transaction_id).scalar()
+        logs = get_transaction_log_archive().logs_for(transaction_id, since=created_at, include_gateway=include_gateway)
         
-        return jsonify([log.to_dict() for log in logs]), 200
+        return jsonify(logs), 200
         
     except Exception as e:
         logger.error(f"Error retrieving payment logs: {str(e)}")
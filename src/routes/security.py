@@ -0,0 +1,72 @@
+from flask import Blueprint, jsonify, request
+from functools import wraps
+from datetime import datetime, timezone
+from src.pagination import page_size
+from src.services.security_events import SEVERITIES, get_security_event_bus
+import ipaddress
+import logging
+
+security_bp = Blueprint('security', __name__)
+logger = logging.getLogger(__name__)
+
+def local_only(f):
+    """Serve the endpoint to loopback clients only (operators on the host, not merchants)"""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        try:
+            is_local = ipaddress.ip_address(request.remote_addr or '').is_loopback
+        except ValueError:
+            is_local = False
+        if not is_local:
+            return jsonify({'error': 'Forbidden'}), 403
+        return f(*args, **kwargs)
+    return decorated_function
+
+def _parse_time(name, value):
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f"Invalid {name}: expected an ISO date or datetime")
+    # Events are stored in naive UTC; an offset ("Z", "+02:00") is converted to it
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+@security_bp.route('/security/events', methods=['GET'])
+@local_only
+def get_security_events():
+    """
+    Query written security events, newest first
+    Filters: event_type (comma-separated), severity (this level and above), start, end, limit
+    """
+    try:
+        event_types = [value for value in request.args.get('event_type', '').split(',') if value]
+        severity = request.args.get('severity', '').upper() or None
+        if severity and severity not in SEVERITIES:
+            return jsonify({'error': f"Invalid severity: expected one of {', '.join(SEVERITIES)}"}), 400
+        start = _parse_time('start', request.args.get('start'))
+        end = _parse_time('end', request.args.get('end'))
+
+        bus = get_security_event_bus()
+        events = bus.query(
+            event_types=event_types, min_severity=severity, start=start, end=end,
+            limit=page_size(request.args.get('limit'))
+        )
+
+        return jsonify({'events': events, 'count': len(events), 'bus': bus.stats()}), 200
+
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logger.error(f"Error querying security events: {str(e)}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+@security_bp.route('/security/events/stats', methods=['GET'])
+@local_only
+def get_security_event_stats():
+    """
+    Event bus counters: buffered, written, dropped under overload, sampled out
+    """
+    return jsonify(get_security_event_bus().stats()), 200
@@ -0,0 +1,136 @@
+import hashlib
+import hmac
+import logging
+import os
+import secrets
+import threading
+from typing import Any, Dict, Optional, Tuple
+from src.services.cache import MISSING, TTLCache
+
+logger = logging.getLogger(__name__)
+
+# Credentials are issued in pairs sharing a key id:
+#   public key  pk_<mode>_<key id>            stored as MerchantAuth.api_key (unique index)
+#   secret key  sk_<mode>_<key id>_<secret>   sent in X-API-Key; only its SHA-256 is stored
+KEY_MODES = ('test', 'live')
+
+def generate_credentials(live: bool = False) -> Tuple[str, str, str]:
+    """
+    Issue a new key pair; returns (public key, secret key, secret hash)
+    """
+    mode = 'live' if live else 'test'
+    key_id = secrets.token_hex(12)
+    public_key = f"pk_{mode}_{key_id}"
+    secret_key = f"sk_{mode}_{key_id}_{secrets.token_urlsafe(32)}"
+    return public_key, secret_key, hash_secret(secret_key)
+
+def hash_secret(secret_key: str) -> str:
+    # Secret keys carry 256 bits of randomness, so a fast hash is enough (no password stretching needed)
+    return hashlib.sha256(secret_key.encode()).hexdigest()
+
+def public_key_for(secret_key: str) -> Optional[str]:
+    """
+    Derive the public key id from a presented secret key, or None if it is malformed
+    """
+    parts = secret_key.split('_', 3)
+    if len(parts) != 4 or parts[0] != 'sk' or parts[1] not in KEY_MODES or not parts[2] or not parts[3]:
+        return None
+    return f"pk_{parts[1]}_{parts[2]}"
+
+class ApiKeyAuthenticator:
+    """
+    Authenticates secret API keys against MerchantAuth records.
+
+    The key id is looked up through the unique api_key index and the secret is compared
+    with the stored hash in constant time. Lookups are cached per process in a TTL LRU,
+    including misses, so a warm key (or a repeated bad one) costs no database round-trip.
+    Other workers pick up regenerated keys once their cached entry expires.
+    """
+
+    def __init__(self, cache: TTLCache = None, negative_ttl: float = 10.0):
+        self.cache = cache or TTLCache(maxsize=10000, ttl=60.0)
+        self.negative_ttl = negative_ttl
+
+    def _load(self, public_key: str) -> Optional[Dict[str, Any]]:
+        from src.models.auth import MerchantAuth
+        from src.models.user import Merchant
+
+        row = MerchantAuth.query.with_entities(
+            MerchantAuth.id, MerchantAuth.api_secret, MerchantAuth.is_active,
+            Merchant.merchant_id, Merchant.status
+        ).join(Merchant, MerchantAuth.merchant_id == Merchant.id).filter(
+            MerchantAuth.api_key == public_key
+        ).first()
+
+        if row is None:
+            return None
+
+        return {
+            'merchant_auth_id': row.id,
+            'merchant_id': row.merchant_id,
+            'secret_hash': row.api_secret,
+            'active': bool(row.is_active) and row.status != 'suspended'
+        }
+
+    def lookup(self, public_key: str) -> Optional[Dict[str, Any]]:
+        """
+        Return the credential record for a public key (cached), or None if unknown
+        """
+        record = self.cache.get(public_key)
+        if record is MISSING:
+            record = self._load(public_key)
+            self.cache.set(public_key, record, ttl=None if record else self.negative_ttl)
+        return record
+
+    def authenticate(self, secret_key: str) -> Dict[str, Any]:
+        """
+        Verify a secret API key and return the merchant it belongs to
+        """
+        public_key = public_key_for(secret_key or '')
+        if public_key is None:
+            return {'valid': False, 'error': 'Invalid API key format'}
+
+        record = self.lookup(public_key)
+        if record is None or not record['secret_hash']:
+            return {'valid': False, 'error': 'Invalid API key'}
+
+        if not hmac.compare_digest(hash_secret(secret_key), record['secret_hash']):
+            return {'valid': False, 'error': 'Invalid API key'}
+
+        if not record['active']:
+            return {'valid': False, 'error': 'API key is disabled'}
+
+        return {
+            'valid': True,
+            'data': {
+                'merchant_id': record['merchant_id'],
+                'merchant_auth_id': record['merchant_auth_id'],
+                'api_key': public_key,
+                'mode': public_key.split('_')[1],
+                'permissions': ['read', 'write']
+            }
+        }
+
+    def invalidate(self, public_key: str):
+        """
+        Drop a cached credential, e.g. after its keys are regenerated
+        """
+        if public_key:
+            self.cache.delete(public_key)
+
+_authenticator = None
+_authenticator_lock = threading.Lock()
+
+def get_api_key_authenticator() -> ApiKeyAuthenticator:
+    """
+    Return the process-wide authenticator (cache sized by API_KEY_CACHE_SIZE / API_KEY_CACHE_TTL)
+    """
+    global _authenticator
+    if _authenticator is None:
+        with _authenticator_lock:
+            if _authenticator is None:
+                _authenticator = ApiKeyAuthenticator(TTLCache(
+                    maxsize=int(os.environ.get('API_KEY_CACHE_SIZE', 10000)),
+                    ttl=float(os.environ.get('API_KEY_CACHE_TTL', 60))
+                ))
+    return _authenticator
@@ -0,0 +1,532 @@
+"""
+Append-only compliance audit log: hash-chained segment files with a sparse block index
+"""
+
+import atexit
+import fcntl
+import hashlib
+import hmac
+import json
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from src.database import data_path
+
+logger = logging.getLogger(__name__)
+
+# Segment: magic, then blocks. A block is one appender batch:
+#   header: magic, payload length, first sequence number, event count, min/max timestamp (µs since
+#           the epoch, UTC), previous block's hash, this block's hash
+#   payload: records, each a header (seq, timestamp, lengths) then event type, merchant id and
+#            the details as JSON
+# A block's hash is SHA-256 over its header up to and including the previous hash, then its
+# payload, so every block commits to the whole log before it.
+SEGMENT_MAGIC = b'DPAUDIT1'
+SEGMENT_PREFIX = 'audit-'
+SEGMENT_SUFFIX = '.seg'
+INDEX_SUFFIX = '.idx.npz'
+BLOCK_MAGIC = b'BLK1'
+BLOCK_HEADER = struct.Struct('>4sIQIqq32s32s')
+HASHED_HEADER_SIZE = BLOCK_HEADER.size - 32
+RECORD_HEADER = struct.Struct('>QqHHI')  # seq, timestamp, event type length, merchant id length, details length
+GENESIS_HASH = bytes(32)
+
+SEGMENT_BYTES = 32 * 1024 * 1024
+MAX_BLOCK_EVENTS = 1000
+
+EPOCH = datetime(1970, 1, 1)
+
+BLOCK_DTYPE = np.dtype([
+    ('offset', np.int64), ('length', np.int64), ('first_seq', np.int64),
+    ('count', np.int64), ('min_ts', np.int64), ('max_ts', np.int64)
+])
+
+def to_micros(value: datetime) -> int:
+    return (value - EPOCH) // timedelta(microseconds=1)
+
+def from_micros(value: int) -> datetime:
+    return EPOCH + timedelta(microseconds=value)
+
+def _key_hash(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest(), 'big')
+
+def _lookup_key(event_type: Optional[str], merchant_id: Optional[str]) -> Optional[str]:
+    """The most selective index key for a query, or None to read every block"""
+    if event_type and merchant_id:
+        return f'tm:{event_type}\x1f{merchant_id}'
+    if event_type:
+        return f't:{event_type}'
+    if merchant_id:
+        return f'm:{merchant_id}'
+    return None
+
+def _record_keys(event_type: str, merchant_id: str):
+    yield _key_hash(f't:{event_type}')
+    if merchant_id:
+        yield _key_hash(f'm:{merchant_id}')
+        yield _key_hash(f'tm:{event_type}\x1f{merchant_id}')
+
+class SegmentIndex:
+    """
+    Sparse index of one segment: a row per block (offset, sequence and time range) and
+    sorted (key hash, block) postings for event types, merchants and their pairs
+    """
+
+    def __init__(self, end: int, blocks: np.ndarray, keys: np.ndarray, key_blocks: np.ndarray):
+        self.end = end
+        self.blocks = blocks
+        self.keys = keys
+        self.key_blocks = key_blocks
+
+    @classmethod
+    def build(cls, buffer, start: int, end: int, first_block: int = 0):
+        """Index the complete blocks in buffer[start:end]"""
+        blocks, keys, key_blocks = [], [], []
+        offset = start
+        while offset + BLOCK_HEADER.size <= end:
+            magic, length, first_seq, count, min_ts, max_ts, _, _ = BLOCK_HEADER.unpack_from(buffer, offset)
+            payload_start = offset + BLOCK_HEADER.size
+            if magic != BLOCK_MAGIC or payload_start + length > end:
+                break
+
+            block_keys = set()
+            position = payload_start
+            for _ in range(count):
+                _, _, type_length, merchant_length, details_length = RECORD_HEADER.unpack_from(buffer, position)
+                position += RECORD_HEADER.size
+                event_type = bytes(buffer[position:position + type_length]).decode('utf-8')
+                merchant_id = bytes(buffer[position + type_length:position + type_length + merchant_length]).decode('utf-8')
+                block_keys.update(_record_keys(event_type, merchant_id))
+                position += type_length + merchant_length + details_length
+
+            block_number = first_block + len(blocks)
+            blocks.append((offset, length, first_seq, count, min_ts, max_ts))
+            keys.extend(block_keys)
+            key_blocks.extend([block_number] * len(block_keys))
+            offset = payload_start + length
+
+        return offset, np.array(blocks, dtype=BLOCK_DTYPE), np.array(keys, dtype=np.uint64), np.array(key_blocks, dtype=np.int64)
+
+    @classmethod
+    def from_segment(cls, buffer, size: int):
+        end, blocks, keys, key_blocks = cls.build(buffer, len(SEGMENT_MAGIC), size)
+        return cls._sorted(end, blocks, keys, key_blocks)
+
+    @classmethod
+    def _sorted(cls, end, blocks, keys, key_blocks):
+        order = np.argsort(keys, kind='stable')
+        return cls(end, blocks, keys[order], key_blocks[order])
+
+    def extended(self, buffer, size: int):
+        """This index with the blocks appended since it was built"""
+        end, blocks, keys, key_blocks = self.build(buffer, self.end, size, first_block=len(self.blocks))
+        if not len(blocks):
+            return self
+        return self._sorted(
+            end, np.concatenate([self.blocks, blocks]),
+            np.concatenate([self.keys, keys]), np.concatenate([self.key_blocks, key_blocks])
+        )
+
+    @classmethod
+    def load(cls, path: str):
+        with np.load(path) as data:
+            return cls(int(data['end']), data['blocks'], data['keys'], data['key_blocks'])
+
+    def save(self, path: str):
+        temp_path = f'{path}.{os.getpid()}.tmp.npz'
+        np.savez(temp_path, end=np.int64(self.end), blocks=self.blocks, keys=self.keys, key_blocks=self.key_blocks)
+        os.replace(temp_path, path)
+
+    def candidate_blocks(self, key: Optional[str], start_ts: Optional[int], end_ts: Optional[int]) -> np.ndarray:
+        """Rows of the blocks that can hold matching events, in log order"""
+        if key is None:
+            selected = np.arange(len(self.blocks))
+        else:
+            key_hash = np.uint64(_key_hash(key))
+            selected = np.sort(self.key_blocks[
+                np.searchsorted(self.keys, key_hash, 'left'):np.searchsorted(self.keys, key_hash, 'right')
+            ])
+        rows = self.blocks[selected]
+        in_range = np.ones(len(rows), dtype=bool)
+        if start_ts is not None:
+            in_range &= rows['max_ts'] >= start_ts
+        if end_ts is not None:
+            in_range &= rows['min_ts'] < end_ts
+        return rows[in_range]
+
+class AuditLog:
+    """
+    Append-only, hash-chained audit log of compliance events.
+
+    append() queues the event and returns; a background appender writes each batch as one
+    block, holding an exclusive lock on the log directory so every process extends the same
+    chain, and fsyncs it before taking the next batch. Segments rotate at SEGMENT_BYTES.
+
+    Queries go through a sparse index per segment (saved beside it, extended as blocks are
+    appended and completed by the appender when the segment is sealed), which maps event types, merchants and (type, merchant) pairs to the
+    blocks holding them; only those blocks are read, through mmap. verify() re-hashes every
+    block in order, one SHA-256 pass over each block's bytes.
+    """
+
+    def __init__(self, directory: str, flush_interval: float = 0.2):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        os.makedirs(directory, exist_ok=True)
+        self.lock_path = os.path.join(directory, 'audit.lock')
+
+        self._events = deque()
+        self._wakeup = threading.Event()
+        self._drain_lock = threading.Lock()
+        self._tail_state = None  # (path, end offset, next seq, last hash) as of this process's last append
+        self._indexes = {}
+        self._index_lock = threading.Lock()
+        self._appender_pid = None
+        self._appender_start_lock = threading.Lock()
+        atexit.register(self.flush)
+
+    # Appending
+
+    def append(self, event_type: str, details: Dict[str, Any] = None, merchant_id: Optional[str] = None,
+               timestamp: Optional[datetime] = None):
+        """Queue an event for the appender"""
+        self._events.append((
+            to_micros(timestamp or datetime.utcnow()), event_type, merchant_id or '',
+            json.dumps(details or {}, separators=(',', ':'), sort_keys=True, default=str)
+        ))
+        if self._appender_pid != os.getpid():
+            self._start_appender()
+
+    def _start_appender(self):
+        with self._appender_start_lock:
+            if self._appender_pid == os.getpid():
+                return
+            self._tail_state = None
+            thread = threading.Thread(target=self._run, name='audit-log-appender', daemon=True)
+            self._appender_pid = os.getpid()
+            thread.start()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Error appending audit events: {str(e)}")
+
+    def flush(self):
+        """Append every queued event now; returns once they are on disk"""
+        with self._drain_lock:
+            if not self._events:
+                return
+            batch = []
+            while True:
+                try:
+                    batch.append(self._events.popleft())
+                except IndexError:
+                    break
+            try:
+                self._write(batch)
+            except Exception:
+                # Keep them for the next attempt, in order
+                self._events.extendleft(reversed(batch))
+                raise
+
+    def _write(self, batch):
+        sealed = None
+        with open(self.lock_path, 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            path, offset, next_seq, last_hash = self._tail()
+            if os.path.getsize(path) > offset:
+                # Drop an incomplete block left by a crash mid-write
+                os.truncate(path, offset)
+            if offset >= SEGMENT_BYTES:
+                sealed = path
+                path, offset = self._new_segment()
+
+            with open(path, 'r+b') as segment:
+                segment.seek(offset)
+                for start in range(0, len(batch), MAX_BLOCK_EVENTS):
+                    block, last_hash = self._block(batch[start:start + MAX_BLOCK_EVENTS], next_seq, last_hash)
+                    segment.write(block)
+                    offset += len(block)
+                    next_seq += min(MAX_BLOCK_EVENTS, len(batch) - start)
+                segment.flush()
+                os.fsync(segment.fileno())
+
+            self._tail_state = (path, offset, next_seq, last_hash)
+
+        if sealed:
+            # Index the segment just sealed once, outside the lock, so queries never build it
+            try:
+                with open(sealed, 'rb') as segment:
+                    size = os.fstat(segment.fileno()).st_size
+                    with mmap.mmap(segment.fileno(), size, access=mmap.ACCESS_READ) as buffer:
+                        self._index(sealed, buffer, size)
+            except Exception as e:
+                logger.error(f"Error indexing audit segment {sealed}: {str(e)}")
+
+    @staticmethod
+    def _block(events, first_seq, previous_hash):
+        records = []
+        for seq, (timestamp, event_type, merchant_id, details) in enumerate(events, start=first_seq):
+            event_type_bytes, merchant_bytes, details_bytes = event_type.encode('utf-8'), merchant_id.encode('utf-8'), details.encode('utf-8')
+            records.append(RECORD_HEADER.pack(seq, timestamp, len(event_type_bytes), len(merchant_bytes), len(details_bytes)))
+            records.extend((event_type_bytes, merchant_bytes, details_bytes))
+        payload = b''.join(records)
+
+        timestamps = [event[0] for event in events]
+        header = BLOCK_HEADER.pack(BLOCK_MAGIC, len(payload), first_seq, len(events),
+                                   min(timestamps), max(timestamps), previous_hash, GENESIS_HASH)
+        block_hash = hashlib.sha256(header[:HASHED_HEADER_SIZE] + payload).digest()
+        return header[:HASHED_HEADER_SIZE] + block_hash + payload, block_hash
+
+    def _new_segment(self):
+        segments = self.segments()
+        number = int(os.path.basename(segments[-1])[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)]) + 1 if segments else 1
+        path = os.path.join(self.directory, f'{SEGMENT_PREFIX}{number:06d}{SEGMENT_SUFFIX}')
+        with open(path, 'xb') as segment:
+            segment.write(SEGMENT_MAGIC)
+            segment.flush()
+            os.fsync(segment.fileno())
+        return path, len(SEGMENT_MAGIC)
+
+    def _tail(self):
+        """(segment path, end of its last complete block, next seq, last hash); call with the lock held"""
+        segments = self.segments()
+        if not segments:
+            path, offset = self._new_segment()
+            return path, offset, 0, GENESIS_HASH
+
+        path = segments[-1]
+        state = self._tail_state
+        if state is None or state[0] not in segments:
+            # Start from the previous segment's tail, which the chain continues from
+            state = (path, len(SEGMENT_MAGIC), 0, GENESIS_HASH)
+            if len(segments) > 1:
+                _, _, next_seq, last_hash = self._walk(segments[-2], len(SEGMENT_MAGIC), 0, GENESIS_HASH)
+                state = (path, len(SEGMENT_MAGIC), next_seq, last_hash)
+        elif state[0] != path:
+            # Another process rotated: finish the segment we knew, then continue in the new one
+            _, _, next_seq, last_hash = self._walk(*state)
+            state = (path, len(SEGMENT_MAGIC), next_seq, last_hash)
+        return self._walk(*state)
+
+    def _walk(self, path, offset, next_seq, last_hash):
+        """Follow block headers from a known position (and chain state) to the last complete block"""
+        with open(path, 'rb') as segment:
+            size = os.fstat(segment.fileno()).st_size
+            while offset + BLOCK_HEADER.size <= size:
+                segment.seek(offset)
+                magic, length, first_seq, count, _, _, _, block_hash = BLOCK_HEADER.unpack(segment.read(BLOCK_HEADER.size))
+                if magic != BLOCK_MAGIC or offset + BLOCK_HEADER.size + length > size:
+                    break
+                next_seq, last_hash = first_seq + count, block_hash
+                offset += BLOCK_HEADER.size + length
+        return path, offset, next_seq, last_hash
+
+    def segments(self) -> List[str]:
+        """Segment paths in log order"""
+        return [
+            os.path.join(self.directory, name) for name in sorted(os.listdir(self.directory))
+            if name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX)
+        ]
+
+    def head(self) -> Dict[str, Any]:
+        """Sequence number and hash of the last event on disk, for anchoring the chain elsewhere"""
+        with open(self.lock_path, 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_SH)
+            segments = self.segments()
+            if not segments:
+                return {'events': 0, 'hash': GENESIS_HASH.hex()}
+            _, _, next_seq, last_hash = self._tail()
+        return {'events': next_seq, 'hash': last_hash.hex()}
+
+    # Queries
+
+    def _index(self, path: str, buffer, size: int) -> SegmentIndex:
+        """
+        The segment's index, saved beside it and extended with blocks appended since; saving
+        the active segment's index too means each block is indexed once, not once per process
+        """
+        with self._index_lock:
+            index = self._indexes.get(path)
+            if index is None and os.path.exists(path + INDEX_SUFFIX):
+                index = SegmentIndex.load(path + INDEX_SUFFIX)
+            if index is None or index.end > size:
+                index = SegmentIndex.from_segment(buffer, size)
+                index.save(path + INDEX_SUFFIX)
+            elif index.end < size:
+                extended = index.extended(buffer, size)
+                if extended is not index:
+                    extended.save(path + INDEX_SUFFIX)
+                index = extended
+            self._indexes[path] = index
+            return index
+
+    def query(self, event_type: Optional[str] = None, merchant_id: Optional[str] = None,
+              start: Optional[datetime] = None, end: Optional[datetime] = None,
+              limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Events on disk matching every given filter, oldest first"""
+        key = _lookup_key(event_type, merchant_id)
+        start_ts = to_micros(start) if start else None
+        end_ts = to_micros(end) if end else None
+        event_type_bytes = event_type.encode('utf-8') if event_type else None
+        merchant_bytes = merchant_id.encode('utf-8') if merchant_id else None
+
+        results = []
+        segments = self.segments()
+        for path in segments:
+            with open(path, 'rb') as segment:
+                size = os.fstat(segment.fileno()).st_size
+                if size <= len(SEGMENT_MAGIC):
+                    continue
+                with mmap.mmap(segment.fileno(), size, access=mmap.ACCESS_READ) as buffer:
+                    index = self._index(path, buffer, size)
+                    if len(index.blocks) and (
+                        (start_ts is not None and index.blocks['max_ts'].max() < start_ts)
+                        or (end_ts is not None and index.blocks['min_ts'].min() >= end_ts)
+                    ):
+                        continue
+                    for block in index.candidate_blocks(key, start_ts, end_ts):
+                        results.extend(self._scan_block(
+                            buffer, int(block['offset']), int(block['length']), int(block['count']),
+                            event_type_bytes, merchant_bytes, start_ts, end_ts
+                        ))
+                        if limit is not None and len(results) >= limit:
+                            return results[:limit]
+        return results
+
+    @staticmethod
+    def _scan_block(buffer, offset, length, count, event_type_bytes, merchant_bytes, start_ts, end_ts):
+        position = offset + BLOCK_HEADER.size
+        for _ in range(count):
+            seq, timestamp, type_length, merchant_length, details_length = RECORD_HEADER.unpack_from(buffer, position)
+            position += RECORD_HEADER.size
+            type_end = position + type_length
+            merchant_end = type_end + merchant_length
+            details_end = merchant_end + details_length
+            if ((event_type_bytes is None or buffer[position:type_end] == event_type_bytes)
+                    and (merchant_bytes is None or buffer[type_end:merchant_end] == merchant_bytes)
+                    and (start_ts is None or timestamp >= start_ts)
+                    and (end_ts is None or timestamp < end_ts)):
+                yield {
+                    'seq': seq,
+                    'timestamp': from_micros(timestamp).isoformat(),
+                    'event_type': buffer[position:type_end].decode('utf-8'),
+                    'merchant_id': buffer[type_end:merchant_end].decode('utf-8') or None,
+                    'details': json.loads(buffer[merchant_end:details_end])
+                }
+            position = details_end
+
+    # Verification
+
+    def verify(self, expected_head: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Re-hash the whole chain. Checks each block's hash, its link to the previous block,
+        and that sequence numbers run on without gaps; with expected_head (a hash recorded
+        earlier from head()), also that the chain still contains that block.
+        """
+        started = time.perf_counter()
+        previous_hash = GENESIS_HASH
+        next_seq = blocks = total_bytes = 0
+        head_seen = expected_head is None
+        result = {'ok': True, 'error': None}
+
+        def fail(path, offset, reason):
+            result.update(ok=False, error={'segment': os.path.basename(path), 'offset': offset, 'reason': reason})
+
+        for path in self.segments():
+            with open(path, 'rb') as segment:
+                size = os.fstat(segment.fileno()).st_size
+                total_bytes += size
+                if segment.read(len(SEGMENT_MAGIC)) != SEGMENT_MAGIC:
+                    fail(path, 0, 'not an audit segment')
+                    break
+                if size == len(SEGMENT_MAGIC):
+                    continue
+                with mmap.mmap(segment.fileno(), size, access=mmap.ACCESS_READ) as buffer:
+                    view = memoryview(buffer)
+                    try:
+                        offset = len(SEGMENT_MAGIC)
+                        while offset < size:
+                            if offset + BLOCK_HEADER.size > size:
+                                fail(path, offset, 'incomplete block header')
+                                break
+                            magic, length, first_seq, count, _, _, linked_hash, block_hash = BLOCK_HEADER.unpack_from(buffer, offset)
+                            payload_end = offset + BLOCK_HEADER.size + length
+                            if magic != BLOCK_MAGIC:
+                                fail(path, offset, 'bad block magic')
+                                break
+                            if payload_end > size:
+                                fail(path, offset, 'incomplete block')
+                                break
+                            if linked_hash != previous_hash:
+                                fail(path, offset, 'block does not link to the previous block')
+                                break
+                            if first_seq != next_seq:
+                                fail(path, offset, f'sequence gap: expected {next_seq}, found {first_seq}')
+                                break
+                            digest = hashlib.sha256(view[offset:offset + HASHED_HEADER_SIZE])
+                            digest.update(view[offset + BLOCK_HEADER.size:payload_end])
+                            if digest.digest() != block_hash:
+                                fail(path, offset, 'block hash mismatch')
+                                break
+                            previous_hash, next_seq = block_hash, first_seq + count
+                            head_seen = head_seen or block_hash.hex() == expected_head
+                            blocks += 1
+                            offset = payload_end
+                    finally:
+                        view.release()
+            if not result['ok']:
+                break
+
+        if result['ok'] and not head_seen:
+            result.update(ok=False, error={'segment': None, 'offset': None, 'reason': 'expected head not found in the chain'})
+
+        elapsed = time.perf_counter() - started
+        result.update({
+            'segments': len(self.segments()),
+            'blocks': blocks,
+            'events': next_seq,
+            'bytes': total_bytes,
+            'head': previous_hash.hex(),
+            'elapsed_seconds': round(elapsed, 3),
+            'mb_per_second': round(total_bytes / elapsed / 1e6, 1) if elapsed else None
+        })
+        return result
+
+def subject_hash(email: str) -> str:
+    """
+    Keyed hash of a data subject's email, so their audit events can be found without the
+    log (which can never be edited) holding the address. Keyed by AUDIT_SUBJECT_KEY, or a key
+    derived from SECRET_KEY.
+    """
+    key = os.environ.get('AUDIT_SUBJECT_KEY')
+    if not key:
+        secret_key = os.environ.get('SECRET_KEY', 'digipay-eu-secret-key-change-in-production')
+        key = hmac.new(secret_key.encode(), b'digipay-audit-subject', hashlib.sha256).hexdigest()
+    return hmac.new(key.encode(), email.strip().lower().encode('utf-8'), hashlib.sha256).hexdigest()
+
+_audit_log = None
+_audit_log_lock = threading.Lock()
+
+def get_audit_log() -> AuditLog:
+    """
+    Return the process-wide audit log (AUDIT_LOG_DIR, or audit_log in the data directory)
+    """
+    global _audit_log
+    if _audit_log is None:
+        with _audit_log_lock:
+            if _audit_log is None:
+                _audit_log = AuditLog(os.environ.get('AUDIT_LOG_DIR') or data_path('audit_log'))
+    return _audit_log
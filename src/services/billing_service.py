@@ -2,49 +2,40 @@
 Billing service for PayGateway merchant billing system
 """
 
-from datetime import datetime, timedelta
-from decimal import Decimal, ROUND_HALF_UP
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy import func, and_
+import calendar
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from sqlalchemy import and_, case, exists, func, select, update
 from src.database import db
 from src.models.billing import (
     MerchantBilling, Invoice, InvoiceItem, FeeTransaction, 
-    RevenueReport, FeeType, BillingStatus, BillingCycle
+    RevenueReport, FeeType, BillingStatus, BillingCycle, InvoiceRunItem
 )
 from src.models.payment import Payment
 from src.models.user import Merchant
+from src.money import from_minor, to_float, to_minor
+from src.services.pricing import DEFAULT_PRICING, pricing_for_billing
+from src.services.revenue_rollup import RevenueRollupService
+import logging
 import uuid
 
+logger = logging.getLogger(__name__)
+
 class BillingService:
     """Service for handling merchant billing operations"""
     
     def __init__(self):
         self.session = db.session
+        self.revenue_rollups = RevenueRollupService()
     
     def calculate_transaction_fee(self, amount, is_european_card=True, merchant_billing=None):
         """Calculate transaction fee based on amount and card type"""
-        if merchant_billing is None:
-            # Use default rates
-            if is_european_card:
-                percentage = 0.5  # 0.5%
-                fixed_fee = 0.10  # €0.10
-            else:
-                percentage = 2.4  # 2.4%
-                fixed_fee = 0.20  # €0.20
-        else:
-            if is_european_card:
-                percentage = merchant_billing.european_card_percentage
-                fixed_fee = merchant_billing.european_card_fixed_fee
-            else:
-                percentage = merchant_billing.non_european_card_percentage
-                fixed_fee = merchant_billing.non_european_card_fixed_fee
-        
-        # Calculate fee
-        percentage_fee = Decimal(str(amount)) * Decimal(str(percentage)) / Decimal('100')
-        total_fee = percentage_fee + Decimal(str(fixed_fee))
-        
-        # Round to 2 decimal places
-        return float(total_fee.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP))
+        return to_float(self.calculate_transaction_fee_minor(amount, is_european_card, merchant_billing))
+    
+    def calculate_transaction_fee_minor(self, amount, is_european_card=True, merchant_billing=None):
+        """Transaction fee in cents for a major-unit amount"""
+        pricing = DEFAULT_PRICING if merchant_billing is None else pricing_for_billing(merchant_billing)
+        return pricing.fee_minor(amount, is_european_card)
     
     def record_transaction_fee(self, payment_transaction, is_european_card=True):
         """Record a transaction fee for a payment"""
@@ -53,7 +44,7 @@ class BillingService:
             merchant_billing = self.get_or_create_merchant_billing(payment_transaction.merchant_id)
             
             # Calculate fee
-            fee_amount = self.calculate_transaction_fee(
+            fee_amount_minor = self.calculate_transaction_fee_minor(
                 payment_transaction.amount, 
                 is_european_card, 
                 merchant_billing
@@ -64,15 +55,16 @@ class BillingService:
                 merchant_billing_id=merchant_billing.id,
                 payment_transaction_id=payment_transaction.transaction_id,
                 fee_type=FeeType.TRANSACTION_FEE,
-                fee_amount=fee_amount,
+                fee_amount_minor=fee_amount_minor,
                 fee_percentage=merchant_billing.european_card_percentage if is_european_card else merchant_billing.non_european_card_percentage,
-                fixed_fee=merchant_billing.european_card_fixed_fee if is_european_card else merchant_billing.non_european_card_fixed_fee,
-                original_amount=payment_transaction.amount,
+                fixed_fee_minor=merchant_billing.european_card_fixed_fee_minor if is_european_card else merchant_billing.non_european_card_fixed_fee_minor,
+                original_amount_minor=payment_transaction.amount_minor,
                 currency=payment_transaction.currency,
                 is_european_card=is_european_card
             )
             
             self.session.add(fee_transaction)
+            self.revenue_rollups.record(self.session, fee_transaction)
             self.session.commit()
             
             return fee_transaction
@@ -90,12 +82,13 @@ class BillingService:
                 merchant_billing_id=merchant_billing.id,
                 payment_transaction_id=payment_transaction.transaction_id,
                 fee_type=FeeType.CHARGEBACK_FEE,
-                fee_amount=merchant_billing.chargeback_fee,
-                original_amount=payment_transaction.amount,
+                fee_amount_minor=merchant_billing.chargeback_fee_minor,
+                original_amount_minor=payment_transaction.amount_minor,
                 currency=payment_transaction.currency
             )
             
             self.session.add(fee_transaction)
+            self.revenue_rollups.record(self.session, fee_transaction)
             self.session.commit()
             
             return fee_transaction
@@ -113,12 +106,13 @@ class BillingService:
                 merchant_billing_id=merchant_billing.id,
                 payment_transaction_id=payment_transaction.transaction_id,
                 fee_type=FeeType.REFUND_FEE,
-                fee_amount=merchant_billing.refund_fee,
-                original_amount=payment_transaction.amount,
+                fee_amount_minor=merchant_billing.refund_fee_minor,
+                original_amount_minor=payment_transaction.amount_minor,
                 currency=payment_transaction.currency
             )
             
             self.session.add(fee_transaction)
+            self.revenue_rollups.record(self.session, fee_transaction)
             self.session.commit()
             
             return fee_transaction
@@ -137,6 +131,8 @@ class BillingService:
                 billing_email=f"{merchant_id}@example.com"  # Default, should be updated
             )
             self.session.add(merchant_billing)
+            self.session.flush()  # Apply the billing cycle defaults
+            merchant_billing.next_billing_at = self.next_billing_date(merchant_billing, datetime.utcnow().date())
             self.session.commit()
         
         return merchant_billing
@@ -145,110 +141,7 @@ class BillingService:
         """Generate an invoice for a merchant for a specific period"""
         try:
             merchant_billing = self.get_or_create_merchant_billing(merchant_id)
-            
-            # Get all uninvoiced fee transactions for the period
-            fee_transactions = self.session.query(FeeTransaction).filter(
-                and_(
-                    FeeTransaction.merchant_billing_id == merchant_billing.id,
-                    FeeTransaction.created_at >= period_start,
-                    FeeTransaction.created_at <= period_end,
-                    FeeTransaction.is_invoiced == False
-                )
-            ).all()
-            
-            if not fee_transactions:
-                return None  # No fees to invoice
-            
-            # Create invoice
-            invoice_number = self.generate_invoice_number()
-            invoice = Invoice(
-                invoice_number=invoice_number,
-                merchant_billing_id=merchant_billing.id,
-                billing_period_start=period_start,
-                billing_period_end=period_end,
-                due_date=datetime.utcnow() + timedelta(days=30)  # 30 days payment terms
-            )
-            
-            self.session.add(invoice)
-            self.session.flush()  # Get invoice ID
-            
-            # Group fee transactions by type
-            fee_groups = {}
-            for fee_tx in fee_transactions:
-                fee_type = fee_tx.fee_type
-                if fee_type not in fee_groups:
-                    fee_groups[fee_type] = []
-                fee_groups[fee_type].append(fee_tx)
-            
-            # Create invoice items
-            subtotal = 0
-            for fee_type, transactions in fee_groups.items():
-                if fee_type == FeeType.TRANSACTION_FEE:
-                    # Group transaction fees by card type
-                    european_fees = [tx for tx in transactions if tx.is_european_card]
-                    non_european_fees = [tx for tx in transactions if not tx.is_european_card]
-                    
-                    if european_fees:
-                        total_amount = sum(tx.fee_amount for tx in european_fees)
-                        item = InvoiceItem(
-                            invoice_id=invoice.id,
-                            description=f"European Card Transaction Fees ({len(european_fees)} transactions)",
-                            fee_type=fee_type,
-                            quantity=len(european_fees),
-                            unit_price=total_amount / len(european_fees),
-                            total_price=total_amount
-                        )
-                        self.session.add(item)
-                        subtotal += total_amount
-                    
-                    if non_european_fees:
-                        total_amount = sum(tx.fee_amount for tx in non_european_fees)
-                        item = InvoiceItem(
-                            invoice_id=invoice.id,
-                            description=f"Non-European Card Transaction Fees ({len(non_european_fees)} transactions)",
-                            fee_type=fee_type,
-                            quantity=len(non_european_fees),
-                            unit_price=total_amount / len(non_european_fees),
-                            total_price=total_amount
-                        )
-                        self.session.add(item)
-                        subtotal += total_amount
-                else:
-                    # Other fee types
-                    total_amount = sum(tx.fee_amount for tx in transactions)
-                    description_map = {
-                        FeeType.CHARGEBACK_FEE: "Chargeback Fees",
-                        FeeType.REFUND_FEE: "Refund Fees",
-                        FeeType.MONTHLY_FEE: "Monthly Fees",
-                        FeeType.SETUP_FEE: "Setup Fees"
-                    }
-                    
-                    item = InvoiceItem(
-                        invoice_id=invoice.id,
-                        description=f"{description_map.get(fee_type, 'Other Fees')} ({len(transactions)} items)",
-                        fee_type=fee_type,
-                        quantity=len(transactions),
-                        unit_price=total_amount / len(transactions),
-                        total_price=total_amount
-                    )
-                    self.session.add(item)
-                    subtotal += total_amount
-            
-            # Calculate tax (assuming 0% for now, can be configured)
-            tax_rate = 0.0
-            tax_amount = subtotal * tax_rate
-            total_amount = subtotal + tax_amount
-            
-            # Update invoice totals
-            invoice.subtotal = subtotal
-            invoice.tax_amount = tax_amount
-            invoice.total_amount = total_amount
-            
-            # Mark fee transactions as invoiced
-            for fee_tx in fee_transactions:
-                fee_tx.is_invoiced = True
-                fee_tx.invoice_id = invoice.id
-            
+            invoice = self.create_invoice(merchant_billing.id, period_start, period_end)
             self.session.commit()
             
             return invoice
@@ -257,6 +150,102 @@ class BillingService:
             self.session.rollback()
             raise e
     
+    def create_invoice(self, merchant_billing_id, period_start, period_end):
+        """
+        Invoice a merchant's uninvoiced fees for a period within the current transaction
+        (the caller commits). Returns None if there is nothing to invoice.
+        """
+        uninvoiced = and_(
+            FeeTransaction.merchant_billing_id == merchant_billing_id,
+            FeeTransaction.created_at >= period_start,
+            FeeTransaction.created_at <= period_end,
+            FeeTransaction.is_invoiced == False
+        )
+        if not self.session.query(exists().where(uninvoiced)).scalar():
+            return None  # No fees to invoice
+        
+        # Create invoice
+        invoice = Invoice(
+            invoice_number=self.generate_invoice_number(),
+            merchant_billing_id=merchant_billing_id,
+            billing_period_start=period_start,
+            billing_period_end=period_end,
+            due_date=datetime.utcnow() + timedelta(days=30)  # 30 days payment terms
+        )
+        self.session.add(invoice)
+        self.session.flush()  # Get invoice ID
+        
+        # Claim the fees with one UPDATE, then total exactly the rows it claimed, so a fee
+        # recorded while the invoice is being built is left for the next one
+        claimed = self.session.execute(
+            update(FeeTransaction)
+            .where(uninvoiced)
+            .values(is_invoiced=True, invoice_id=invoice.id)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        if not claimed:
+            self.session.delete(invoice)
+            self.session.flush()
+            return None
+        
+        # Transaction fees are itemised by card region, other fees by type
+        is_transaction_fee = FeeTransaction.fee_type == FeeType.TRANSACTION_FEE
+        card_region = case(
+            (and_(is_transaction_fee, FeeTransaction.is_european_card == True), 'european'),
+            (is_transaction_fee, 'non_european'),
+            else_=''
+        ).label('card_region')
+        groups = self.session.execute(
+            select(
+                FeeTransaction.fee_type, card_region,
+                func.count(FeeTransaction.id).label('quantity'),
+                func.sum(FeeTransaction.fee_amount_minor).label('total_minor')
+            )
+            .where(FeeTransaction.invoice_id == invoice.id)
+            .group_by(FeeTransaction.fee_type, card_region)
+        ).all()
+        
+        description_map = {
+            FeeType.CHARGEBACK_FEE: "Chargeback Fees",
+            FeeType.REFUND_FEE: "Refund Fees",
+            FeeType.MONTHLY_FEE: "Monthly Fees",
+            FeeType.SETUP_FEE: "Setup Fees"
+        }
+        fee_type_order = list(FeeType)
+        
+        # Create invoice items; amounts are integer cents throughout
+        subtotal = 0
+        items = []
+        for group in sorted(groups, key=lambda row: (fee_type_order.index(row.fee_type), row.card_region != 'european')):
+            if group.card_region == 'european':
+                description = f"European Card Transaction Fees ({group.quantity} transactions)"
+            elif group.card_region == 'non_european':
+                description = f"Non-European Card Transaction Fees ({group.quantity} transactions)"
+            else:
+                description = f"{description_map.get(group.fee_type, 'Other Fees')} ({group.quantity} items)"
+            
+            items.append(InvoiceItem(
+                invoice_id=invoice.id,
+                description=description,
+                fee_type=group.fee_type,
+                quantity=group.quantity,
+                unit_price_minor=to_minor(from_minor(group.total_minor) / group.quantity),
+                total_price_minor=int(group.total_minor)
+            ))
+            subtotal += int(group.total_minor)
+        self.session.add_all(items)
+        
+        # Calculate tax (assuming 0% for now, can be configured)
+        tax_rate = Decimal('0')
+        tax_amount = to_minor(from_minor(subtotal) * tax_rate)
+        
+        # Update invoice totals
+        invoice.subtotal_minor = subtotal
+        invoice.tax_amount_minor = tax_amount
+        invoice.total_amount_minor = subtotal + tax_amount
+        
+        return invoice
+    
     def generate_invoice_number(self):
         """Generate a unique invoice number"""
         timestamp = datetime.utcnow().strftime("%Y%m%d")
@@ -272,24 +261,17 @@ class BillingService:
         
         merchant_billing = self.get_or_create_merchant_billing(merchant_id)
         
-        # Get fee transactions for the period
-        fee_transactions = self.session.query(FeeTransaction).filter(
-            and_(
-                FeeTransaction.merchant_billing_id == merchant_billing.id,
-                FeeTransaction.created_at >= period_start,
-                FeeTransaction.created_at <= period_end
-            )
-        ).all()
+        # Whole days come from the daily rollups, partial days from the fee transactions
+        metrics, _ = self.revenue_rollups.summary(self.session, period_start, period_end, merchant_billing.id)
         
-        # Calculate summary
         summary = {
-            'total_revenue': sum(tx.fee_amount for tx in fee_transactions),
-            'transaction_fees': sum(tx.fee_amount for tx in fee_transactions if tx.fee_type == FeeType.TRANSACTION_FEE),
-            'chargeback_fees': sum(tx.fee_amount for tx in fee_transactions if tx.fee_type == FeeType.CHARGEBACK_FEE),
-            'refund_fees': sum(tx.fee_amount for tx in fee_transactions if tx.fee_type == FeeType.REFUND_FEE),
-            'transaction_count': len([tx for tx in fee_transactions if tx.fee_type == FeeType.TRANSACTION_FEE]),
-            'european_transactions': len([tx for tx in fee_transactions if tx.fee_type == FeeType.TRANSACTION_FEE and tx.is_european_card]),
-            'non_european_transactions': len([tx for tx in fee_transactions if tx.fee_type == FeeType.TRANSACTION_FEE and not tx.is_european_card]),
+            'total_revenue': to_float(metrics['total_revenue_minor']),
+            'transaction_fees': to_float(metrics['transaction_fee_revenue_minor']),
+            'chargeback_fees': to_float(metrics['chargeback_fee_revenue_minor']),
+            'refund_fees': to_float(metrics['refund_fee_revenue_minor']),
+            'transaction_count': metrics['total_transactions'],
+            'european_transactions': metrics['european_transactions'],
+            'non_european_transactions': metrics['non_european_transactions'],
             'period_start': period_start,
             'period_end': period_end
         }
@@ -303,69 +285,77 @@ class BillingService:
         if period_end is None:
             period_end = datetime.utcnow()
         
-        # Get all fee transactions for the period
-        fee_transactions = self.session.query(FeeTransaction).filter(
-            and_(
-                FeeTransaction.created_at >= period_start,
-                FeeTransaction.created_at <= period_end
-            )
-        ).all()
+        metrics, active_merchants = self.revenue_rollups.summary(self.session, period_start, period_end)
         
-        # Calculate summary
         summary = {
-            'total_revenue': sum(tx.fee_amount for tx in fee_transactions),
-            'transaction_fees': sum(tx.fee_amount for tx in fee_transactions if tx.fee_type == FeeType.TRANSACTION_FEE),
-            'chargeback_fees': sum(tx.fee_amount for tx in fee_transactions if tx.fee_type == FeeType.CHARGEBACK_FEE),
-            'refund_fees': sum(tx.fee_amount for tx in fee_transactions if tx.fee_type == FeeType.REFUND_FEE),
-            'total_transactions': len([tx for tx in fee_transactions if tx.fee_type == FeeType.TRANSACTION_FEE]),
-            'european_transactions': len([tx for tx in fee_transactions if tx.fee_type == FeeType.TRANSACTION_FEE and tx.is_european_card]),
-            'non_european_transactions': len([tx for tx in fee_transactions if tx.fee_type == FeeType.TRANSACTION_FEE and not tx.is_european_card]),
-            'active_merchants': len(set(tx.merchant_billing.merchant_id for tx in fee_transactions)),
+            'total_revenue': to_float(metrics['total_revenue_minor']),
+            'transaction_fees': to_float(metrics['transaction_fee_revenue_minor']),
+            'chargeback_fees': to_float(metrics['chargeback_fee_revenue_minor']),
+            'refund_fees': to_float(metrics['refund_fee_revenue_minor']),
+            'total_transactions': metrics['total_transactions'],
+            'european_transactions': metrics['european_transactions'],
+            'non_european_transactions': metrics['non_european_transactions'],
+            'active_merchants': len(active_merchants),
             'period_start': period_start,
             'period_end': period_end
         }
         
         return summary
     
-    def process_automatic_billing(self):
+    def rebuild_revenue_rollups(self, start=None, end=None):
+        """Recompute the daily revenue rollups from fee transactions (backfill or repair)"""
+        try:
+            written = self.revenue_rollups.rebuild(self.session.connection(), start, end)
+            self.session.commit()
+            return written
+        except Exception as e:
+            self.session.rollback()
+            raise e
+    
+    def process_automatic_billing(self, today=None, workers=1):
         """Process automatic billing for all merchants with auto-billing enabled"""
-        today = datetime.utcnow().date()
-        
-        # Get all merchant billings with auto-billing enabled
-        merchant_billings = self.session.query(MerchantBilling).filter(
-            MerchantBilling.auto_billing_enabled == True
-        ).all()
+        from src.services.invoice_run import InvoiceRunService
         
-        invoices_generated = []
+        today = today or datetime.utcnow().date()
         
-        for merchant_billing in merchant_billings:
-            # Check if it's time to generate an invoice
-            if self.should_generate_invoice(merchant_billing, today):
-                period_start, period_end = self.get_billing_period(merchant_billing, today)
-                
-                try:
-                    invoice = self.generate_invoice(
-                        merchant_billing.merchant_id,
-                        period_start,
-                        period_end
-                    )
-                    if invoice:
-                        invoices_generated.append(invoice)
-                except Exception as e:
-                    print(f"Error generating invoice for merchant {merchant_billing.merchant_id}: {e}")
+        # Only merchants whose next billing date has arrived are read; dates missed while the
+        # job was not running are caught up oldest first, one run per date. Due merchants are
+        # invoiced in chunks (across worker processes when workers > 1), and a run
+        # interrupted part way resumes when started again
+        summaries = InvoiceRunService().run_due(today, workers=workers)
+        for summary in summaries:
+            for failure in summary['errors']:
+                logger.error(f"Error generating invoice for merchant billing {failure['merchant_billing_id']}: {failure['error']}")
         
-        return invoices_generated
+        return self.session.query(Invoice).join(InvoiceRunItem, InvoiceRunItem.invoice_id == Invoice.id).filter(
+            InvoiceRunItem.run_id.in_([summary['run_id'] for summary in summaries])
+        ).all()
     
     def should_generate_invoice(self, merchant_billing, today):
         """Check if an invoice should be generated for a merchant"""
-        if merchant_billing.billing_cycle == BillingCycle.MONTHLY:
-            return today.day == merchant_billing.billing_day
-        elif merchant_billing.billing_cycle == BillingCycle.WEEKLY:
-            return today.weekday() == merchant_billing.billing_day
+        return self.next_billing_date(merchant_billing, today) == datetime.combine(today, datetime.min.time())
+    
+    def next_billing_date(self, merchant_billing, on_or_after):
+        """
+        The first day on or after on_or_after on which the merchant is invoiced (as a datetime
+        at midnight). Monthly billing days past the end of a month fall on its last day.
+        """
+        if merchant_billing.billing_cycle == BillingCycle.WEEKLY:
+            days_ahead = (merchant_billing.billing_day % 7 - on_or_after.weekday()) % 7
+            due = on_or_after + timedelta(days=days_ahead)
         elif merchant_billing.billing_cycle == BillingCycle.DAILY:
-            return True
+            due = on_or_after
+        else:  # MONTHLY
+            due = self._monthly_billing_day(on_or_after.year, on_or_after.month, merchant_billing.billing_day)
+            if due < on_or_after:
+                year, month = (on_or_after.year + 1, 1) if on_or_after.month == 12 else (on_or_after.year, on_or_after.month + 1)
+                due = self._monthly_billing_day(year, month, merchant_billing.billing_day)
         
-        return False
+        return datetime.combine(due, datetime.min.time())
+    
+    def _monthly_billing_day(self, year, month, billing_day):
+        last_day = calendar.monthrange(year, month)[1]
+        return date(year, month, min(max(billing_day or 1, 1), last_day))
     
     def get_billing_period(self, merchant_billing, today):
         """Get the billing period for a merchant"""
@@ -3,7 +3,7 @@ from typing import Dict, Any, List
 from datetime import datetime, timedelta
 from src.models.payment import Payment, TransactionLog
 from src.models.user import Merchant
-import json
+from src.services.audit_log import get_audit_log, subject_hash
 
 logger = logging.getLogger(__name__)
 
@@ -198,7 +198,7 @@ class ComplianceService:
     def _requires_sca(self, payment: Payment) -> bool:
         """Check if Strong Customer Authentication is required"""
         # SCA required for amounts over 30 EUR
-        if float(payment.amount) > self.psd2_sca_threshold:
+        if payment.amount_minor > self.psd2_sca_threshold:
             return True
         
         # SCA required for high-risk transactions
@@ -210,7 +210,7 @@ class ComplianceService:
     def _has_sca_exemption(self, payment: Payment) -> bool:
         """Check if transaction qualifies for SCA exemption"""
         # Low-value exemption (under 30 EUR)
-        if float(payment.amount) <= self.psd2_sca_threshold:
+        if payment.amount_minor <= self.psd2_sca_threshold:
             return True
         
         # Trusted beneficiary exemption (simplified for demo)
@@ -237,7 +237,7 @@ class ComplianceService:
         """Validate transaction against PSD2 limits"""
         # EU instant payment limit is 100,000 EUR
         max_amount = 10000000  # 100,000 EUR in cents
-        return float(payment.amount) <= max_amount
+        return payment.amount_minor <= max_amount
     
     def _validate_data_minimization(self, payment: Payment) -> bool:
         """Validate GDPR data minimization principle"""
@@ -337,22 +337,14 @@ class ComplianceService:
         
         return recommendations
     
-    def log_compliance_event(self, event_type: str, details: Dict[str, Any]):
-        """Log compliance-related events for audit trail"""
+    def log_compliance_event(self, event_type: str, details: Dict[str, Any], merchant_id: str = None):
+        """Record a compliance event in the hash-chained audit log"""
         try:
-            log_entry = {
-                'timestamp': datetime.utcnow().isoformat(),
-                'event_type': event_type,
-                'details': details
-            }
-            
-            # In production, this would be stored in a secure audit log
-            logger.info(f"Compliance event logged: {json.dumps(log_entry)}")
-            
+            get_audit_log().append(event_type, details, merchant_id=merchant_id)
         except Exception as e:
             logger.error(f"Error logging compliance event: {str(e)}")
     
-    def handle_data_subject_request(self, request_type: str, customer_email: str) -> Dict[str, Any]:
+    def handle_data_subject_request(self, request_type: str, customer_email: str, merchant_id: str = None) -> Dict[str, Any]:
         """
         Handle GDPR data subject requests (access, rectification, erasure, portability)
         """
@@ -377,7 +369,16 @@ class ComplianceService:
                 # Provide data in machine-readable format
                 result['data_export'] = self._export_customer_data(customer_email)
             
-            self.log_compliance_event('data_subject_request', result)
+            # The audit log is append-only, so it records the request but never the subject's data
+            audit_details = {
+                'request_type': request_type,
+                'subject': subject_hash(customer_email),
+                'status': result['status'],
+                'processed_at': result['processed_at']
+            }
+            if 'deleted_records' in result:
+                audit_details['deleted_records'] = result['deleted_records']
+            self.log_compliance_event('data_subject_request', audit_details, merchant_id=merchant_id)
             return result
             
         except Exception as e:
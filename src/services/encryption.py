@@ -1,4 +1,5 @@
 import hashlib
+import hmac
 import secrets
 import base64
 import logging
@@ -6,37 +7,166 @@ from cryptography.fernet import Fernet
 from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
 import os
+import threading
+from typing import Dict, List
+from src.services.token_vault import TokenVault, get_token_vault
 
 logger = logging.getLogger(__name__)
 
-class EncryptionService:
+# Ciphertexts written before key ids were introduced were encrypted with this key version
+LEGACY_KEY_ID = 'v1'
+
+class KeyRing:
     """
-    Encryption service for handling sensitive data like card numbers
-    Implements tokenization and encryption for PCI DSS compliance
+    Process-wide set of versioned encryption keys.
+    Each key version is derived from its master secret once and reused; ciphertexts
+    carry the key id so data encrypted under a retired version still decrypts.
     """
     
-    def __init__(self):
+    def __init__(self, master_keys: Dict[str, str], current_key_id: str, salt: bytes, iterations: int = 100000):
+        self.salt = salt
+        self.iterations = iterations
+        self._master_keys = dict(master_keys)
+        self._current_key_id = current_key_id
+        self._fernets = {}
+        self._lock = threading.Lock()
+    
+    @classmethod
+    def from_environment(cls) -> 'KeyRing':
+        """
+        Build the keyring from ENCRYPTION_MASTER_KEY / ENCRYPTION_KEY_ID plus any retired
+        versions listed in ENCRYPTION_PREVIOUS_KEYS as "key_id:secret,key_id:secret"
+        """
         # In production, these would be stored securely (e.g., AWS KMS, HashiCorp Vault)
-        self.master_key = os.environ.get('ENCRYPTION_MASTER_KEY', 'default-master-key-change-in-production')
-        self.salt = b'stable_salt_for_demo'  # In production, use random salt per encryption
+        current_key_id = os.environ.get('ENCRYPTION_KEY_ID', LEGACY_KEY_ID)
+        master_keys = {}
+        for entry in os.environ.get('ENCRYPTION_PREVIOUS_KEYS', '').split(','):
+            if ':' in entry:
+                key_id, secret = entry.split(':', 1)
+                master_keys[key_id.strip()] = secret.strip()
+        master_keys[current_key_id] = os.environ.get('ENCRYPTION_MASTER_KEY', 'default-master-key-change-in-production')
         
-    def _get_encryption_key(self) -> bytes:
+        return cls(master_keys, current_key_id, salt=b'stable_salt_for_demo')
+    
+    @property
+    def current_key_id(self) -> str:
+        return self._current_key_id
+    
+    def derive_key(self, key_id: str) -> bytes:
         """
-        Derive encryption key from master key
+        Derive the Fernet key for a key version from its master secret (uncached)
         """
+        if key_id not in self._master_keys:
+            raise KeyError(f"Unknown encryption key id: {key_id}")
+        
         kdf = PBKDF2HMAC(
             algorithm=hashes.SHA256(),
             length=32,
             salt=self.salt,
-            iterations=100000,
+            iterations=self.iterations,
         )
-        key = base64.urlsafe_b64encode(kdf.derive(self.master_key.encode()))
-        return key
+        return base64.urlsafe_b64encode(kdf.derive(self._master_keys[key_id].encode()))
+    
+    def fernet(self, key_id: str = None) -> Fernet:
+        """
+        Return the cipher for a key version, deriving its key on first use
+        """
+        key_id = key_id or self._current_key_id
+        cipher = self._fernets.get(key_id)
+        if cipher is None:
+            with self._lock:
+                cipher = self._fernets.get(key_id)
+                if cipher is None:
+                    cipher = Fernet(self.derive_key(key_id))
+                    self._fernets[key_id] = cipher
+        return cipher
+    
+    def rotate(self, key_id: str, master_key: str):
+        """
+        Make a new key version current. Previous versions stay available for decryption,
+        but every cached derived key is dropped and re-derived only when next needed.
+        """
+        with self._lock:
+            if key_id in self._master_keys and self._master_keys[key_id] != master_key:
+                raise ValueError(f"Key id {key_id} is already in use")
+            self._master_keys[key_id] = master_key
+            self._current_key_id = key_id
+            self._fernets.clear()
+        logger.info(f"Encryption key rotated, current key id: {key_id}")
+    
+    def retire(self, key_id: str):
+        """
+        Remove a key version; data still encrypted under it can no longer be decrypted
+        """
+        with self._lock:
+            if key_id == self._current_key_id:
+                raise ValueError("Cannot retire the current encryption key")
+            self._master_keys.pop(key_id, None)
+            self._fernets.pop(key_id, None)
+    
+    def key_ids(self) -> List[str]:
+        return list(self._master_keys)
+
+_keyring = None
+_keyring_lock = threading.Lock()
+
+def get_keyring() -> KeyRing:
+    """
+    Return the process-wide keyring
+    """
+    global _keyring
+    if _keyring is None:
+        with _keyring_lock:
+            if _keyring is None:
+                _keyring = KeyRing.from_environment()
+    return _keyring
+
+class EncryptionService:
+    """
+    Encryption service for handling sensitive data like card numbers
+    Implements tokenization and encryption for PCI DSS compliance
+    """
+    
+    def __init__(self, keyring: KeyRing = None, vault: TokenVault = None):
+        self.keyring = keyring or get_keyring()
+        self._vault = vault
+        # Keyed so fingerprints cannot be brute-forced from the card number space without the key
+        self.fingerprint_key = os.environ.get('CARD_FINGERPRINT_KEY', 'default-fingerprint-key-change-in-production').encode()
+        
+    @property
+    def vault(self) -> TokenVault:
+        if self._vault is None:
+            self._vault = get_token_vault()
+        return self._vault
+    
+    def _encrypt(self, data: bytes) -> str:
+        """
+        Encrypt with the current key version and tag the result with its key id
+        """
+        key_id = self.keyring.current_key_id
+        encrypted = self.keyring.fernet(key_id).encrypt(data)
+        return f"{key_id}:{base64.urlsafe_b64encode(encrypted).decode()}"
+    
+    def _decrypt(self, ciphertext: str) -> bytes:
+        """
+        Decrypt a key-id-tagged ciphertext; untagged values predate key ids
+        """
+        key_id, _, encoded = ciphertext.rpartition(':')
+        fernet = self.keyring.fernet(key_id or LEGACY_KEY_ID)
+        return fernet.decrypt(base64.urlsafe_b64decode(encoded.encode()))
+    
+    def card_fingerprint(self, card_number: str) -> bytes:
+        """
+        Keyed fingerprint of a card number, used to find an existing token for the same card
+        """
+        clean_card = ''.join(filter(str.isdigit, card_number))
+        return hmac.new(self.fingerprint_key, clean_card.encode(), hashlib.sha256).digest()
     
     def tokenize_card(self, card_number: str) -> str:
         """
         Tokenize a card number for secure storage
-        Returns a token that can be used to reference the card without storing the actual number
+        Returns a token that can be used to reference the card without storing the actual number.
+        The same card number always returns the same token.
         """
         try:
             # Remove any spaces or dashes
@@ -46,19 +176,16 @@ class EncryptionService:
             if not self._validate_card_number(clean_card):
                 raise ValueError("Invalid card number format")
             
-            # Create a secure token
-            # In production, this would store the mapping in a secure vault
-            token_data = f"{clean_card}:{secrets.token_urlsafe(16)}"
-            
-            # Encrypt the token data
-            fernet = Fernet(self._get_encryption_key())
-            encrypted_token = fernet.encrypt(token_data.encode())
+            # Known cards resolve through the fingerprint index
+            fingerprint = self.card_fingerprint(clean_card)
+            token = self.vault.find_token(fingerprint)
+            if token:
+                return token
             
-            # Return base64 encoded token
-            token = base64.urlsafe_b64encode(encrypted_token).decode()
+            token = self.vault.store(fingerprint, self._encrypt(clean_card.encode()), clean_card[-4:])
             
-            logger.info(f"Card tokenized successfully, token length: {len(token)}")
-            return f"tok_{token[:32]}"  # Truncate for demo purposes
+            logger.info("Card tokenized successfully")
+            return token
             
         except Exception as e:
             logger.error(f"Error tokenizing card: {str(e)}")
@@ -73,17 +200,29 @@ class EncryptionService:
             if not token.startswith('tok_'):
                 raise ValueError("Invalid token format")
             
-            # Remove token prefix
-            token_data = token[4:]
+            ciphertext = self.vault.get(token)
+            if ciphertext is None:
+                raise ValueError("Unknown token")
             
-            # In a real implementation, this would retrieve from secure vault
-            # For demo purposes, we'll return a masked number
-            return "****-****-****-1234"  # Always return masked for security
+            return self._decrypt(ciphertext).decode()
             
         except Exception as e:
             logger.error(f"Error detokenizing card: {str(e)}")
             raise ValueError("Card detokenization failed")
     
+    def detokenize_cards(self, tokens: List[str]) -> Dict[str, str]:
+        """
+        Retrieve the card numbers for many tokens at once (settlement and reconciliation jobs).
+        Returns a mapping of token to card number; unknown tokens are omitted.
+        """
+        try:
+            ciphertexts = self.vault.get_many([token for token in tokens if token.startswith('tok_')])
+            return {token: self._decrypt(ciphertext).decode() for token, ciphertext in ciphertexts.items()}
+            
+        except Exception as e:
+            logger.error(f"Error detokenizing cards: {str(e)}")
+            raise ValueError("Card detokenization failed")
+    
     def _validate_card_number(self, card_number: str) -> bool:
         """
         Validate card number using Luhn algorithm
@@ -112,9 +251,7 @@ class EncryptionService:
         Encrypt sensitive data for storage
         """
         try:
-            fernet = Fernet(self._get_encryption_key())
-            encrypted_data = fernet.encrypt(data.encode())
-            return base64.urlsafe_b64encode(encrypted_data).decode()
+            return self._encrypt(data.encode())
             
         except Exception as e:
             logger.error(f"Error encrypting data: {str(e)}")
@@ -125,10 +262,7 @@ class EncryptionService:
         Decrypt sensitive data
         """
         try:
-            fernet = Fernet(self._get_encryption_key())
-            decoded_data = base64.urlsafe_b64decode(encrypted_data.encode())
-            decrypted_data = fernet.decrypt(decoded_data)
-            return decrypted_data.decode()
+            return self._decrypt(encrypted_data).decode()
             
         except Exception as e:
             logger.error(f"Error decrypting data: {str(e)}")
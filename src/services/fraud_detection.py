@@ -1,7 +1,8 @@
 import logging
-import re
 from typing import Dict, Any
 from src.models.payment import Payment
+from src.services.fraud_rules import get_email_rules
+from src.services.velocity import ENTITIES, get_velocity_store
 import random
 import math
 
@@ -12,14 +13,30 @@ class FraudDetectionService:
     Fraud detection service that analyzes transactions for potential fraud
     """
     
-    def __init__(self):
+    def __init__(self, velocity_store=None):
         self.high_risk_countries = ['XX', 'YY']  # Example high-risk country codes
-        self.suspicious_email_patterns = [
-            r'.*temp.*@.*',
-            r'.*test.*@.*',
-            r'.*fake.*@.*'
+        self._velocity_store = velocity_store
+        # (entity, window, transactions at which the rule fires, risk added)
+        self.velocity_rules = [
+            ('card_token', '1m', 3, 0.2),
+            ('card_token', '1h', 10, 0.15),
+            ('card_token', '24h', 25, 0.1),
+            ('customer_email', '1m', 3, 0.15),
+            ('customer_email', '1h', 10, 0.1),
+            ('customer_email', '24h', 30, 0.05),
+            ('ip_address', '1m', 5, 0.15),
+            ('ip_address', '1h', 30, 0.1),
+            ('ip_address', '24h', 100, 0.05),
+            ('merchant_id', '1m', 300, 0.15),  # card-testing bursts against one merchant
+            ('merchant_id', '1h', 5000, 0.05)
         ]
         
+    @property
+    def velocity_store(self):
+        if self._velocity_store is None:
+            self._velocity_store = get_velocity_store()
+        return self._velocity_store
+    
     def analyze_transaction(self, payment: Payment, transaction_data: Dict[str, Any]) -> float:
         """
         Analyze a transaction and return a fraud score (0.0 to 1.0)
@@ -29,7 +46,7 @@ class FraudDetectionService:
             fraud_score = 0.0
             
             # Amount-based risk
-            fraud_score += self._analyze_amount_risk(payment.amount)
+            fraud_score += self._analyze_amount_risk(payment.amount_minor)
             
             # Email-based risk
             if payment.customer_email:
@@ -39,8 +56,9 @@ class FraudDetectionService:
             if payment.ip_address:
                 fraud_score += self._analyze_ip_risk(payment.ip_address)
             
-            # Velocity checks
+            # Velocity checks (against earlier transactions), then count this one
             fraud_score += self._analyze_velocity_risk(payment)
+            self._record_velocity(payment)
             
             # Card-based risk
             if payment.card_token:
@@ -60,19 +78,27 @@ class FraudDetectionService:
             logger.error(f"Error analyzing fraud for transaction {payment.transaction_id}: {str(e)}")
             return 0.5  # Default medium risk on error
     
-    def _analyze_amount_risk(self, amount: float) -> float:
+    def analyze_batch(self, start, end, chunk_size: int = 50000, dry_run: bool = False, progress=None) -> Dict[str, Any]:
+        """
+        Rescore every payment created in [start, end) with vectorized feature passes
+        and write the scores back in bulk (see fraud_batch.BatchFraudScorer)
+        """
+        from src.services.fraud_batch import BatchFraudScorer
+
+        scorer = BatchFraudScorer(self.velocity_rules)
+        return scorer.rescore(start, end, chunk_size=chunk_size, dry_run=dry_run, progress=progress)
+
+    def _analyze_amount_risk(self, amount_minor: int) -> float:
         """
-        Analyze risk based on transaction amount
+        Analyze risk based on transaction amount (in minor units)
         """
         try:
-            amount_float = float(amount)
-            
             # Very high amounts are riskier
-            if amount_float > 100000:  # Over 1000 EUR
+            if amount_minor > 100000:  # Over 1000 EUR
                 return 0.4
-            elif amount_float > 50000:  # Over 500 EUR
+            elif amount_minor > 50000:  # Over 500 EUR
                 return 0.2
-            elif amount_float > 20000:  # Over 200 EUR
+            elif amount_minor > 20000:  # Over 200 EUR
                 return 0.1
             else:
                 return 0.0
@@ -83,24 +109,23 @@ class FraudDetectionService:
     def _analyze_email_risk(self, email: str) -> float:
         """
         Analyze risk based on customer email
+        Rules are loaded from src/data/fraud and hot-reloaded (see fraud_rules)
         """
         try:
+            rules = get_email_rules()
             risk_score = 0.0
+            local_part, _, email_domain = email.lower().rpartition('@')
             
-            # Check for suspicious email patterns
-            for pattern in self.suspicious_email_patterns:
-                if re.match(pattern, email.lower()):
-                    risk_score += 0.3
-                    break
+            # Check for suspicious keywords in the local part
+            if rules.has_suspicious_keyword(local_part):
+                risk_score += 0.3
             
             # Check for disposable email domains
-            disposable_domains = ['tempmail.com', '10minutemail.com', 'guerrillamail.com']
-            email_domain = email.split('@')[-1].lower()
-            if email_domain in disposable_domains:
+            if rules.is_disposable_domain(email_domain):
                 risk_score += 0.4
             
             # Check for recently created domains (simplified check)
-            if email_domain.endswith('.tk') or email_domain.endswith('.ml'):
+            if rules.has_risky_tld(email_domain):
                 risk_score += 0.2
             
             return min(risk_score, 0.5)
@@ -142,20 +167,33 @@ class FraudDetectionService:
     def _analyze_velocity_risk(self, payment: Payment) -> float:
         """
         Analyze risk based on transaction velocity
-        (frequency of transactions from same merchant/customer)
+        (frequency of transactions from same merchant/card/customer/IP)
         """
         try:
-            # Simplified velocity check
-            # In production, this would query the database for recent transactions
+            velocity_risk = 0.0
+            counts = {}
             
-            # Simulate velocity risk
-            velocity_risk = random.uniform(0.0, 0.3)
+            for entity, window, threshold, risk in self.velocity_rules:
+                if entity not in counts:
+                    counts[entity] = self.velocity_store.counts(entity, getattr(payment, entity))
+                if counts[entity][window] >= threshold:
+                    velocity_risk += risk
             
-            return velocity_risk
+            return min(velocity_risk, 0.3)
             
-        except Exception:
+        except Exception as e:
+            logger.error(f"Error analyzing velocity risk: {str(e)}")
             return 0.1
     
+    def _record_velocity(self, payment: Payment):
+        """
+        Count a transaction in the shared velocity counters
+        """
+        try:
+            self.velocity_store.record({entity: getattr(payment, entity) for entity in ENTITIES})
+        except Exception as e:
+            logger.error(f"Error recording transaction velocity: {str(e)}")
+    
     def _analyze_card_risk(self, card_token: str) -> float:
         """
         Analyze risk based on card information
@@ -0,0 +1,176 @@
+import logging
+import os
+import threading
+import time
+from collections import deque
+from typing import Dict, Iterable, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RULES_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data', 'fraud')
+
+RULE_FILES = {
+    'email_keywords': 'email_keywords.txt',
+    'disposable_domains': 'disposable_domains.txt',
+    'risky_tlds': 'risky_tlds.txt'
+}
+
+class KeywordAutomaton:
+    """
+    Aho-Corasick automaton over a set of keywords.
+    Checking a string costs O(len(string)) no matter how many keywords are loaded.
+    """
+
+    def __init__(self, keywords: Iterable[str]):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._match: List[bool] = [False]
+
+        for keyword in keywords:
+            state = 0
+            for char in keyword:
+                next_state = self._goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self._goto)
+                    self._goto[state][char] = next_state
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._match.append(False)
+                state = next_state
+            self._match[state] = True
+
+        # Breadth-first pass to set failure links; depth-1 states fail back to the root
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[next_state] = self._goto[fallback].get(char, 0)
+                self._match[next_state] = self._match[next_state] or self._match[self._fail[next_state]]
+
+    def search(self, text: str) -> bool:
+        """
+        Return True if any keyword occurs in the text
+        """
+        goto, fail, match = self._goto, self._fail, self._match
+        state = 0
+        for char in text:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if match[state]:
+                return True
+        return False
+
+class EmailRuleSet:
+    """
+    Compiled email risk rules: a keyword automaton for the local part,
+    and hash sets for disposable domains and risky TLDs.
+    """
+
+    def __init__(self, keywords: Iterable[str], disposable_domains: Iterable[str], risky_tlds: Iterable[str]):
+        self.keywords = KeywordAutomaton(keywords)
+        self.disposable_domains = frozenset(disposable_domains)
+        self.risky_tlds = frozenset(risky_tlds)
+
+    def has_suspicious_keyword(self, local_part: str) -> bool:
+        return self.keywords.search(local_part)
+
+    def is_disposable_domain(self, domain: str) -> bool:
+        """
+        Match the domain or any parent domain, so mail.tempmail.com matches tempmail.com
+        """
+        labels = domain.split('.')
+        return any('.'.join(labels[i:]) in self.disposable_domains for i in range(len(labels) - 1))
+
+    def has_risky_tld(self, domain: str) -> bool:
+        return domain.rpartition('.')[2] in self.risky_tlds
+
+def _read_rule_file(path: str) -> List[str]:
+    """
+    One entry per line; blank lines and # comments are ignored
+    """
+    entries = []
+    with open(path, encoding='utf-8') as rule_file:
+        for line in rule_file:
+            entry = line.split('#', 1)[0].strip().lower()
+            if entry:
+                entries.append(entry)
+    return entries
+
+class EmailRuleLoader:
+    """
+    Loads the email rule set from data files and reloads it when a file changes.
+    File modification times are checked at most once per reload interval, and a
+    reloaded rule set replaces the old one atomically.
+    """
+
+    def __init__(self, rules_dir: str, reload_interval: float = 30.0):
+        self.rules_dir = rules_dir
+        self.reload_interval = reload_interval
+        self._rules = None
+        self._mtimes = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def _file_mtimes(self) -> Tuple[int, ...]:
+        return tuple(
+            os.stat(os.path.join(self.rules_dir, filename)).st_mtime_ns
+            for filename in RULE_FILES.values()
+        )
+
+    def _load(self, mtimes: Tuple[int, ...]):
+        entries = {
+            name: _read_rule_file(os.path.join(self.rules_dir, filename))
+            for name, filename in RULE_FILES.items()
+        }
+        self._rules = EmailRuleSet(
+            entries['email_keywords'], entries['disposable_domains'], entries['risky_tlds']
+        )
+        self._mtimes = mtimes
+        logger.info(
+            f"Loaded email fraud rules: {len(entries['email_keywords'])} keywords, "
+            f"{len(entries['disposable_domains'])} disposable domains, {len(entries['risky_tlds'])} TLDs"
+        )
+
+    def get(self) -> EmailRuleSet:
+        """
+        Return the current rule set, reloading it first if the data files changed
+        """
+        now = time.monotonic()
+        if self._rules is not None and now - self._checked_at < self.reload_interval:
+            return self._rules
+
+        with self._lock:
+            if self._rules is None or now - self._checked_at >= self.reload_interval:
+                try:
+                    mtimes = self._file_mtimes()
+                    if mtimes != self._mtimes:
+                        self._load(mtimes)
+                except Exception as e:
+                    if self._rules is None:
+                        raise
+                    logger.error(f"Error reloading email fraud rules, keeping previous set: {str(e)}")
+                self._checked_at = now
+
+        return self._rules
+
+_loader = None
+_loader_lock = threading.Lock()
+
+def get_email_rules() -> EmailRuleSet:
+    """
+    Return the process-wide email rule set (FRAUD_RULES_DIR, or src/data/fraud)
+    """
+    global _loader
+    if _loader is None:
+        with _loader_lock:
+            if _loader is None:
+                _loader = EmailRuleLoader(
+                    os.environ.get('FRAUD_RULES_DIR', DEFAULT_RULES_DIR),
+                    float(os.environ.get('FRAUD_RULES_RELOAD_SECONDS', 30))
+                )
+    return _loader.get()
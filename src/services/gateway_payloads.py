@@ -0,0 +1,36 @@
+"""
+Gateway responses for transaction logs, stored compactly in their own table
+"""
+
+import json
+import zlib
+
+# Bumped when the stored document changes shape; decode_payload upgrades older versions
+PAYLOAD_VERSION = 1
+
+ENCODING_JSON = 'json'
+ENCODING_JSON_ZLIB = 'json+zlib'
+
+# Typical authorization responses are around 150 bytes of JSON, which zlib can't shrink;
+# larger documents (network error details, 3-D Secure data) are compressed
+COMPRESS_THRESHOLD = 256
+COMPRESS_LEVEL = 6
+
+def encode_payload(response):
+    """(encoding, data) for a gateway response: compact JSON, zlib-compressed when that helps"""
+    data = json.dumps(response, separators=(',', ':'), sort_keys=True, default=str).encode('utf-8')
+    if len(data) > COMPRESS_THRESHOLD:
+        compressed = zlib.compress(data, COMPRESS_LEVEL)
+        if len(compressed) < len(data):
+            return ENCODING_JSON_ZLIB, compressed
+    return ENCODING_JSON, data
+
+def decode_payload(version, encoding, data):
+    """The gateway response stored as (version, encoding, data)"""
+    if encoding == ENCODING_JSON_ZLIB:
+        data = zlib.decompress(data)
+    elif encoding != ENCODING_JSON:
+        raise ValueError(f"Unknown gateway payload encoding: {encoding}")
+    if version != PAYLOAD_VERSION:
+        raise ValueError(f"Unknown gateway payload version: {version}")
+    return json.loads(data)
@@ -0,0 +1,279 @@
+"""
+Automatic billing runs: invoice every merchant that is due, in parallel worker processes
+"""
+
+import logging
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import delete, func, select, update
+from src.database import db
+from src.models.billing import InvoiceRun, InvoiceRunItem, MerchantBilling
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 200
+COMMIT_BATCH_SIZE = 50
+
+def _init_worker(database_uri):
+    """
+    Give each worker process a minimal app of its own: the database and nothing else (no
+    blueprints, velocity store or warm-up), with connections not shared with the parent
+    """
+    from flask import Flask
+    from src.database import init_db
+
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = database_uri
+    init_db(app)
+    app.app_context().push()
+
+def invoice_merchants(run_id, jobs):
+    """
+    Invoice a chunk of (merchant_billing_id, period_start, period_end, next_billing_at) jobs.
+    Runs in a worker process or in-process.
+
+    Merchants are committed COMMIT_BATCH_SIZE at a time together with their checkpoints,
+    since on SQLite the commit costs more than building the invoice. If anything in a batch
+    fails, the batch is rolled back and redone one merchant per commit, so only the
+    merchants that fail are recorded as failed.
+    """
+    from src.services.billing_service import BillingService
+
+    billing_service = BillingService()
+    session = billing_service.session
+    results = []
+
+    for batch_start in range(0, len(jobs), COMMIT_BATCH_SIZE):
+        batch = jobs[batch_start:batch_start + COMMIT_BATCH_SIZE]
+        try:
+            batch_results = [_invoice_merchant(billing_service, run_id, *job) for job in batch]
+            session.commit()
+            results.extend(batch_results)
+            continue
+        except Exception:
+            session.rollback()
+
+        for job in batch:
+            merchant_billing_id = job[0]
+            started = time.perf_counter()
+            try:
+                result = _invoice_merchant(billing_service, run_id, *job)
+                session.commit()
+            except Exception as e:
+                session.rollback()
+                logger.error(f"Error generating invoice for merchant billing {merchant_billing_id}: {str(e)}")
+                result = {
+                    'merchant_billing_id': merchant_billing_id,
+                    'status': 'failed',
+                    'invoice_id': None,
+                    'error': str(e),
+                    'elapsed_ms': (time.perf_counter() - started) * 1000
+                }
+                try:
+                    _checkpoint(session, run_id, result)
+                    session.commit()
+                except Exception as checkpoint_error:
+                    session.rollback()
+                    logger.error(f"Error recording invoice run failure for {merchant_billing_id}: {str(checkpoint_error)}")
+            results.append(result)
+
+    return results
+
+def _invoice_merchant(billing_service, run_id, merchant_billing_id, period_start, period_end, next_billing_at):
+    """Build one merchant's invoice, schedule its next one and write its checkpoint in the current transaction"""
+    started = time.perf_counter()
+    invoice = billing_service.create_invoice(merchant_billing_id, period_start, period_end)
+    billing_service.session.execute(
+        update(MerchantBilling)
+        .where(MerchantBilling.id == merchant_billing_id)
+        .values(next_billing_at=next_billing_at)
+        .execution_options(synchronize_session=False)
+    )
+    result = {
+        'merchant_billing_id': merchant_billing_id,
+        'status': 'invoiced' if invoice else 'nothing_to_invoice',
+        'invoice_id': invoice.id if invoice else None,
+        'error': None,
+        'elapsed_ms': (time.perf_counter() - started) * 1000
+    }
+    _checkpoint(billing_service.session, run_id, result)
+    return result
+
+def _checkpoint(session, run_id, result):
+    # A merchant that failed on an earlier attempt of this run is replaced, not duplicated
+    session.execute(delete(InvoiceRunItem).where(
+        InvoiceRunItem.run_id == run_id,
+        InvoiceRunItem.merchant_billing_id == result['merchant_billing_id']
+    ))
+    session.add(InvoiceRunItem(run_id=run_id, **result))
+
+class InvoiceRunService:
+    """
+    Invoice runs over every auto-billed merchant that is due on a date.
+
+    Each merchant carries its next billing date (next_billing_at), so a run reads only the
+    merchants that are due and moves each one's date forward in the same commit as its
+    invoice.
+
+    Merchants are split into chunks and invoiced by a pool of worker processes. Each
+    merchant's invoice commits together with its invoice_run_items checkpoint, so
+    running the same date again resumes the run: merchants already handled are
+    skipped and failed ones are retried.
+    """
+
+    def __init__(self):
+        self.session = db.session
+
+    def due_jobs(self, run_date):
+        """
+        (merchant_billing_id, period_start, period_end, next_billing_at) for every merchant
+        whose next billing date is on or before run_date, read through the next_billing_at index.
+        A merchant's period is the one for its own billing date, which is earlier than run_date
+        when a run was missed.
+        """
+        from src.services.billing_service import BillingService
+
+        billing_service = BillingService()
+        merchant_billings = self.session.execute(
+            select(MerchantBilling.id, MerchantBilling.billing_cycle, MerchantBilling.billing_day,
+                   MerchantBilling.next_billing_at)
+            .where(
+                MerchantBilling.auto_billing_enabled == True,
+                MerchantBilling.next_billing_at <= datetime.combine(run_date, datetime.min.time())
+            )
+            .order_by(MerchantBilling.id)
+        ).all()
+
+        jobs = []
+        for merchant_billing in merchant_billings:
+            billing_date = merchant_billing.next_billing_at.date()
+            period_start, period_end = billing_service.get_billing_period(merchant_billing, billing_date)
+            next_billing_at = billing_service.next_billing_date(merchant_billing, billing_date + timedelta(days=1))
+            jobs.append((merchant_billing.id, period_start, period_end, next_billing_at))
+        return jobs
+
+    def run_due(self, today, workers=1, chunk_size=DEFAULT_CHUNK_SIZE, progress=None):
+        """
+        Run every billing date that has come due up to today, oldest first, and return their
+        summaries. After downtime this catches up: each missed date gets its own run, and a
+        merchant that missed several cycles is invoiced once per cycle as its next_billing_at
+        steps forward. Each date is run once per call, so a merchant that keeps failing is
+        retried on the next call rather than in a loop.
+        """
+        summaries = []
+        last_run = None
+        cutoff = datetime.combine(today, datetime.min.time())
+
+        while True:
+            due = select(func.min(MerchantBilling.next_billing_at)).where(
+                MerchantBilling.auto_billing_enabled == True,
+                MerchantBilling.next_billing_at <= cutoff
+            )
+            if last_run is not None:
+                due = due.where(MerchantBilling.next_billing_at > datetime.combine(last_run, datetime.min.time()))
+            next_date = self.session.execute(due).scalar()
+            if next_date is None:
+                break
+
+            last_run = next_date.date()
+            summaries.append(self.run(last_run, workers=workers, chunk_size=chunk_size, progress=progress))
+
+        return summaries
+
+    def run(self, run_date, workers=1, chunk_size=DEFAULT_CHUNK_SIZE, progress=None):
+        """
+        Invoice every merchant due on run_date, resuming an earlier run for the same date.
+        Returns the run summary (see summarize).
+        """
+        started = time.perf_counter()
+        if workers > 1 and db.engine.dialect.name == 'sqlite':
+            # SQLite takes one writer at a time, so extra processes only wait on its lock
+            logger.info("SQLite database: invoicing in-process instead of across worker processes")
+            workers = 1
+
+        invoice_run = self.session.query(InvoiceRun).filter_by(run_date=run_date).first()
+        if invoice_run is None:
+            invoice_run = InvoiceRun(run_date=run_date)
+            self.session.add(invoice_run)
+        invoice_run.status = 'running'
+        invoice_run.workers = workers
+        invoice_run.finished_at = None
+        self.session.commit()
+        run_id = invoice_run.id
+
+        jobs = self.due_jobs(run_date)
+        done = set(self.session.execute(
+            select(InvoiceRunItem.merchant_billing_id)
+            .where(InvoiceRunItem.run_id == run_id, InvoiceRunItem.status != 'failed')
+        ).scalars())
+        pending = [job for job in jobs if job[0] not in done]
+        logger.info(f"Invoice run {run_date}: {len(jobs)} merchants due, {len(pending)} left to invoice")
+
+        chunks = [pending[i:i + chunk_size] for i in range(0, len(pending), chunk_size)]
+        handled = 0
+
+        def report(results):
+            nonlocal handled
+            handled += len(results)
+            if progress:
+                progress({'handled': handled, 'pending': len(pending)})
+
+        if workers > 1 and len(chunks) > 1:
+            # The parent's session must not hold a connection the workers inherit
+            self.session.close()
+            database_uri = current_app.config['SQLALCHEMY_DATABASE_URI']
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(database_uri,)) as pool:
+                for future in as_completed([pool.submit(invoice_merchants, run_id, chunk) for chunk in chunks]):
+                    report(future.result())
+        else:
+            for chunk in chunks:
+                report(invoice_merchants(run_id, chunk))
+
+        summary = self.summarize(run_id)
+        invoice_run = self.session.get(InvoiceRun, run_id)
+        invoice_run.merchants_due = len(jobs)
+        invoice_run.invoices_generated = summary['invoiced']
+        invoice_run.failures = summary['failed']
+        invoice_run.status = 'completed_with_failures' if summary['failed'] else 'completed'
+        invoice_run.finished_at = datetime.utcnow()
+        self.session.commit()
+
+        summary.update({
+            'run_date': run_date.isoformat(),
+            'workers': workers,
+            'merchants_due': len(jobs),
+            'resumed': len(jobs) - len(pending),
+            'elapsed_seconds': round(time.perf_counter() - started, 2)
+        })
+        return summary
+
+    def summarize(self, run_id, slowest=5):
+        """Outcome counts and per-merchant timings for a run"""
+        items = self.session.execute(
+            select(InvoiceRunItem.merchant_billing_id, InvoiceRunItem.status,
+                   InvoiceRunItem.elapsed_ms, InvoiceRunItem.invoice_id, InvoiceRunItem.error)
+            .where(InvoiceRunItem.run_id == run_id)
+        ).all()
+
+        timings = sorted(item.elapsed_ms or 0.0 for item in items)
+
+        def percentile(fraction):
+            return round(timings[min(len(timings) - 1, int(len(timings) * fraction))], 2) if timings else 0.0
+
+        return {
+            'run_id': run_id,
+            'invoiced': sum(1 for item in items if item.status == 'invoiced'),
+            'nothing_to_invoice': sum(1 for item in items if item.status == 'nothing_to_invoice'),
+            'failed': sum(1 for item in items if item.status == 'failed'),
+            'timings_ms': {'p50': percentile(0.5), 'p95': percentile(0.95), 'max': percentile(1.0)},
+            'slowest': [
+                {'merchant_billing_id': item.merchant_billing_id, 'elapsed_ms': round(item.elapsed_ms or 0.0, 2)}
+                for item in sorted(items, key=lambda item: item.elapsed_ms or 0.0, reverse=True)[:slowest]
+            ],
+            'errors': [
+                {'merchant_billing_id': item.merchant_billing_id, 'error': item.error}
+                for item in items if item.status == 'failed'
+            ]
+        }
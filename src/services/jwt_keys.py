@@ -0,0 +1,129 @@
+import hashlib
+import hmac
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, List
+import jwt
+from src.services.cache import MISSING, TTLCache
+
+logger = logging.getLogger(__name__)
+
+JWT_ALGORITHM = 'HS256'
+
+# Key id used when the signing key is derived from SECRET_KEY
+DERIVED_KEY_ID = 'k1'
+
+class JWTKeyRing:
+    """
+    Shared, rotatable set of JWT signing keys.
+
+    Tokens are signed with the current key and carry its id in the `kid` header, so
+    tokens issued before a rotation keep verifying until that key is retired. Verified
+    tokens are cached by digest until they expire, and repeat requests with the same
+    bearer token skip signature verification entirely.
+    """
+
+    def __init__(self, keys: Dict[str, str], current_kid: str, cache: TTLCache = None):
+        if current_kid not in keys:
+            raise ValueError(f"Current JWT key id {current_kid} has no key")
+        self._keys = dict(keys)
+        self._current_kid = current_kid
+        self.cache = cache or TTLCache(maxsize=10000, ttl=3600.0)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_environment(cls) -> 'JWTKeyRing':
+        """
+        Build the keyring from JWT_SIGNING_KEYS ("kid:secret,kid:secret") and JWT_CURRENT_KEY_ID
+        (default: the last key listed). Without them, one key is derived from SECRET_KEY so
+        every worker signs and verifies with the same key.
+        """
+        keys = {}
+        for entry in os.environ.get('JWT_SIGNING_KEYS', '').split(','):
+            if ':' in entry:
+                kid, secret = entry.split(':', 1)
+                keys[kid.strip()] = secret.strip()
+
+        if not keys:
+            secret_key = os.environ.get('SECRET_KEY', 'digipay-eu-secret-key-change-in-production')
+            keys[DERIVED_KEY_ID] = hmac.new(secret_key.encode(), b'digipay-jwt-signing', hashlib.sha256).hexdigest()
+
+        current_kid = os.environ.get('JWT_CURRENT_KEY_ID') or list(keys)[-1]
+        cache = TTLCache(maxsize=int(os.environ.get('JWT_CACHE_SIZE', 10000)), ttl=3600.0)
+        return cls(keys, current_kid, cache)
+
+    @property
+    def current_kid(self) -> str:
+        return self._current_kid
+
+    def sign(self, payload: Dict[str, Any]) -> str:
+        """
+        Sign a token with the current key
+        """
+        kid = self._current_kid
+        return jwt.encode(payload, self._keys[kid], algorithm=JWT_ALGORITHM, headers={'kid': kid})
+
+    def decode(self, token: str) -> Dict[str, Any]:
+        """
+        Verify a token's signature and claims (uncached); raises jwt.InvalidTokenError subclasses
+        """
+        kid = jwt.get_unverified_header(token).get('kid')
+        key = self._keys.get(kid)
+        if key is None:
+            raise jwt.InvalidTokenError(f"Unknown signing key id: {kid}")
+        return jwt.decode(token, key, algorithms=[JWT_ALGORITHM])
+
+    def verify(self, token: str) -> Dict[str, Any]:
+        """
+        Verify a token, answering from the verified-token cache when possible
+        """
+        digest = hashlib.sha256(token.encode()).digest()
+        payload = self.cache.get(digest)
+        if payload is not MISSING:
+            return payload
+
+        payload = self.decode(token)
+        remaining = payload['exp'] - time.time() if 'exp' in payload else self.cache.ttl
+        if remaining > 0:
+            self.cache.set(digest, payload, ttl=min(remaining, self.cache.ttl))
+        return payload
+
+    def rotate(self, kid: str, secret: str):
+        """
+        Sign new tokens with a new key; tokens signed with earlier keys still verify
+        """
+        with self._lock:
+            if kid in self._keys and self._keys[kid] != secret:
+                raise ValueError(f"JWT key id {kid} is already in use")
+            self._keys[kid] = secret
+            self._current_kid = kid
+        logger.info(f"JWT signing key rotated, current key id: {kid}")
+
+    def retire(self, kid: str):
+        """
+        Remove a key; tokens signed with it stop verifying, including cached ones
+        """
+        with self._lock:
+            if kid == self._current_kid:
+                raise ValueError("Cannot retire the current JWT signing key")
+            self._keys.pop(kid, None)
+            self.cache.clear()
+
+    def key_ids(self) -> List[str]:
+        return list(self._keys)
+
+_keyring = None
+_keyring_lock = threading.Lock()
+
+def get_jwt_keyring() -> JWTKeyRing:
+    """
+    Return the process-wide JWT keyring
+    """
+    global _keyring
+    if _keyring is None:
+        with _keyring_lock:
+            if _keyring is None:
+                _keyring = JWTKeyRing.from_environment()
+    return _keyring
@@ -0,0 +1,342 @@
+"""
+Transaction logs partitioned by month: open months in the database, closed months in
+compressed read-only segment files
+"""
+
+import bisect
+import heapq
+import json
+import logging
+import os
+import struct
+import threading
+import zlib
+from datetime import datetime, timedelta
+from functools import lru_cache
+from sqlalchemy import delete, func, select
+from src.database import data_path, db
+from src.services.gateway_payloads import decode_payload
+
+logger = logging.getLogger(__name__)
+
+# Segment file: magic, zlib-compressed blocks of rows sorted by (transaction_id, created_at, id),
+# a compressed JSON index of the blocks, then the trailer pointing at the index
+SEGMENT_MAGIC = b'DPLOGSEG'
+SEGMENT_FORMAT = 1
+SEGMENT_TRAILER = struct.Struct('>QQ8s')  # index offset, index length, magic
+SEGMENT_PREFIX = 'transaction_logs-'
+SEGMENT_SUFFIX = '.seg'
+BLOCK_SIZE = 64 * 1024  # uncompressed bytes of rows per block
+
+# A month is archived once it has been over this long, so no log can still be written to it
+ARCHIVE_GRACE = timedelta(days=1)
+
+# Seven years, matching GDPR_RETENTION_DAYS in the deployment config
+DEFAULT_RETENTION_DAYS = 2555
+
+DELETE_BATCH_SIZE = 5000
+
+# Row layout in segments; the first three fields are the sort key
+TRANSACTION_ID, CREATED_AT, LOG_ID, EVENT_TYPE, MESSAGE, RESPONSE_CODE, GATEWAY_RESPONSE = range(7)
+
+def month_start(value):
+    return datetime(value.year, value.month, 1)
+
+def next_month(start):
+    return datetime(start.year + start.month // 12, start.month % 12 + 1, 1)
+
+def _sort_key(row):
+    return row[TRANSACTION_ID], row[CREATED_AT], row[LOG_ID]
+
+def write_segment(path, month, rows):
+    """
+    Write rows, already in sort order, to a segment file; returns the row count.
+    The file is written beside its final path and renamed into place, so readers only
+    ever see a complete segment.
+    """
+    temp_path = path + '.tmp'
+    blocks = []
+    count = 0
+
+    with open(temp_path, 'wb') as segment:
+        segment.write(SEGMENT_MAGIC)
+        block, block_size = [], 0
+
+        def flush():
+            data = zlib.compress(json.dumps(block, separators=(',', ':')).encode('utf-8'))
+            blocks.append([block[0][TRANSACTION_ID], block[-1][TRANSACTION_ID], segment.tell(), len(data)])
+            segment.write(data)
+
+        for row in rows:
+            block.append(row)
+            block_size += sum(len(value) for value in row[:RESPONSE_CODE + 1] if isinstance(value, str)) + 64
+            count += 1
+            if block_size >= BLOCK_SIZE:
+                flush()
+                block, block_size = [], 0
+        if block:
+            flush()
+
+        index = zlib.compress(json.dumps({
+            'format': SEGMENT_FORMAT, 'month': month.strftime('%Y-%m'), 'rows': count, 'blocks': blocks
+        }, separators=(',', ':')).encode('utf-8'))
+        index_offset = segment.tell()
+        segment.write(index)
+        segment.write(SEGMENT_TRAILER.pack(index_offset, len(index), SEGMENT_MAGIC))
+        segment.flush()
+        os.fsync(segment.fileno())
+
+    os.replace(temp_path, path)
+    return count
+
+@lru_cache(maxsize=256)
+def _segment_index(path, mtime_ns, size):
+    """A segment's block index (first keys, blocks); cached per file version"""
+    with open(path, 'rb') as segment:
+        segment.seek(-SEGMENT_TRAILER.size, os.SEEK_END)
+        index_offset, index_length, magic = SEGMENT_TRAILER.unpack(segment.read(SEGMENT_TRAILER.size))
+        if magic != SEGMENT_MAGIC:
+            raise ValueError(f"Not a transaction log segment: {path}")
+        segment.seek(index_offset)
+        index = json.loads(zlib.decompress(segment.read(index_length)))
+    if index['format'] != SEGMENT_FORMAT:
+        raise ValueError(f"Unknown transaction log segment format {index['format']}: {path}")
+    return [block[0] for block in index['blocks']], index['blocks']
+
+def _read_block(segment, offset, length):
+    segment.seek(offset)
+    return json.loads(zlib.decompress(segment.read(length)))
+
+def read_segment(path, transaction_id):
+    """A transaction's rows in a segment, decompressing only the blocks that can hold them"""
+    stat = os.stat(path)
+    first_keys, blocks = _segment_index(path, stat.st_mtime_ns, stat.st_size)
+    # A transaction's rows can start in the block before the first one that begins with it
+    position = max(bisect.bisect_left(first_keys, transaction_id) - 1, 0)
+
+    rows = []
+    with open(path, 'rb') as segment:
+        for first, last, offset, length in blocks[position:]:
+            if first > transaction_id:
+                break
+            if last < transaction_id:
+                continue
+            rows.extend(row for row in _read_block(segment, offset, length) if row[TRANSACTION_ID] == transaction_id)
+    return rows
+
+def iter_segment(path):
+    """Every row in a segment, in sort order"""
+    stat = os.stat(path)
+    _, blocks = _segment_index(path, stat.st_mtime_ns, stat.st_size)
+    with open(path, 'rb') as segment:
+        for _, _, offset, length in blocks:
+            yield from _read_block(segment, offset, length)
+
+def _log_dict(row, include_gateway):
+    log = {
+        'id': row[LOG_ID],
+        'transaction_id': row[TRANSACTION_ID],
+        'event_type': row[EVENT_TYPE],
+        'message': row[MESSAGE],
+        'response_code': row[RESPONSE_CODE],
+        'created_at': row[CREATED_AT]
+    }
+    if include_gateway:
+        log['gateway_response'] = row[GATEWAY_RESPONSE]
+    return log
+
+class TransactionLogArchive:
+    """
+    Transaction logs partitioned by calendar month (UTC).
+
+    Open months stay in the transaction_logs table, so a log entry still commits together
+    with the payment change it records, and the table holds only about a month of rows
+    however long the history is. Once a month has closed, archive_closed_months() moves it
+    into one compressed, read-only segment file, sorted by transaction so that a lookup
+    decompresses a single block or two. Months past the retention period are dropped by
+    deleting their segment file.
+
+    Reads route by time: a payment's logs are never older than the payment, so only the
+    segments from its creation month onwards are consulted.
+    """
+
+    def __init__(self, directory, retention_days=DEFAULT_RETENTION_DAYS):
+        self.directory = directory
+        self.retention = timedelta(days=retention_days)
+        self.session = db.session
+        os.makedirs(directory, exist_ok=True)
+
+    def segment_path(self, month):
+        return os.path.join(self.directory, f"{SEGMENT_PREFIX}{month.strftime('%Y-%m')}{SEGMENT_SUFFIX}")
+
+    def segments(self):
+        """(month, path) for every archived month, oldest first"""
+        found = []
+        for name in os.listdir(self.directory):
+            if not (name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX)):
+                continue
+            try:
+                month = datetime.strptime(name[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)], '%Y-%m')
+            except ValueError:
+                continue
+            found.append((month, os.path.join(self.directory, name)))
+        return sorted(found)
+
+    def logs_for(self, transaction_id, since=None, include_gateway=False):
+        """
+        A transaction's log entries as dicts, newest first. since (the payment's creation
+        time) limits the archived months read; without it every segment is checked.
+        """
+        from sqlalchemy.orm import selectinload
+        from src.models.payment import TransactionLog
+
+        query = TransactionLog.query.filter_by(transaction_id=transaction_id)
+        if include_gateway:
+            query = query.options(selectinload(TransactionLog.payload))
+        logs = {log.id: log.to_dict(include_gateway=include_gateway) for log in query}
+
+        first_month = month_start(since) if since else None
+        for month, path in self.segments():
+            if first_month and month < first_month:
+                continue
+            try:
+                rows = read_segment(path, transaction_id)
+            except FileNotFoundError:
+                # Dropped since the directory was listed
+                continue
+            # While a month is being archived its rows can be in both places
+            for row in rows:
+                logs.setdefault(row[LOG_ID], _log_dict(row, include_gateway))
+
+        return sorted(logs.values(), key=lambda log: (log['created_at'], log['id']), reverse=True)
+
+    def _month_rows(self, start, end):
+        """A month's rows from the database, in segment sort order, with gateway responses decoded"""
+        from src.models.payment import TransactionLog, TransactionLogPayload
+
+        result = self.session.execute(
+            select(
+                TransactionLog.transaction_id, TransactionLog.created_at, TransactionLog.id,
+                TransactionLog.event_type, TransactionLog.message, TransactionLog.response_code,
+                TransactionLogPayload.version, TransactionLogPayload.encoding, TransactionLogPayload.data
+            )
+            .outerjoin(TransactionLogPayload, TransactionLogPayload.log_id == TransactionLog.id)
+            .where(TransactionLog.created_at >= start, TransactionLog.created_at < end)
+            .order_by(TransactionLog.transaction_id, TransactionLog.created_at, TransactionLog.id)
+            .execution_options(yield_per=DELETE_BATCH_SIZE)
+        )
+        for row in result:
+            gateway_response = decode_payload(row.version, row.encoding, row.data) if row.data is not None else None
+            yield [row.transaction_id, row.created_at.isoformat(), row.id,
+                   row.event_type, row.message, row.response_code, gateway_response]
+
+    def _delete_month(self, start, end):
+        """Delete a month's rows from the database in batches, one commit per batch"""
+        from src.models.payment import TransactionLog, TransactionLogPayload
+
+        batch = (
+            select(TransactionLog.id)
+            .where(TransactionLog.created_at >= start, TransactionLog.created_at < end)
+            .order_by(TransactionLog.created_at, TransactionLog.id)
+            .limit(DELETE_BATCH_SIZE)
+        )
+        deleted = 0
+        while True:
+            self.session.execute(
+                delete(TransactionLogPayload).where(TransactionLogPayload.log_id.in_(batch))
+                .execution_options(synchronize_session=False)
+            )
+            count = self.session.execute(
+                delete(TransactionLog).where(TransactionLog.id.in_(batch))
+                .execution_options(synchronize_session=False)
+            ).rowcount
+            self.session.commit()
+            deleted += count
+            if count < DELETE_BATCH_SIZE:
+                return deleted
+
+    def archive_month(self, start):
+        """
+        Move one closed month from the database into its segment, then delete it from the
+        database. Rows already in an existing segment (an archive interrupted before its
+        delete finished) are merged in once.
+        """
+        end = next_month(start)
+        path = self.segment_path(start)
+        rows = self._month_rows(start, end)
+        if os.path.exists(path):
+            rows = heapq.merge(iter_segment(path), rows, key=_sort_key)
+
+        def unique(rows):
+            last_key = None
+            for row in rows:
+                key = _sort_key(row)
+                if key != last_key:
+                    yield row
+                last_key = key
+
+        archived = write_segment(path, start, unique(rows))
+        self.session.commit()  # ends the read transaction before the deletes
+        deleted = self._delete_month(start, end)
+        return {'month': start.strftime('%Y-%m'), 'archived': archived, 'deleted': deleted,
+                'bytes': os.path.getsize(path)}
+
+    def archive_closed_months(self, now=None, progress=None):
+        """
+        Archive every closed month still in the database and drop expired months.
+        Expired months still in the database are deleted without being archived.
+        Returns a summary of what was archived and dropped.
+        """
+        from src.models.payment import TransactionLog
+
+        now = now or datetime.utcnow()
+        open_from = month_start(now - ARCHIVE_GRACE)
+        expired_before = month_start(now - self.retention)
+        summary = {'archived': [], 'expired_rows': 0, 'dropped': []}
+
+        oldest = self.session.execute(select(func.min(TransactionLog.created_at))).scalar()
+        while oldest is not None and oldest < open_from:
+            start = month_start(oldest)
+            if start < expired_before:
+                summary['expired_rows'] += self._delete_month(start, next_month(start))
+            else:
+                result = self.archive_month(start)
+                summary['archived'].append(result)
+                if progress:
+                    progress(result)
+            oldest = self.session.execute(
+                select(func.min(TransactionLog.created_at)).where(TransactionLog.created_at >= next_month(start))
+            ).scalar()
+
+        summary['dropped'] = self.drop_expired(now)
+        return summary
+
+    def drop_expired(self, now=None):
+        """Delete the segment of every month that ended before the retention period; returns their months"""
+        expired_before = month_start((now or datetime.utcnow()) - self.retention)
+        dropped = []
+        for month, path in self.segments():
+            if month >= expired_before:
+                break
+            os.remove(path)
+            dropped.append(month.strftime('%Y-%m'))
+            logger.info(f"Dropped expired transaction log segment {month.strftime('%Y-%m')}")
+        return dropped
+
+_archive = None
+_archive_lock = threading.Lock()
+
+def get_transaction_log_archive() -> TransactionLogArchive:
+    """
+    Return the process-wide transaction log archive (TRANSACTION_LOG_ARCHIVE_DIR, or
+    transaction_log_archive in the data directory; retention from GDPR_RETENTION_DAYS)
+    """
+    global _archive
+    if _archive is None:
+        with _archive_lock:
+            if _archive is None:
+                _archive = TransactionLogArchive(
+                    os.environ.get('TRANSACTION_LOG_ARCHIVE_DIR') or data_path('transaction_log_archive'),
+                    retention_days=int(os.environ.get('GDPR_RETENTION_DAYS', DEFAULT_RETENTION_DAYS))
+                )
+    return _archive
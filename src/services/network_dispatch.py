@@ -0,0 +1,135 @@
+import asyncio
+import concurrent.futures
+import logging
+import os
+import random
+import threading
+from typing import Any, Awaitable, Dict, List
+
+logger = logging.getLogger(__name__)
+
+class SimulatedCardNetwork:
+    """
+    Simulated card network used until the real Visa/Mastercard integrations are wired in.
+    Latency is awaited on the dispatch loop instead of blocking the calling thread.
+    """
+
+    async def call(self, endpoint: str, payload: Dict[str, Any], latency: tuple) -> Dict[str, Any]:
+        """
+        Send a request to the card network and wait for the (simulated) response
+        """
+        await asyncio.sleep(random.uniform(*latency))
+        return {'endpoint': endpoint, 'payload': payload}
+
+class StubCardNetwork(SimulatedCardNetwork):
+    """
+    Card network stub with a fixed latency, used by benchmarks and local testing
+    """
+
+    def __init__(self, latency_seconds: float = 0.05):
+        self.latency_seconds = latency_seconds
+
+    async def call(self, endpoint: str, payload: Dict[str, Any], latency: tuple) -> Dict[str, Any]:
+        await asyncio.sleep(self.latency_seconds)
+        return {'endpoint': endpoint, 'payload': payload}
+
+class DispatchEngine:
+    """
+    Process-wide asyncio event loop that multiplexes in-flight card network calls.
+
+    The loop runs in a daemon thread so the synchronous Flask routes can hand a coroutine
+    over and wait on the result, while batch callers can keep hundreds of authorizations
+    in flight from a single worker.
+    """
+
+    def __init__(self, max_in_flight: int = 500):
+        self.max_in_flight = max_in_flight
+        self._loop = None
+        self._thread = None
+        self._semaphore = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        """
+        Start the event loop thread on first use (and again after a fork, e.g. gunicorn workers)
+        """
+        if self._loop is not None and self._pid == os.getpid():
+            return self._loop
+
+        with self._lock:
+            if self._loop is None or self._pid != os.getpid():
+                loop = asyncio.new_event_loop()
+                thread = threading.Thread(
+                    target=self._run_loop, args=(loop,), name='card-network-dispatch', daemon=True
+                )
+                thread.start()
+                self._semaphore = asyncio.Semaphore(self.max_in_flight)
+                self._loop = loop
+                self._thread = thread
+                self._pid = os.getpid()
+                logger.info(f"Card network dispatch loop started (max in flight: {self.max_in_flight})")
+
+        return self._loop
+
+    @staticmethod
+    def _run_loop(loop: asyncio.AbstractEventLoop):
+        asyncio.set_event_loop(loop)
+        loop.run_forever()
+
+    async def _bounded(self, coro: Awaitable) -> Any:
+        async with self._semaphore:
+            return await coro
+
+    def submit(self, coro: Awaitable) -> concurrent.futures.Future:
+        """
+        Schedule a coroutine on the dispatch loop and return a thread-safe future
+        """
+        loop = self._ensure_loop()
+        return asyncio.run_coroutine_threadsafe(self._bounded(coro), loop)
+
+    def run(self, coro: Awaitable, timeout: float = None) -> Any:
+        """
+        Run a coroutine on the dispatch loop and block the calling thread until it completes
+        """
+        future = self.submit(coro)
+        try:
+            return future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            raise
+
+    def run_many(self, coros: List[Awaitable], timeout: float = None) -> List[Any]:
+        """
+        Run several coroutines concurrently and return their results in submission order.
+        Exceptions are returned in place of results rather than raised.
+        """
+        futures = [self.submit(coro) for coro in coros]
+        done, not_done = concurrent.futures.wait(futures, timeout=timeout)
+
+        results = []
+        for future in futures:
+            if future in not_done:
+                future.cancel()
+                results.append(concurrent.futures.TimeoutError())
+            elif future.exception() is not None:
+                results.append(future.exception())
+            else:
+                results.append(future.result())
+        return results
+
+_engine = None
+_engine_lock = threading.Lock()
+
+def get_dispatch_engine() -> DispatchEngine:
+    """
+    Return the process-wide dispatch engine
+    """
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = DispatchEngine(
+                    max_in_flight=int(os.environ.get('CARD_NETWORK_MAX_IN_FLIGHT', 500))
+                )
+    return _engine
@@ -1,8 +1,10 @@
 import requests
 import json
 import logging
-from typing import Dict, Any
+import concurrent.futures
+from typing import Dict, Any, List
 from src.models.payment import Payment, PaymentStatus
+from src.services.network_dispatch import SimulatedCardNetwork, get_dispatch_engine
 import time
 import random
 
@@ -12,28 +14,50 @@ class PaymentProcessor:
     """
     Payment processor service that handles communication with payment networks
     and card schemes (Visa, Mastercard, etc.)
+
+    Network calls are coroutines run on the shared dispatch engine; the synchronous
+    methods are facades for the Flask routes.
     """
     
-    def __init__(self):
+    def __init__(self, network=None, engine=None):
         self.visa_endpoint = "https://api.visa.com/payments"
         self.mastercard_endpoint = "https://api.mastercard.com/payments"
         self.timeout = 30  # seconds
+        self.network = network or SimulatedCardNetwork()
+        self.engine = engine or get_dispatch_engine()
         
+    def _network_request(self, payment: Payment) -> Dict[str, Any]:
+        """
+        Snapshot the payment fields sent to the network, so the dispatch loop
+        never touches the ORM object (or its session) from another thread
+        """
+        return {
+            'amount': payment.amount_minor,  # Networks take integer minor units
+            'currency': payment.currency,
+            'card_token': payment.card_token,
+            'card_brand': payment.card_brand,
+            'merchant_id': payment.merchant_id,
+            'transaction_id': payment.transaction_id
+        }
+    
+    def _timeout_result(self) -> Dict[str, Any]:
+        return {
+            'success': False,
+            'error': 'Card network timeout',
+            'response_code': '91'
+        }
+    
     def process_payment(self, payment: Payment) -> Dict[str, Any]:
         """
         Process a payment through the appropriate payment network
         """
         try:
             logger.info(f"Processing payment {payment.transaction_id}")
+            return self.engine.run(self.process_payment_async(self._network_request(payment)), self.timeout)
             
-            # Determine payment network based on card brand
-            if payment.card_brand.lower() in ['visa']:
-                return self._process_visa_payment(payment)
-            elif payment.card_brand.lower() in ['mastercard', 'master']:
-                return self._process_mastercard_payment(payment)
-            else:
-                return self._process_generic_payment(payment)
-                
+        except concurrent.futures.TimeoutError:
+            logger.error(f"Timeout processing payment {payment.transaction_id}")
+            return self._timeout_result()
         except Exception as e:
             logger.error(f"Error processing payment {payment.transaction_id}: {str(e)}")
             return {
@@ -42,7 +66,44 @@ class PaymentProcessor:
                 'response_code': '500'
             }
     
-    def _process_visa_payment(self, payment: Payment) -> Dict[str, Any]:
+    def process_payments(self, payments: List[Payment]) -> List[Dict[str, Any]]:
+        """
+        Process several payments concurrently; results are returned in the same order
+        """
+        requests_data = [self._network_request(payment) for payment in payments]
+        results = self.engine.run_many(
+            [self.process_payment_async(data) for data in requests_data], self.timeout
+        )
+        
+        processed = []
+        for data, result in zip(requests_data, results):
+            if isinstance(result, concurrent.futures.TimeoutError):
+                logger.error(f"Timeout processing payment {data['transaction_id']}")
+                processed.append(self._timeout_result())
+            elif isinstance(result, Exception):
+                logger.error(f"Error processing payment {data['transaction_id']}: {str(result)}")
+                processed.append({
+                    'success': False,
+                    'error': 'Payment processing failed',
+                    'response_code': '500'
+                })
+            else:
+                processed.append(result)
+        return processed
+    
+    async def process_payment_async(self, payment_data: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Route a payment to the appropriate payment network based on card brand
+        """
+        card_brand = (payment_data.get('card_brand') or '').lower()
+        if card_brand in ['visa']:
+            return await self._process_visa_payment(payment_data)
+        elif card_brand in ['mastercard', 'master']:
+            return await self._process_mastercard_payment(payment_data)
+        else:
+            return await self._process_generic_payment(payment_data)
+    
+    async def _process_visa_payment(self, payment_data: Dict[str, Any]) -> Dict[str, Any]:
         """
         Process payment through Visa network
         """
@@ -50,23 +111,23 @@ class PaymentProcessor:
             # Simulate Visa API call
             # In production, this would be actual Visa API integration
             payload = {
-                'amount': str(payment.amount),
-                'currency': payment.currency,
-                'card_token': payment.card_token,
-                'merchant_id': payment.merchant_id,
-                'transaction_id': payment.transaction_id
+                'amount': payment_data['amount'],
+                'currency': payment_data['currency'],
+                'card_token': payment_data['card_token'],
+                'merchant_id': payment_data['merchant_id'],
+                'transaction_id': payment_data['transaction_id']
             }
             
             # Simulate network delay and response
-            time.sleep(random.uniform(0.5, 2.0))  # Simulate network latency
+            await self.network.call(self.visa_endpoint, payload, (0.5, 2.0))
             
             # Simulate success/failure based on amount (for demo purposes)
-            if float(payment.amount) < 10000:  # Amounts under 100.00 EUR succeed
+            if payment_data['amount'] < 10000:  # Amounts under 100.00 EUR succeed
                 return {
                     'success': True,
                     'authorization_code': f"VISA{random.randint(100000, 999999)}",
                     'response_code': '00',
-                    'network_transaction_id': f"visa_{payment.transaction_id}",
+                    'network_transaction_id': f"visa_{payment_data['transaction_id']}",
                     'processor': 'visa'
                 }
             else:
@@ -85,30 +146,30 @@ class PaymentProcessor:
                 'response_code': '96'
             }
     
-    def _process_mastercard_payment(self, payment: Payment) -> Dict[str, Any]:
+    async def _process_mastercard_payment(self, payment_data: Dict[str, Any]) -> Dict[str, Any]:
         """
         Process payment through Mastercard network
         """
         try:
             # Simulate Mastercard API call
             payload = {
-                'amount': str(payment.amount),
-                'currency': payment.currency,
-                'card_token': payment.card_token,
-                'merchant_id': payment.merchant_id,
-                'transaction_id': payment.transaction_id
+                'amount': payment_data['amount'],
+                'currency': payment_data['currency'],
+                'card_token': payment_data['card_token'],
+                'merchant_id': payment_data['merchant_id'],
+                'transaction_id': payment_data['transaction_id']
             }
             
             # Simulate network delay and response
-            time.sleep(random.uniform(0.5, 2.0))
+            await self.network.call(self.mastercard_endpoint, payload, (0.5, 2.0))
             
             # Simulate success/failure
-            if float(payment.amount) < 15000:  # Amounts under 150.00 EUR succeed
+            if payment_data['amount'] < 15000:  # Amounts under 150.00 EUR succeed
                 return {
                     'success': True,
                     'authorization_code': f"MC{random.randint(100000, 999999)}",
                     'response_code': '00',
-                    'network_transaction_id': f"mc_{payment.transaction_id}",
+                    'network_transaction_id': f"mc_{payment_data['transaction_id']}",
                     'processor': 'mastercard'
                 }
             else:
@@ -127,21 +188,21 @@ class PaymentProcessor:
                 'response_code': '96'
             }
     
-    def _process_generic_payment(self, payment: Payment) -> Dict[str, Any]:
+    async def _process_generic_payment(self, payment_data: Dict[str, Any]) -> Dict[str, Any]:
         """
         Process payment through generic payment processor
         """
         try:
             # Simulate generic payment processing
-            time.sleep(random.uniform(0.3, 1.5))
+            await self.network.call('generic', payment_data, (0.3, 1.5))
             
             # Simple success logic for demo
-            if float(payment.amount) < 20000:  # Amounts under 200.00 EUR succeed
+            if payment_data['amount'] < 20000:  # Amounts under 200.00 EUR succeed
                 return {
                     'success': True,
                     'authorization_code': f"GEN{random.randint(100000, 999999)}",
                     'response_code': '00',
-                    'network_transaction_id': f"gen_{payment.transaction_id}",
+                    'network_transaction_id': f"gen_{payment_data['transaction_id']}",
                     'processor': 'generic'
                 }
             else:
@@ -160,24 +221,43 @@ class PaymentProcessor:
                 'response_code': '96'
             }
     
-    def refund_payment(self, payment: Payment, refund_amount: float) -> Dict[str, Any]:
+    def refund_payment(self, payment: Payment, refund_amount_minor: int) -> Dict[str, Any]:
         """
-        Process a refund for a payment
+        Process a refund for a payment (amount in the payment currency's minor units)
         """
         try:
-            logger.info(f"Processing refund for payment {payment.transaction_id}, amount: {refund_amount}")
+            logger.info(f"Processing refund for payment {payment.transaction_id}, amount: {refund_amount_minor}")
+            return self.engine.run(
+                self.refund_payment_async(self._network_request(payment), refund_amount_minor), self.timeout
+            )
             
+        except concurrent.futures.TimeoutError:
+            logger.error(f"Timeout processing refund for payment {payment.transaction_id}")
+            return self._timeout_result()
+        except Exception as e:
+            logger.error(f"Refund processing error: {str(e)}")
+            return {
+                'success': False,
+                'error': 'Refund processing error',
+                'response_code': '96'
+            }
+    
+    async def refund_payment_async(self, payment_data: Dict[str, Any], refund_amount_minor: int) -> Dict[str, Any]:
+        """
+        Send a refund for a payment to the card network
+        """
+        try:
             # Simulate refund processing
-            time.sleep(random.uniform(0.5, 1.5))
+            await self.network.call('refund', payment_data, (0.5, 1.5))
             
             # Simulate refund success (most refunds succeed in demo)
             if random.random() > 0.1:  # 90% success rate
                 return {
                     'success': True,
-                    'refund_id': f"refund_{payment.transaction_id}_{int(time.time())}",
+                    'refund_id': f"refund_{payment_data['transaction_id']}_{int(time.time())}",
                     'response_code': '00',
-                    'refund_amount': refund_amount,
-                    'processor': payment.card_brand.lower() if payment.card_brand else 'generic'
+                    'refund_amount': refund_amount_minor,
+                    'processor': payment_data['card_brand'].lower() if payment_data['card_brand'] else 'generic'
                 }
             else:
                 return {
@@ -198,9 +278,27 @@ class PaymentProcessor:
         """
         Verify card details with the issuing bank
         """
+        try:
+            return self.engine.run(self.verify_card_async(card_token, card_brand), self.timeout)
+            
+        except concurrent.futures.TimeoutError:
+            logger.error("Timeout verifying card")
+            return self._timeout_result()
+        except Exception as e:
+            logger.error(f"Card verification error: {str(e)}")
+            return {
+                'success': False,
+                'error': 'Card verification failed',
+                'response_code': '96'
+            }
+    
+    async def verify_card_async(self, card_token: str, card_brand: str) -> Dict[str, Any]:
+        """
+        Verify card details with the issuing bank without blocking the caller
+        """
         try:
             # Simulate card verification
-            time.sleep(random.uniform(0.2, 0.8))
+            await self.network.call('verify', {'card_token': card_token, 'card_brand': card_brand}, (0.2, 0.8))
             
             # Simple verification logic for demo
             if len(card_token) >= 10:  # Valid token format
@@ -235,7 +333,7 @@ class PaymentProcessor:
             # - High-risk merchants
             # - Certain card types
             
-            if float(payment.amount) > 3000:  # Over 30 EUR
+            if payment.amount_minor > 3000:  # Over 30 EUR
                 return True
             
             if payment.fraud_score and payment.fraud_score > 0.5:
@@ -0,0 +1,171 @@
+"""
+Per-merchant payment counters for the merchant dashboard
+"""
+
+import logging
+from datetime import datetime, timedelta
+from sqlalchemy import case, delete, func, select, update
+from sqlalchemy.exc import IntegrityError
+from src.database import bucket_date, day_bucket
+from src.money import BILLING_CURRENCY
+from src.models.payment import MerchantPaymentDailyStats, MerchantPaymentStats, Payment, PaymentStatus
+
+logger = logging.getLogger(__name__)
+
+COUNTERS = ['payment_count', 'completed_count', 'completed_volume_minor', 'failed_count', 'refunded_count', 'refunded_volume_minor']
+# Volumes are in each currency's minor unit, so they are only ever summed within a currency
+VOLUMES = ('completed_volume_minor', 'refunded_volume_minor')
+
+def status_counters(status, amount):
+    """What one payment in a given status contributes to the counters (payment_count aside)"""
+    counters = dict.fromkeys(COUNTERS, 0)
+    if status == PaymentStatus.COMPLETED:
+        counters['completed_count'] = 1
+        counters['completed_volume_minor'] = amount
+    elif status == PaymentStatus.FAILED:
+        counters['failed_count'] = 1
+    elif status == PaymentStatus.REFUNDED:
+        counters['refunded_count'] = 1
+        counters['refunded_volume_minor'] = amount
+    return counters
+
+class PaymentStatsService:
+    """
+    All-time and per-day payment counters per merchant and currency.
+
+    Counters change in the same transaction as the payment whose status changed, so
+    the dashboard reads two small rows instead of scanning the merchant's payments.
+    Daily counters are bucketed by the day the payment was created, so a payment
+    completed or refunded later still counts towards the day it was taken.
+    """
+
+    def record(self, session, payments, previous_status=None):
+        """
+        Apply status changes to the counters; call before committing the payments.
+        previous_status is None for newly created payments.
+        """
+        totals = {}
+        daily = {}
+        for payment in payments:
+            if payment.created_at is None:
+                payment.created_at = datetime.utcnow()
+            amount = payment.amount_minor
+            currency = payment.currency or BILLING_CURRENCY
+
+            before = status_counters(previous_status, amount)
+            after = status_counters(payment.status, amount)
+            deltas = {name: after[name] - before[name] for name in COUNTERS}
+            if previous_status is None:
+                deltas['payment_count'] = 1
+
+            for bucket, key in ((totals, (payment.merchant_id, currency)),
+                                (daily, (payment.merchant_id, payment.created_at.date(), currency))):
+                current = bucket.setdefault(key, dict.fromkeys(COUNTERS, 0))
+                for name in COUNTERS:
+                    current[name] += deltas[name]
+
+        for (merchant_id, currency), deltas in totals.items():
+            self._apply(session, MerchantPaymentStats, {'merchant_id': merchant_id, 'currency': currency}, deltas)
+        for (merchant_id, day, currency), deltas in daily.items():
+            self._apply(session, MerchantPaymentDailyStats, {'merchant_id': merchant_id, 'day': day, 'currency': currency}, deltas)
+
+    def _apply(self, session, model, key, deltas):
+        """Add deltas to a counters row, creating it on first use"""
+        changes = {name: delta for name, delta in deltas.items() if delta}
+        if not changes:
+            return
+
+        statement = (
+            update(model)
+            .where(*[getattr(model, column) == value for column, value in key.items()])
+            .values(**{name: getattr(model, name) + delta for name, delta in changes.items()})
+            .execution_options(synchronize_session=False)
+        )
+        if session.execute(statement).rowcount:
+            return
+
+        try:
+            with session.begin_nested():
+                session.add(model(**key, **deltas))
+        except IntegrityError:
+            # A concurrent request created the row first
+            session.execute(statement)
+
+    def dashboard(self, session, merchant_id, days=30):
+        """
+        All-time counters and counters for payments created in the last `days` days, as
+        (totals, recent) dicts of COUNTERS: counts summed across currencies, volumes as
+        {currency: minor units}
+        """
+        since = datetime.utcnow().date() - timedelta(days=days)
+
+        totals = session.execute(
+            select(MerchantPaymentStats.currency, *[getattr(MerchantPaymentStats, name) for name in COUNTERS])
+            .where(MerchantPaymentStats.merchant_id == merchant_id)
+        ).all()
+        recent = session.execute(
+            select(MerchantPaymentDailyStats.currency,
+                   *[func.coalesce(func.sum(getattr(MerchantPaymentDailyStats, name)), 0).label(name) for name in COUNTERS])
+            .where(MerchantPaymentDailyStats.merchant_id == merchant_id, MerchantPaymentDailyStats.day >= since)
+            .group_by(MerchantPaymentDailyStats.currency)
+        ).all()
+
+        return self._by_currency(totals), self._by_currency(recent)
+
+    @staticmethod
+    def _by_currency(rows):
+        counters = {name: {} if name in VOLUMES else 0 for name in COUNTERS}
+        for row in rows:
+            for name in COUNTERS:
+                if name in VOLUMES:
+                    counters[name][row.currency] = getattr(row, name)
+                else:
+                    counters[name] += getattr(row, name)
+        return counters
+
+    def rebuild(self, connection, merchant_id=None):
+        """Recompute the counters from the payments table; returns the number of rows written"""
+        day = day_bucket(Payment.created_at, connection.dialect.name)
+
+        def total(status, value=1):
+            return func.coalesce(func.sum(case((Payment.status == status, value), else_=0)), 0)
+
+        currency = func.coalesce(Payment.currency, BILLING_CURRENCY)
+        query = select(
+            Payment.merchant_id, day.label('day'), currency.label('currency'),
+            func.count(Payment.id).label('payment_count'),
+            total(PaymentStatus.COMPLETED).label('completed_count'),
+            total(PaymentStatus.COMPLETED, Payment.amount_minor).label('completed_volume_minor'),
+            total(PaymentStatus.FAILED).label('failed_count'),
+            total(PaymentStatus.REFUNDED).label('refunded_count'),
+            total(PaymentStatus.REFUNDED, Payment.amount_minor).label('refunded_volume_minor')
+        ).group_by(Payment.merchant_id, day, currency)
+
+        clear_totals = delete(MerchantPaymentStats)
+        clear_daily = delete(MerchantPaymentDailyStats)
+        if merchant_id:
+            query = query.where(Payment.merchant_id == merchant_id)
+            clear_totals = clear_totals.where(MerchantPaymentStats.merchant_id == merchant_id)
+            clear_daily = clear_daily.where(MerchantPaymentDailyStats.merchant_id == merchant_id)
+        connection.execute(clear_totals)
+        connection.execute(clear_daily)
+
+        daily_rows = []
+        totals = {}
+        for row in connection.execute(query):
+            counters = {name: getattr(row, name) for name in COUNTERS}
+            daily_rows.append(dict(merchant_id=row.merchant_id, day=bucket_date(row.day), currency=row.currency, **counters))
+            merchant_totals = totals.setdefault((row.merchant_id, row.currency), dict.fromkeys(COUNTERS, 0))
+            for name in COUNTERS:
+                merchant_totals[name] += counters[name]
+
+        total_rows = [
+            dict(merchant_id=merchant, currency=currency, **counters)
+            for (merchant, currency), counters in totals.items()
+        ]
+        if daily_rows:
+            connection.execute(MerchantPaymentDailyStats.__table__.insert(), daily_rows)
+            connection.execute(MerchantPaymentStats.__table__.insert(), total_rows)
+
+        logger.info(f"Rebuilt payment counters for {len(totals)} merchant currencies")
+        return len(daily_rows) + len(total_rows)
@@ -0,0 +1,199 @@
+"""
+Per-merchant transaction fee pricing, cached in process for fee quotes
+"""
+
+import logging
+import os
+import threading
+from decimal import Decimal
+from functools import lru_cache
+
+import numpy as np
+
+from src.money import from_minor, to_float, to_minor
+from src.services.cache import MISSING, TTLCache
+
+logger = logging.getLogger(__name__)
+
+# Fee rates are held as integers over RATE_SCALE: a percentage with up to four decimals is
+# exact, and for percentages up to 100% the scaled fee stays within int64 for any amount
+# below MAX_AMOUNT_CENTS
+RATE_DECIMALS = 6
+RATE_SCALE = 10 ** RATE_DECIMALS
+MAX_AMOUNT_CENTS = 10 ** 12
+
+# Rates used for merchants without a billing configuration, matching MerchantBilling's defaults
+# (percentage, fixed fee in cents) for European and non-European cards
+DEFAULT_RATES = (0.5, 10, 2.4, 20)
+
+def _scaled(value, scale):
+    """value * scale as an int, or None if that is not a whole number"""
+    scaled = value * scale
+    return int(scaled) if scaled == scaled.to_integral_value() else None
+
+class CardRate:
+    """One card type's percentage and fixed fee (in cents), parsed once"""
+
+    __slots__ = ('percentage', 'fixed_fee', 'percentage_scaled', 'fixed_scaled')
+
+    def __init__(self, percentage, fixed_fee_minor):
+        self.percentage = Decimal(str(percentage or 0))
+        self.fixed_fee = from_minor(fixed_fee_minor or 0)
+        # fee in cents * RATE_SCALE = amount_cents * percentage_scaled + fixed_scaled
+        self.percentage_scaled = _scaled(self.percentage, RATE_SCALE // 100)
+        self.fixed_scaled = int(fixed_fee_minor or 0) * RATE_SCALE
+
+    @property
+    def exact_in_integers(self):
+        # Negative rates round differently under floor division, and rates over 100% could overflow
+        return (self.percentage_scaled is not None and 0 <= self.percentage_scaled <= RATE_SCALE
+                and self.fixed_scaled >= 0)
+
+    def fee_cents(self, amount_cents):
+        return (amount_cents * self.percentage_scaled + self.fixed_scaled + RATE_SCALE // 2) // RATE_SCALE
+
+    def fee_decimal_cents(self, amount):
+        fee = Decimal(str(amount)) * self.percentage / Decimal('100') + self.fixed_fee
+        return to_minor(fee)
+
+class MerchantPricing:
+    """
+    A merchant's transaction fee rates, ready for quoting.
+
+    Fees round half up to the cent, as they always have. Amounts with at most two decimals
+    are quoted in integer cents; anything else goes through Decimal.
+    """
+
+    __slots__ = ('european', 'non_european')
+
+    def __init__(self, european_percentage, european_fixed_fee_minor, non_european_percentage, non_european_fixed_fee_minor):
+        self.european = CardRate(european_percentage, european_fixed_fee_minor)
+        self.non_european = CardRate(non_european_percentage, non_european_fixed_fee_minor)
+
+    def fee_minor(self, amount, is_european_card=True):
+        """Fee for one major-unit amount, in cents"""
+        rate = self.european if is_european_card else self.non_european
+        amount_cents = _whole_cents(amount)
+        if amount_cents is not None and rate.exact_in_integers:
+            return rate.fee_cents(amount_cents)
+        return rate.fee_decimal_cents(amount)
+
+    def fee(self, amount, is_european_card=True):
+        """Fee for one major-unit amount, in euros"""
+        return to_float(self.fee_minor(amount, is_european_card))
+
+    def quote_cents(self, amount_cents, european):
+        """
+        Vectorized fees for int64 arrays of amounts in cents (non-negative, below MAX_AMOUNT_CENTS)
+        and a matching boolean array of card types; returns int64 fees in cents
+        """
+        fees = np.empty(len(amount_cents), dtype=np.int64)
+        for rate, mask in ((self.european, european), (self.non_european, ~european)):
+            if not mask.any():
+                continue
+            if rate.exact_in_integers:
+                fees[mask] = (amount_cents[mask] * rate.percentage_scaled + rate.fixed_scaled + RATE_SCALE // 2) // RATE_SCALE
+            else:
+                # Rates with more decimals than RATE_SCALE holds: quote each amount exactly
+                fees[mask] = [rate.fee_decimal_cents(from_minor(cents)) for cents in amount_cents[mask]]
+        return fees
+
+def _whole_cents(amount):
+    """The amount in integer cents if it has at most two decimals, else None"""
+    if isinstance(amount, Decimal):
+        if not amount.is_finite():
+            return None
+        cents = amount.scaleb(2)
+        return int(cents) if cents == cents.to_integral_value() and 0 <= cents < MAX_AMOUNT_CENTS else None
+    if isinstance(amount, bool) or not isinstance(amount, (int, float)):
+        return None
+    if isinstance(amount, int):
+        return amount * 100 if 0 <= amount * 100 < MAX_AMOUNT_CENTS else None
+    cents = round(amount * 100)
+    if 0 <= cents < MAX_AMOUNT_CENTS and cents / 100 == amount:
+        return cents
+    return None
+
+def amounts_to_cents(amounts):
+    """
+    Convert a list of JSON amounts to an int64 array of cents.
+    Raises ValueError unless every amount is a non-negative number with at most two decimals.
+    """
+    if any(isinstance(amount, bool) or not isinstance(amount, (int, float)) for amount in amounts):
+        raise ValueError('amounts must be numbers')
+    values = np.asarray(amounts, dtype=np.float64)
+    if not np.isfinite(values).all() or (values < 0).any() or (values * 100 >= MAX_AMOUNT_CENTS).any():
+        raise ValueError('amounts must be non-negative and below %d' % (MAX_AMOUNT_CENTS // 100))
+    cents = np.rint(values * 100)
+    if (cents / 100 != values).any():
+        raise ValueError('amounts must have at most two decimal places')
+    return cents.astype(np.int64)
+
+@lru_cache(maxsize=1024)
+def pricing_for_rates(european_percentage, european_fixed_fee_minor, non_european_percentage, non_european_fixed_fee_minor):
+    """Shared MerchantPricing for a set of rates; most merchants are on the same few"""
+    return MerchantPricing(european_percentage, european_fixed_fee_minor, non_european_percentage, non_european_fixed_fee_minor)
+
+def pricing_for_billing(merchant_billing):
+    """MerchantPricing for a MerchantBilling row (or a row with the same rate columns)"""
+    return pricing_for_rates(
+        merchant_billing.european_card_percentage, merchant_billing.european_card_fixed_fee_minor,
+        merchant_billing.non_european_card_percentage, merchant_billing.non_european_card_fixed_fee_minor
+    )
+
+DEFAULT_PRICING = pricing_for_rates(*DEFAULT_RATES)
+
+class PricingTable:
+    """
+    In-process pricing per merchant, so fee quotes don't touch the database.
+
+    A miss reads the merchant's four rate columns; a merchant without a billing
+    configuration is quoted at the default rates (the row is created when its first
+    fee is recorded, with the same defaults). Updating a merchant's configuration
+    invalidates its entry in this process; other workers pick it up when it expires.
+    """
+
+    def __init__(self, cache: TTLCache = None):
+        self.cache = cache or TTLCache(maxsize=10000, ttl=300.0)
+
+    def _load(self, merchant_id):
+        from src.models.billing import MerchantBilling
+
+        row = MerchantBilling.query.with_entities(
+            MerchantBilling.european_card_percentage, MerchantBilling.european_card_fixed_fee_minor,
+            MerchantBilling.non_european_card_percentage, MerchantBilling.non_european_card_fixed_fee_minor
+        ).filter(MerchantBilling.merchant_id == merchant_id).first()
+
+        return pricing_for_billing(row) if row is not None else DEFAULT_PRICING
+
+    def get(self, merchant_id):
+        """Pricing for a merchant (cached); default pricing when merchant_id is empty"""
+        if not merchant_id:
+            return DEFAULT_PRICING
+        pricing = self.cache.get(merchant_id)
+        if pricing is MISSING:
+            pricing = self._load(merchant_id)
+            self.cache.set(merchant_id, pricing)
+        return pricing
+
+    def invalidate(self, merchant_id):
+        """Drop a merchant's cached pricing, e.g. after its billing configuration changes"""
+        if merchant_id:
+            self.cache.delete(merchant_id)
+
+_pricing_table = None
+_pricing_table_lock = threading.Lock()
+
+def get_pricing_table() -> PricingTable:
+    """
+    Return the process-wide pricing table (cache sized by PRICING_CACHE_SIZE / PRICING_CACHE_TTL)
+    """
+    global _pricing_table
+    if _pricing_table is None:
+        with _pricing_table_lock:
+            if _pricing_table is None:
+                _pricing_table = PricingTable(TTLCache(
+                    maxsize=int(os.environ.get('PRICING_CACHE_SIZE', 10000)),
+                    ttl=float(os.environ.get('PRICING_CACHE_TTL', 300))
+                ))
+    return _pricing_table
@@ -0,0 +1,135 @@
+import hashlib
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict
+from src.database import data_path
+
+logger = logging.getLogger(__name__)
+
+# Expired buckets are swept once every this many checks per process
+PURGE_EVERY = 10000
+
+class RateLimiter:
+    """
+    GCRA (generic cell rate algorithm) rate limiter on a shared SQLite file.
+
+    Each bucket is a single row holding its theoretical arrival time (TAT), so a check
+    is one primary-key read and write inside a short IMMEDIATE transaction: O(1) no
+    matter how many requests the window allows. Every gunicorn worker opens the same
+    file, so a limit holds across the whole server rather than per worker.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._checks = 0
+        self._init_schema()
+
+    def _connection(self) -> sqlite3.Connection:
+        """
+        One connection per thread (and per process, after gunicorn forks)
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=2.0, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=OFF')  # counters only; losing the last writes on power loss is fine
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _init_schema(self):
+        self._connection().execute('''
+            CREATE TABLE IF NOT EXISTS rate_limits (
+                bucket TEXT PRIMARY KEY,
+                tat REAL NOT NULL
+            ) WITHOUT ROWID
+        ''')
+
+    def hit(self, bucket: str, limit: int, window_seconds: float, now: float = None) -> Dict[str, Any]:
+        """
+        Count one request against a bucket allowing `limit` requests per `window_seconds`.
+        Denied requests are not counted.
+        """
+        now = time.time() if now is None else now
+        interval = window_seconds / limit
+
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT tat FROM rate_limits WHERE bucket = ?', (bucket,)).fetchone()
+            tat = max(row[0], now) if row else now
+            new_tat = tat + interval
+            allow_at = new_tat - window_seconds
+
+            allowed = now >= allow_at
+            if allowed:
+                conn.execute(
+                    'INSERT INTO rate_limits (bucket, tat) VALUES (?, ?) '
+                    'ON CONFLICT(bucket) DO UPDATE SET tat = excluded.tat',
+                    (bucket, new_tat)
+                )
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+        self._checks += 1
+        if self._checks % PURGE_EVERY == 0:
+            self.purge(now)
+
+        stored_tat = new_tat if allowed else tat
+        return {
+            'allowed': allowed,
+            'limit': limit,
+            'remaining': max(0, int((now - (stored_tat - window_seconds)) // interval)),
+            'reset_after': max(0, math.ceil(stored_tat - now)),
+            'retry_after': 0 if allowed else max(1, math.ceil(allow_at - now))
+        }
+
+    def purge(self, now: float = None):
+        """
+        Drop buckets that have fully drained; they behave exactly like missing rows
+        """
+        now = time.time() if now is None else now
+        try:
+            self._connection().execute('DELETE FROM rate_limits WHERE tat < ?', (now,))
+        except sqlite3.Error as e:
+            logger.error(f"Error purging rate limit buckets: {str(e)}")
+
+def rate_limit_headers(result: Dict[str, Any]) -> Dict[str, str]:
+    """
+    Standard RateLimit-* response headers (IETF httpapi draft), plus Retry-After when denied
+    """
+    headers = {
+        'RateLimit-Limit': str(result['limit']),
+        'RateLimit-Remaining': str(result['remaining']),
+        'RateLimit-Reset': str(result['reset_after'])
+    }
+    if not result['allowed']:
+        headers['Retry-After'] = str(result['retry_after'])
+    return headers
+
+def hash_identifier(value: str) -> str:
+    """
+    Bucket names for secrets (API keys) are hashed so the limiter file never holds them
+    """
+    return hashlib.sha256(value.encode()).hexdigest()[:32]
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+def get_rate_limiter() -> RateLimiter:
+    """
+    Return the process-wide rate limiter (RATE_LIMIT_STORE_PATH, or rate_limits.db in the data directory)
+    """
+    global _limiter
+    if _limiter is None:
+        with _limiter_lock:
+            if _limiter is None:
+                _limiter = RateLimiter(os.environ.get('RATE_LIMIT_STORE_PATH') or data_path('rate_limits.db'))
+    return _limiter
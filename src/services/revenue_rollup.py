@@ -0,0 +1,216 @@
+"""
+Daily revenue rollups kept in the revenue_reports table
+"""
+
+import logging
+from datetime import datetime, timedelta
+from sqlalchemy import and_, case, delete, func, select, update
+from src.database import bucket_date, day_bucket
+from src.models.billing import FeeTransaction, FeeType, RevenueReport
+
+logger = logging.getLogger(__name__)
+
+DAILY = 'daily'
+
+# Counters kept per rollup row, all integers (fee amounts in billing-currency minor units); every one
+# of them sums across days. Transaction volume is not kept: payments come in several currencies, and
+# their original amounts cannot be added up into one billing-currency figure.
+METRICS = [
+    'total_revenue_minor', 'transaction_fee_revenue_minor', 'chargeback_fee_revenue_minor', 'refund_fee_revenue_minor',
+    'other_fee_revenue_minor', 'total_transactions', 'european_transactions', 'non_european_transactions'
+]
+
+def day_start(moment):
+    return datetime.combine(moment.date() if isinstance(moment, datetime) else moment, datetime.min.time())
+
+def fee_metrics(fee_transaction):
+    """The amounts one fee adds to each rollup counter"""
+    fee_amount = fee_transaction.fee_amount_minor or 0
+    fee_type = fee_transaction.fee_type
+    is_transaction_fee = fee_type == FeeType.TRANSACTION_FEE
+    european = is_transaction_fee and fee_transaction.is_european_card is not False
+    return {
+        'total_revenue_minor': fee_amount,
+        'transaction_fee_revenue_minor': fee_amount if is_transaction_fee else 0,
+        'chargeback_fee_revenue_minor': fee_amount if fee_type == FeeType.CHARGEBACK_FEE else 0,
+        'refund_fee_revenue_minor': fee_amount if fee_type == FeeType.REFUND_FEE else 0,
+        'other_fee_revenue_minor': 0 if fee_type in (FeeType.TRANSACTION_FEE, FeeType.CHARGEBACK_FEE, FeeType.REFUND_FEE) else fee_amount,
+        'total_transactions': 1 if is_transaction_fee else 0,
+        'european_transactions': 1 if european else 0,
+        'non_european_transactions': 1 if is_transaction_fee and not european else 0
+    }
+
+def fee_aggregates():
+    """The same counters as fee_metrics, as SQL aggregates over fee_transactions"""
+    fee_amount = func.coalesce(FeeTransaction.fee_amount_minor, 0)
+    is_transaction_fee = FeeTransaction.fee_type == FeeType.TRANSACTION_FEE
+    is_non_european = and_(is_transaction_fee, FeeTransaction.is_european_card == False)
+
+    def total(condition, value):
+        return func.coalesce(func.sum(case((condition, value), else_=0)), 0)
+
+    return [
+        func.coalesce(func.sum(fee_amount), 0).label('total_revenue_minor'),
+        total(is_transaction_fee, fee_amount).label('transaction_fee_revenue_minor'),
+        total(FeeTransaction.fee_type == FeeType.CHARGEBACK_FEE, fee_amount).label('chargeback_fee_revenue_minor'),
+        total(FeeTransaction.fee_type == FeeType.REFUND_FEE, fee_amount).label('refund_fee_revenue_minor'),
+        total(FeeTransaction.fee_type.notin_([FeeType.TRANSACTION_FEE, FeeType.CHARGEBACK_FEE, FeeType.REFUND_FEE]),
+              fee_amount).label('other_fee_revenue_minor'),
+        total(is_transaction_fee, 1).label('total_transactions'),
+        (total(is_transaction_fee, 1) - total(is_non_european, 1)).label('european_transactions'),
+        total(is_non_european, 1).label('non_european_transactions')
+    ]
+
+class RevenueRollupService:
+    """
+    Daily per-merchant and platform-wide revenue rollups.
+
+    Fees are added to their day's rollup rows in the same transaction that records them,
+    so a revenue summary reads one row per day instead of every fee in the period.
+    Reads sum rows rather than expecting one row per day, so a row created twice by
+    concurrent first fees of the day still counts correctly.
+    """
+
+    def record(self, session, fee_transaction):
+        """
+        Add a fee to its merchant's and the platform's daily rollup. Call before committing the fee;
+        sets the fee's created_at so it lands in the same day as its rollup.
+        """
+        if fee_transaction.created_at is None:
+            fee_transaction.created_at = datetime.utcnow()
+        day = day_start(fee_transaction.created_at)
+        metrics = fee_metrics(fee_transaction)
+
+        merchant_row_created = self._increment(session, day, fee_transaction.merchant_billing_id, metrics)
+        # A new merchant row for the day means one more merchant was active on it
+        self._increment(session, day, None, metrics, active_merchants=1 if merchant_row_created else 0)
+
+    def _increment(self, session, day, merchant_billing_id, metrics, active_merchants=0):
+        """Add metrics to a day's row, creating it if missing; returns True if it was created"""
+        values = {name: getattr(RevenueReport, name) + amount for name, amount in metrics.items()}
+        if active_merchants:
+            values['active_merchants'] = RevenueReport.active_merchants + active_merchants
+
+        result = session.execute(
+            update(RevenueReport)
+            .where(self._row_filter(day, merchant_billing_id))
+            .values(**values)
+            .execution_options(synchronize_session=False)
+        )
+        if result.rowcount:
+            return False
+
+        session.add(RevenueReport(
+            active_merchants=active_merchants,
+            **self._row_key(day, merchant_billing_id), **metrics
+        ))
+        session.flush()
+        return True
+
+    def _row_key(self, day, merchant_billing_id):
+        return {
+            'report_type': DAILY,
+            'merchant_billing_id': merchant_billing_id,
+            'report_date': day,
+            'period_start': day,
+            'period_end': day + timedelta(days=1) - timedelta(seconds=1)
+        }
+
+    def _row_filter(self, day, merchant_billing_id):
+        merchant_filter = (RevenueReport.merchant_billing_id.is_(None) if merchant_billing_id is None
+                           else RevenueReport.merchant_billing_id == merchant_billing_id)
+        return and_(RevenueReport.report_type == DAILY, merchant_filter, RevenueReport.period_start == day)
+
+    def rebuild(self, connection, start=None, end=None):
+        """
+        Recompute daily rollups from fee_transactions for the days from start up to
+        (not including) end, or for all history; returns the number of rows written
+        """
+        day = day_bucket(FeeTransaction.created_at, connection.dialect.name)
+        query = select(FeeTransaction.merchant_billing_id, day.label('day'), *fee_aggregates())
+        rollups = delete(RevenueReport).where(RevenueReport.report_type == DAILY)
+        if start:
+            query = query.where(FeeTransaction.created_at >= day_start(start))
+            rollups = rollups.where(RevenueReport.period_start >= day_start(start))
+        if end:
+            query = query.where(FeeTransaction.created_at < day_start(end))
+            rollups = rollups.where(RevenueReport.period_start < day_start(end))
+
+        connection.execute(rollups)
+
+        rows = []
+        platform = {}
+        for row in connection.execute(query.group_by(FeeTransaction.merchant_billing_id, day)):
+            bucket = day_start(bucket_date(row.day))
+            metrics = {name: getattr(row, name) for name in METRICS}
+            rows.append(dict(self._row_key(bucket, row.merchant_billing_id), active_merchants=0, **metrics))
+
+            totals = platform.setdefault(bucket, dict.fromkeys(METRICS + ['active_merchants'], 0))
+            for name in METRICS:
+                totals[name] += metrics[name]
+            totals['active_merchants'] += 1
+
+        rows.extend(dict(self._row_key(bucket, None), **totals) for bucket, totals in platform.items())
+        if rows:
+            connection.execute(RevenueReport.__table__.insert(), rows)
+
+        logger.info(f"Rebuilt {len(rows)} daily revenue rollups")
+        return len(rows)
+
+    def summary(self, session, period_start, period_end, merchant_billing_id=None):
+        """
+        Revenue counters for fees created from period_start through period_end, inclusive.
+        Whole days are read from the rollups; the partial days at either end of the period
+        are aggregated from fee_transactions.
+        Returns (metrics, active merchant_billing_ids).
+        """
+        first_day = day_start(period_start)
+        if first_day < period_start:
+            first_day += timedelta(days=1)
+        last_day = day_start(period_end)
+
+        metrics = dict.fromkeys(METRICS, 0)
+        merchants = set()
+
+        def add(row):
+            for name in METRICS:
+                metrics[name] += getattr(row, name) or 0
+
+        if first_day >= last_day:
+            # Less than one whole day: read the fees directly
+            fee_ranges = [(period_start, period_end)]
+        else:
+            fee_ranges = [(period_start, first_day - timedelta(microseconds=1)), (last_day, period_end)]
+
+            rollup_filter = and_(
+                RevenueReport.report_type == DAILY,
+                RevenueReport.period_start >= first_day,
+                RevenueReport.period_start < last_day
+            )
+            merchant_filter = (RevenueReport.merchant_billing_id.is_(None) if merchant_billing_id is None
+                               else RevenueReport.merchant_billing_id == merchant_billing_id)
+            add(session.execute(
+                select(*[func.sum(getattr(RevenueReport, name)).label(name) for name in METRICS])
+                .where(rollup_filter, merchant_filter)
+            ).one())
+
+            if merchant_billing_id is None:
+                merchants.update(session.execute(
+                    select(RevenueReport.merchant_billing_id).distinct()
+                    .where(rollup_filter, RevenueReport.merchant_billing_id.isnot(None))
+                ).scalars())
+
+        for range_start, range_end in fee_ranges:
+            if range_start > range_end:
+                continue
+            fee_filter = and_(FeeTransaction.created_at >= range_start, FeeTransaction.created_at <= range_end)
+            if merchant_billing_id is not None:
+                fee_filter = and_(FeeTransaction.merchant_billing_id == merchant_billing_id, fee_filter)
+            add(session.execute(select(*fee_aggregates()).where(fee_filter)).one())
+
+            if merchant_billing_id is None:
+                merchants.update(session.execute(
+                    select(FeeTransaction.merchant_billing_id).distinct().where(fee_filter)
+                ).scalars())
+
+        return metrics, merchants
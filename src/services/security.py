@@ -5,7 +5,11 @@ import logging
 from datetime import datetime, timedelta
 from typing import Dict, Any, Optional, List
 from functools import wraps
-from flask import request, jsonify, current_app
+from flask import request, jsonify, current_app, make_response, has_request_context
+from src.services.api_keys import get_api_key_authenticator
+from src.services.jwt_keys import get_jwt_keyring
+from src.services.rate_limiter import get_rate_limiter, hash_identifier, rate_limit_headers
+from src.services.security_events import get_security_event_bus
 import re
 
 logger = logging.getLogger(__name__)
@@ -16,12 +20,10 @@ class SecurityService:
     """
     
     def __init__(self):
-        self.jwt_secret = secrets.token_urlsafe(32)
         self.token_expiry_hours = 24
         self.max_login_attempts = 5
         self.lockout_duration_minutes = 30
         self.password_min_length = 8
-        self.failed_attempts = {}  # In production, use Redis or database
         
     def hash_password(self, password: str, salt: str = None) -> tuple:
         """
@@ -126,7 +128,7 @@ class SecurityService:
             if additional_claims:
                 payload.update(additional_claims)
             
-            token = jwt.encode(payload, self.jwt_secret, algorithm='HS256')
+            token = get_jwt_keyring().sign(payload)
             
             logger.info(f"JWT token generated for user {user_id}")
             return token
@@ -140,11 +142,8 @@ class SecurityService:
         Verify and decode JWT token
         """
         try:
-            payload = jwt.decode(token, self.jwt_secret, algorithms=['HS256'])
-            
-            # Check if token is expired
-            if datetime.utcnow() > datetime.fromtimestamp(payload['exp']):
-                return {'valid': False, 'error': 'Token expired'}
+            # Signature and expiry are checked by the keyring (cached per token until exp)
+            payload = get_jwt_keyring().verify(token)
             
             return {'valid': True, 'payload': payload}
             
@@ -159,40 +158,19 @@ class SecurityService:
     def check_rate_limit(self, identifier: str, max_requests: int = 100, window_minutes: int = 60) -> Dict[str, Any]:
         """
         Check rate limiting for API requests
+        Counts are kept in the shared GCRA limiter, so they hold across all workers
         """
         try:
-            current_time = datetime.utcnow()
-            window_start = current_time - timedelta(minutes=window_minutes)
-            
-            # In production, use Redis for distributed rate limiting
-            # For demo, use in-memory storage
-            if identifier not in self.failed_attempts:
-                self.failed_attempts[identifier] = []
-            
-            # Remove old attempts outside the window
-            self.failed_attempts[identifier] = [
-                attempt for attempt in self.failed_attempts[identifier]
-                if attempt > window_start
-            ]
-            
-            current_requests = len(self.failed_attempts[identifier])
-            
-            if current_requests >= max_requests:
-                return {
-                    'allowed': False,
-                    'current_requests': current_requests,
-                    'max_requests': max_requests,
-                    'reset_time': (window_start + timedelta(minutes=window_minutes)).isoformat()
-                }
-            
-            # Record this request
-            self.failed_attempts[identifier].append(current_time)
+            result = get_rate_limiter().hit(identifier, max_requests, window_minutes * 60)
+            reset_time = datetime.utcnow() + timedelta(seconds=result['reset_after'])
             
             return {
-                'allowed': True,
-                'current_requests': current_requests + 1,
+                'allowed': result['allowed'],
                 'max_requests': max_requests,
-                'remaining_requests': max_requests - current_requests - 1
+                'remaining_requests': result['remaining'],
+                'retry_after': result['retry_after'],
+                'reset_time': reset_time.isoformat(),
+                'headers': rate_limit_headers(result)
             }
             
         except Exception as e:
@@ -202,25 +180,15 @@ class SecurityService:
     def validate_api_key(self, api_key: str, merchant_id: str = None) -> Dict[str, Any]:
         """
         Validate API key for merchant authentication
+        Secret keys are checked against the stored hash (see api_keys.ApiKeyAuthenticator)
         """
         try:
-            # In production, this would check against a database
-            # For demo, use a simple validation
-            if not api_key or len(api_key) < 32:
-                return {'valid': False, 'error': 'Invalid API key format'}
-            
-            if not api_key.startswith('pk_') and not api_key.startswith('sk_'):
-                return {'valid': False, 'error': 'Invalid API key prefix'}
-            
-            # Simulate database lookup
-            api_key_data = {
-                'merchant_id': merchant_id or 'merchant_demo_001',
-                'permissions': ['read', 'write'],
-                'created_at': datetime.utcnow().isoformat(),
-                'last_used': datetime.utcnow().isoformat()
-            }
+            result = get_api_key_authenticator().authenticate(api_key)
             
-            return {'valid': True, 'data': api_key_data}
+            if result['valid'] and merchant_id and result['data']['merchant_id'] != merchant_id:
+                return {'valid': False, 'error': 'API key does not belong to this merchant'}
+            
+            return result
             
         except Exception as e:
             logger.error(f"Error validating API key: {str(e)}")
@@ -279,23 +247,13 @@ class SecurityService:
     
     def log_security_event(self, event_type: str, details: Dict[str, Any], severity: str = 'INFO'):
         """
-        Log security events for monitoring and analysis
+        Publish a security event to the event bus; written out and queryable in the background
         """
         try:
-            log_entry = {
-                'timestamp': datetime.utcnow().isoformat(),
-                'event_type': event_type,
-                'severity': severity,
-                'details': details,
-                'source_ip': request.remote_addr if request else 'unknown'
-            }
-            
-            # In production, send to SIEM or security monitoring system
-            if severity in ['HIGH', 'CRITICAL']:
-                logger.warning(f"Security event: {log_entry}")
-            else:
-                logger.info(f"Security event: {log_entry}")
-                
+            get_security_event_bus().publish(
+                event_type, details, severity,
+                source_ip=request.remote_addr if has_request_context() else None
+            )
         except Exception as e:
             logger.error(f"Error logging security event: {str(e)}")
     
@@ -429,6 +387,7 @@ def require_auth(f):
         if api_key:
             validation_result = security_service.validate_api_key(api_key)
             if not validation_result['valid']:
+                security_service.log_security_event('invalid_api_key', {'path': request.path}, 'MEDIUM')
                 return jsonify({'error': 'Invalid API key'}), 401
             
             # Add merchant info to request context
@@ -444,6 +403,9 @@ def require_auth(f):
         verification_result = security_service.verify_jwt_token(token)
         
         if not verification_result['valid']:
+            security_service.log_security_event(
+                'invalid_token', {'path': request.path, 'error': verification_result['error']}, 'MEDIUM'
+            )
             return jsonify({'error': verification_result['error']}), 401
         
         # Add user info to request context
@@ -452,28 +414,72 @@ def require_auth(f):
     
     return decorated_function
 
+def authorized_merchant_id(requested: Optional[str] = None) -> Optional[str]:
+    """
+    The merchant the current request is authenticated as (API key or bearer token), or None
+    when it carries no merchant identity or requested names a different merchant
+    """
+    merchant_id = (
+        getattr(request, 'merchant_data', {}).get('merchant_id')
+        or getattr(request, 'user_data', {}).get('merchant_id')
+    )
+    if requested is not None and str(requested) != merchant_id:
+        return None
+    return merchant_id
+
+def _rate_limit_identifier(key: str) -> str:
+    """
+    Resolve the client a limit applies to; falls back to the client IP when the key is unavailable
+    """
+    if key == 'api_key' and request.headers.get('X-API-Key'):
+        return 'api_key:' + hash_identifier(request.headers['X-API-Key'])
+    
+    if key == 'merchant':
+        merchant_id = (
+            authorized_merchant_id()
+            or (request.get_json(silent=True) or {}).get('merchant_id')
+        )
+        if merchant_id:
+            return f'merchant:{merchant_id}'
+    
+    return f'ip:{request.remote_addr}'
+
 # Decorator for rate limiting
-def rate_limit(max_requests: int = 100, window_minutes: int = 60):
+def rate_limit(max_requests: int = 100, window_minutes: int = 60, key: str = 'ip', scope: str = None):
+    """
+    Limit requests per client, keyed by 'ip', 'api_key' or 'merchant'.
+    Each decorated endpoint has its own bucket unless several share a scope name.
+    """
+    if key not in ('ip', 'api_key', 'merchant'):
+        raise ValueError(f"Unsupported rate limit key: {key}")
+    
     def decorator(f):
+        bucket_scope = scope or f.__name__
+        
         @wraps(f)
         def decorated_function(*args, **kwargs):
             security_service = SecurityService()
             
-            # Use IP address as identifier
-            identifier = request.remote_addr
+            identifier = f'{bucket_scope}:{_rate_limit_identifier(key)}'
             
             rate_limit_result = security_service.check_rate_limit(
                 identifier, max_requests, window_minutes
             )
+            headers = rate_limit_result.get('headers', {})
             
             if not rate_limit_result['allowed']:
+                security_service.log_security_event(
+                    'rate_limit_exceeded', {'scope': bucket_scope, 'key': key, 'path': request.path}, 'LOW'
+                )
                 return jsonify({
                     'error': 'Rate limit exceeded',
+                    'retry_after': rate_limit_result.get('retry_after'),
                     'reset_time': rate_limit_result.get('reset_time')
-                }), 429
+                }), 429, headers
             
-            return f(*args, **kwargs)
+            response = make_response(f(*args, **kwargs))
+            response.headers.extend(headers)
+            return response
         
         return decorated_function
     return decorator
-
@@ -0,0 +1,304 @@
+"""
+In-process security event bus: a bounded buffer on the request path, a background writer
+batching events into rotating NDJSON segments, and queries over those segments
+"""
+
+import atexit
+import json
+import logging
+import os
+import random
+import threading
+from collections import deque
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+from src.database import data_path
+
+logger = logging.getLogger(__name__)
+
+SEVERITIES = ('INFO', 'LOW', 'MEDIUM', 'HIGH', 'CRITICAL')
+SEVERITY_RANK = {severity: rank for rank, severity in enumerate(SEVERITIES)}
+
+# Events at these severities are never sampled out and are also logged by the writer
+ALERT_SEVERITIES = frozenset(('HIGH', 'CRITICAL'))
+
+SEGMENT_PREFIX = 'security-events-'
+SEGMENT_SUFFIX = '.ndjson'
+
+class SecurityEventBus:
+    """
+    Security events, published from request threads and written out in the background.
+
+    publish() only appends to a bounded deque (append and popleft are atomic, so the
+    accepted path takes no lock) and never waits on the sink: when the buffer is full the
+    event is dropped and counted. Event types can be sampled (SECURITY_EVENT_SAMPLING, e.g.
+    "rate_limit_exceeded=0.1"), except at HIGH and CRITICAL severity.
+
+    A writer thread per process drains the buffer in batches into NDJSON segment files
+    named by start time and process id, so gunicorn workers never share a file. Segments
+    rotate by size and the oldest are deleted past max_segments, except the one each live
+    writer still has open.
+    """
+
+    def __init__(self, directory: str, capacity: int = 10000, sampling: Dict[str, float] = None,
+                 batch_size: int = 500, flush_interval: float = 0.5,
+                 segment_bytes: int = 8 * 1024 * 1024, max_segments: int = 64):
+        self.directory = directory
+        self.capacity = capacity
+        self.sampling = dict(sampling or {})
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.segment_bytes = segment_bytes
+        self.max_segments = max_segments
+        os.makedirs(directory, exist_ok=True)
+
+        self._events = deque()
+        self._wakeup = threading.Event()
+        # Counters touched off the accepted path: drops, sampling and the writer's own
+        self._stats_lock = threading.Lock()
+        self._dropped = 0
+        self._sampled_out = 0
+        self._written = 0
+        self._write_errors = 0
+
+        self._drain_lock = threading.Lock()
+        self._segment = None
+        self._segment_size = 0
+        self._writer = None
+        self._writer_pid = None
+        self._writer_start_lock = threading.Lock()
+        atexit.register(self.flush)
+
+    def publish(self, event_type: str, details: Dict[str, Any] = None, severity: str = 'INFO',
+                source_ip: Optional[str] = None) -> bool:
+        """Queue an event for the writer; returns False if it was sampled out or dropped"""
+        rate = self.sampling.get(event_type)
+        if rate is not None and severity not in ALERT_SEVERITIES and random.random() >= rate:
+            with self._stats_lock:
+                self._sampled_out += 1
+            return False
+
+        if len(self._events) >= self.capacity:
+            with self._stats_lock:
+                self._dropped += 1
+            return False
+
+        self._events.append({
+            'timestamp': datetime.utcnow().isoformat(),
+            'event_type': event_type,
+            'severity': severity,
+            'source_ip': source_ip,
+            'details': dict(details or {})
+        })
+
+        if self._writer_pid != os.getpid():
+            self._start_writer()
+        if len(self._events) >= self.batch_size:
+            self._wakeup.set()
+        return True
+
+    def _start_writer(self):
+        # Also restarts the writer in a forked worker, where the parent's thread does not exist
+        with self._writer_start_lock:
+            if self._writer_pid == os.getpid():
+                return
+            self._segment = None
+            self._writer = threading.Thread(target=self._run, name='security-event-writer', daemon=True)
+            self._writer_pid = os.getpid()
+            self._writer.start()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Error writing security events: {str(e)}")
+
+    def flush(self):
+        """Write every buffered event out now"""
+        with self._drain_lock:
+            while self._events:
+                batch = []
+                while len(batch) < self.batch_size:
+                    try:
+                        batch.append(self._events.popleft())
+                    except IndexError:
+                        break
+                self._write(batch)
+
+    def _write(self, batch: List[Dict[str, Any]]):
+        try:
+            data = ''.join(json.dumps(event, separators=(',', ':'), default=str) + '\n' for event in batch).encode('utf-8')
+            if self._segment is None or self._segment_size >= self.segment_bytes:
+                self._rotate()
+            self._segment.write(data)
+            self._segment.flush()
+            self._segment_size += len(data)
+        except Exception as e:
+            with self._stats_lock:
+                self._write_errors += 1
+                self._dropped += len(batch)
+            self._segment = None
+            logger.error(f"Error writing {len(batch)} security events: {str(e)}")
+            return
+
+        with self._stats_lock:
+            self._written += len(batch)
+        for event in batch:
+            if event['severity'] in ALERT_SEVERITIES:
+                logger.warning(f"Security event {event['event_type']} ({event['severity']}): {event['details']}")
+
+    def _rotate(self):
+        if self._segment is not None:
+            self._segment.close()
+        name = f"{SEGMENT_PREFIX}{datetime.utcnow().strftime('%Y%m%dT%H%M%S%f')}-{os.getpid()}{SEGMENT_SUFFIX}"
+        self._segment = open(os.path.join(self.directory, name), 'ab')
+        self._segment_size = 0
+        self._prune()
+
+    def _prune(self):
+        """
+        Delete the oldest segments past max_segments. Each writer appends only to its newest
+        segment, so that one is kept while its process is alive, whichever process prunes.
+        """
+        segments = self.segments()
+        excess = len(segments) - self.max_segments
+        if excess <= 0:
+            return
+
+        newest = {}
+        for path in segments:
+            newest[_segment_pid(path)] = path
+        open_segments = {path for pid, path in newest.items() if _process_alive(pid)}
+
+        for path in segments:
+            if excess <= 0:
+                break
+            if path in open_segments:
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            excess -= 1
+
+    def segments(self) -> List[str]:
+        """Segment paths, oldest first"""
+        return [
+            os.path.join(self.directory, name) for name in sorted(os.listdir(self.directory))
+            if name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX)
+        ]
+
+    def stats(self) -> Dict[str, int]:
+        with self._stats_lock:
+            return {
+                'capacity': self.capacity,
+                'buffered': len(self._events),
+                'written': self._written,
+                'dropped': self._dropped,
+                'sampled_out': self._sampled_out,
+                'write_errors': self._write_errors,
+                'segments': len(self.segments())
+            }
+
+    def query(self, event_types: List[str] = None, min_severity: str = None,
+              start: datetime = None, end: datetime = None, limit: int = 100) -> List[Dict[str, Any]]:
+        """
+        Written events matching every given filter, newest first. Covers the segments of
+        every process sharing the directory; events still buffered are not included.
+        """
+        start, end = _naive_utc(start), _naive_utc(end)
+        wanted_types = set(event_types or ())
+        min_rank = SEVERITY_RANK[min_severity] if min_severity else None
+        # Cheap substring checks before parsing each line
+        type_markers = [f'"event_type":{json.dumps(event_type)}' for event_type in wanted_types]
+        start_text = start.isoformat() if start else None
+        end_text = end.isoformat() if end else None
+
+        candidates = []
+        for path in self.segments():
+            try:
+                modified = datetime.utcfromtimestamp(os.path.getmtime(path))
+            except FileNotFoundError:
+                continue
+            created = datetime.strptime(os.path.basename(path)[len(SEGMENT_PREFIX):].split('-')[0], '%Y%m%dT%H%M%S%f')
+            if (start and modified < start) or (end and created >= end):
+                continue
+            candidates.append((modified, path))
+
+        results = []
+        # Newest segments first; stop once the rest were last written before the oldest result kept
+        for modified, path in sorted(candidates, reverse=True):
+            if len(results) >= limit and modified.isoformat() < results[limit - 1]['timestamp']:
+                break
+            try:
+                with open(path, 'rb') as segment:
+                    lines = segment.read().decode('utf-8').splitlines()
+            except FileNotFoundError:
+                continue
+            for line in lines:
+                if type_markers and not any(marker in line for marker in type_markers):
+                    continue
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    continue  # a line cut short by a crash
+                if wanted_types and event['event_type'] not in wanted_types:
+                    continue
+                if min_rank is not None and SEVERITY_RANK.get(event['severity'], 0) < min_rank:
+                    continue
+                if (start_text and event['timestamp'] < start_text) or (end_text and event['timestamp'] >= end_text):
+                    continue
+                results.append(event)
+            results.sort(key=lambda event: event['timestamp'], reverse=True)
+            del results[limit:]
+
+        return results
+
+def _naive_utc(value: Optional[datetime]) -> Optional[datetime]:
+    """Timestamps here are naive UTC; convert aware datetimes to match"""
+    if value is not None and value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+def _segment_pid(path: str) -> int:
+    """The id of the process that wrote a segment, from its name"""
+    return int(os.path.basename(path)[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)].split('-')[1])
+
+def _process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def _parse_sampling(value: str) -> Dict[str, float]:
+    """Parse "event_type=rate,..." into {event_type: rate}"""
+    sampling = {}
+    for item in filter(None, (part.strip() for part in (value or '').split(','))):
+        event_type, _, rate = item.partition('=')
+        sampling[event_type.strip()] = max(0.0, min(float(rate), 1.0))
+    return sampling
+
+_bus = None
+_bus_lock = threading.Lock()
+
+def get_security_event_bus() -> SecurityEventBus:
+    """
+    Return the process-wide security event bus (SECURITY_EVENT_DIR, or security_events in the
+    data directory; SECURITY_EVENT_BUFFER_SIZE and SECURITY_EVENT_SAMPLING)
+    """
+    global _bus
+    if _bus is None:
+        with _bus_lock:
+            if _bus is None:
+                _bus = SecurityEventBus(
+                    os.environ.get('SECURITY_EVENT_DIR') or data_path('security_events'),
+                    capacity=int(os.environ.get('SECURITY_EVENT_BUFFER_SIZE', 10000)),
+                    sampling=_parse_sampling(os.environ.get('SECURITY_EVENT_SAMPLING', ''))
+                )
+    return _bus
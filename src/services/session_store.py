@@ -0,0 +1,151 @@
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+from sqlalchemy import update
+from src.database import db
+from src.services.cache import MISSING, TTLCache
+
+logger = logging.getLogger(__name__)
+
+SESSION_LIFETIME = timedelta(hours=24)
+
+MERCHANT_FIELDS = [
+    'merchant_id', 'business_name', 'contact_email', 'contact_phone', 'business_address',
+    'business_type', 'website_url', 'status', 'is_verified', 'created_at'
+]
+
+class SessionStore:
+    """
+    Resolves dashboard session tokens to their merchant, with an in-process LRU in front.
+
+    A miss costs one joined query over login_sessions, merchant_auth and merchants; the
+    snapshot is then served from memory until the cache TTL runs out. Sessions slide: each
+    use pushes expires_at forward, but the new expiry is only written back in batches
+    every flush interval instead of committing on every request. Logout invalidates the
+    local entry; other workers drop theirs when the TTL expires.
+    """
+
+    def __init__(self, cache: TTLCache = None, negative_ttl: float = 5.0,
+                 touch_interval: float = 60.0, flush_interval: float = 30.0, flush_batch_size: int = 500):
+        self.cache = cache or TTLCache(maxsize=10000, ttl=30.0)
+        self.negative_ttl = negative_ttl
+        self.touch_interval = timedelta(seconds=touch_interval)
+        self.flush_interval = flush_interval
+        self.flush_batch_size = flush_batch_size
+        self._pending = {}  # session id -> new expires_at
+        self._flushed_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _load(self, session_token: str) -> Optional[Dict[str, Any]]:
+        from src.models.auth import LoginSession, MerchantAuth
+        from src.models.user import Merchant
+
+        row = db.session.query(
+            LoginSession.id, LoginSession.expires_at, MerchantAuth.id.label('merchant_auth_id'),
+            MerchantAuth.api_key, *[getattr(Merchant, field) for field in MERCHANT_FIELDS]
+        ).join(
+            MerchantAuth, LoginSession.merchant_auth_id == MerchantAuth.id
+        ).join(
+            Merchant, MerchantAuth.merchant_id == Merchant.id
+        ).filter(
+            LoginSession.session_token == session_token,
+            LoginSession.is_active == True
+        ).first()
+
+        if row is None:
+            return None
+
+        return {
+            'session_id': row.id,
+            'expires_at': row.expires_at,
+            'merchant_auth_id': row.merchant_auth_id,
+            'api_key': row.api_key,
+            'merchant': {field: getattr(row, field) for field in MERCHANT_FIELDS}
+        }
+
+    def resolve(self, session_token: str) -> Optional[Dict[str, Any]]:
+        """
+        Return the snapshot for an active, unexpired session token, or None
+        """
+        if not session_token:
+            return None
+
+        record = self.cache.get(session_token)
+        if record is MISSING:
+            record = self._load(session_token)
+            self.cache.set(session_token, record, ttl=None if record else self.negative_ttl)
+
+        if record is None:
+            return None
+
+        now = datetime.utcnow()
+        with self._lock:
+            record = self._pending_expiry(record)
+            if record['expires_at'] < now:
+                self.cache.delete(session_token)
+                return None
+            if record['expires_at'] - now < SESSION_LIFETIME - self.touch_interval:
+                record = dict(record, expires_at=now + SESSION_LIFETIME)
+                self._pending[record['session_id']] = record['expires_at']
+                self.cache.set(session_token, record)
+
+        self.flush(force=False)
+        return record
+
+    def _pending_expiry(self, record: Dict[str, Any]) -> Dict[str, Any]:
+        # A snapshot reloaded before its extension was flushed must not look older than it is
+        pending = self._pending.get(record['session_id'])
+        if pending and pending > record['expires_at']:
+            return dict(record, expires_at=pending)
+        return record
+
+    def flush(self, force: bool = True):
+        """
+        Write pending session extensions in one bulk UPDATE.
+        Without force, only does so once the flush interval or batch size is reached.
+        """
+        from src.models.auth import LoginSession
+
+        with self._lock:
+            due = time.monotonic() - self._flushed_at >= self.flush_interval
+            if not self._pending or not (force or due or len(self._pending) >= self.flush_batch_size):
+                return
+            pending, self._pending = self._pending, {}
+            self._flushed_at = time.monotonic()
+
+        try:
+            db.session.execute(
+                update(LoginSession),
+                [{'id': session_id, 'expires_at': expires_at} for session_id, expires_at in pending.items()]
+            )
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Error flushing {len(pending)} session extensions: {str(e)}")
+
+    def invalidate(self, session_token: str):
+        """
+        Drop a cached session, e.g. after logout or deactivation
+        """
+        if session_token:
+            self.cache.delete(session_token)
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_session_store() -> SessionStore:
+    """
+    Return the process-wide session store (cache sized by SESSION_CACHE_SIZE / SESSION_CACHE_TTL)
+    """
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = SessionStore(TTLCache(
+                    maxsize=int(os.environ.get('SESSION_CACHE_SIZE', 10000)),
+                    ttl=float(os.environ.get('SESSION_CACHE_TTL', 30))
+                ))
+    return _store
@@ -0,0 +1,122 @@
+import logging
+import os
+import secrets
+import sqlite3
+import string
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional
+from src.database import data_path
+
+logger = logging.getLogger(__name__)
+
+TOKEN_ALPHABET = string.ascii_letters
+TOKEN_LENGTH = 32
+
+# SQLite's default limit on bound parameters is 999
+LOOKUP_CHUNK_SIZE = 500
+
+class TokenVault:
+    """
+    SQLite-backed card token vault.
+
+    Stores one encrypted PAN per card, indexed by token (for detokenization) and by
+    a keyed fingerprint of the PAN (so the same card always maps to the same token).
+    The vault lives in its own file, outside the application database.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._init_schema()
+
+    def _connection(self) -> sqlite3.Connection:
+        """
+        One connection per thread (and per process, after gunicorn forks)
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5.0)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _init_schema(self):
+        conn = self._connection()
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS card_tokens (
+                token TEXT PRIMARY KEY,
+                fingerprint BLOB NOT NULL UNIQUE,
+                ciphertext TEXT NOT NULL,
+                last_four TEXT,
+                created_at TEXT NOT NULL
+            )
+        ''')
+        conn.commit()
+
+    def find_token(self, fingerprint: bytes) -> Optional[str]:
+        """
+        Return the token already issued for a card fingerprint, if any
+        """
+        row = self._connection().execute(
+            'SELECT token FROM card_tokens WHERE fingerprint = ?', (fingerprint,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def store(self, fingerprint: bytes, ciphertext: str, last_four: str) -> str:
+        """
+        Issue a token for a card; if another worker stored the same card first, its token wins
+        """
+        conn = self._connection()
+        token = 'tok_' + ''.join(secrets.choice(TOKEN_ALPHABET) for _ in range(TOKEN_LENGTH))
+        with conn:
+            conn.execute(
+                'INSERT OR IGNORE INTO card_tokens (token, fingerprint, ciphertext, last_four, created_at) '
+                'VALUES (?, ?, ?, ?, ?)',
+                (token, fingerprint, ciphertext, last_four, datetime.utcnow().isoformat())
+            )
+        return self.find_token(fingerprint)
+
+    def get(self, token: str) -> Optional[str]:
+        """
+        Return the stored ciphertext for a token
+        """
+        row = self._connection().execute(
+            'SELECT ciphertext FROM card_tokens WHERE token = ?', (token,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def get_many(self, tokens: List[str]) -> Dict[str, str]:
+        """
+        Return the stored ciphertexts for many tokens, keyed by token.
+        Unknown tokens are left out of the result.
+        """
+        conn = self._connection()
+        unique_tokens = list(dict.fromkeys(tokens))
+        found = {}
+        for start in range(0, len(unique_tokens), LOOKUP_CHUNK_SIZE):
+            chunk = unique_tokens[start:start + LOOKUP_CHUNK_SIZE]
+            placeholders = ','.join('?' * len(chunk))
+            found.update(conn.execute(
+                f'SELECT token, ciphertext FROM card_tokens WHERE token IN ({placeholders})', chunk
+            ).fetchall())
+        return found
+
+    def count(self) -> int:
+        return self._connection().execute('SELECT COUNT(*) FROM card_tokens').fetchone()[0]
+
+_vault = None
+_vault_lock = threading.Lock()
+
+def get_token_vault() -> TokenVault:
+    """
+    Return the process-wide token vault (TOKEN_VAULT_PATH, or token_vault.db in the data directory)
+    """
+    global _vault
+    if _vault is None:
+        with _vault_lock:
+            if _vault is None:
+                _vault = TokenVault(os.environ.get('TOKEN_VAULT_PATH') or data_path('token_vault.db'))
+    return _vault
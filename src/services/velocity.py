@@ -0,0 +1,240 @@
+import calendar
+import fcntl
+import hashlib
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, Optional
+from src.database import data_path
+
+logger = logging.getLogger(__name__)
+
+# Sliding windows as (name, bucket size in seconds, number of buckets)
+WINDOWS = [
+    ('1m', 10, 6),
+    ('1h', 300, 12),
+    ('24h', 3600, 24),
+]
+TOTAL_BUCKETS = sum(buckets for _, _, buckets in WINDOWS)
+
+# Entities tracked for every transaction, keyed by Payment attribute
+ENTITIES = ['merchant_id', 'card_token', 'customer_email', 'ip_address']
+
+MAGIC = b'DPVEL001'
+HEADER = struct.Struct('<8sIId')
+HEADER_SIZE = 64
+# key hash, last update (epoch seconds), reserved, then (bucket epoch, count) per bucket
+SLOT = struct.Struct(f'<QII{TOTAL_BUCKETS * 2}I')
+MAX_PROBES = 8
+
+class VelocityStore:
+    """
+    Bucketed ring-buffer velocity counters in a memory-mapped file.
+
+    Every entity (merchant, card token, email, IP) hashes to a fixed-size slot holding one
+    ring of time buckets per window, so recording and reading a count are O(1) regardless of
+    traffic. All gunicorn workers map the same file; writers serialize on a file lock and
+    readers never block.
+    """
+
+    def __init__(self, path: str, slot_count: int = 32768):
+        self.path = path
+        self.slot_count = slot_count
+        self.size = HEADER_SIZE + slot_count * SLOT.size
+        self._mm = None
+        self._fd = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _map(self) -> mmap.mmap:
+        """
+        Map the counter file, creating (or resizing) it on first use in this process
+        """
+        if self._mm is not None and self._pid == os.getpid():
+            return self._mm
+
+        with self._lock:
+            if self._mm is None or self._pid != os.getpid():
+                fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                try:
+                    header = os.pread(fd, HEADER.size, 0)
+                    valid = (
+                        len(header) == HEADER.size
+                        and HEADER.unpack(header)[:3] == (MAGIC, self.slot_count, SLOT.size)
+                        and os.fstat(fd).st_size == self.size
+                    )
+                    if not valid:
+                        os.ftruncate(fd, 0)
+                        os.ftruncate(fd, self.size)
+                        os.pwrite(fd, HEADER.pack(MAGIC, self.slot_count, SLOT.size, 0.0), 0)
+                        logger.info(f"Created velocity store at {self.path}")
+                finally:
+                    fcntl.flock(fd, fcntl.LOCK_UN)
+
+                self._mm = mmap.mmap(fd, self.size)
+                self._fd = fd
+                self._pid = os.getpid()
+
+        return self._mm
+
+    @staticmethod
+    def _key_hash(entity: str, value: str) -> int:
+        digest = hashlib.blake2b(f"{entity}:{value}".encode(), digest_size=8).digest()
+        return int.from_bytes(digest, 'little') | 1  # zero marks an empty slot
+
+    def _slot_offset(self, index: int) -> int:
+        return HEADER_SIZE + (index % self.slot_count) * SLOT.size
+
+    def _find_slot(self, mm: mmap.mmap, key_hash: int, create: bool) -> Optional[int]:
+        """
+        Linear probing over a short run of slots; when creating and the run is full,
+        the least recently updated slot is recycled
+        """
+        oldest_offset, oldest_seen = None, None
+        for probe in range(MAX_PROBES):
+            offset = self._slot_offset(key_hash + probe)
+            slot_hash, last_seen = struct.unpack_from('<QI', mm, offset)
+            if slot_hash == key_hash:
+                return offset
+            if slot_hash == 0:
+                return offset if create else None
+            if oldest_seen is None or last_seen < oldest_seen:
+                oldest_offset, oldest_seen = offset, last_seen
+
+        return oldest_offset if create else None
+
+    def _increment(self, mm: mmap.mmap, key_hash: int, now: int):
+        offset = self._find_slot(mm, key_hash, create=True)
+        values = list(SLOT.unpack_from(mm, offset))
+        if values[0] != key_hash:
+            values = [key_hash, now, 0] + [0] * (TOTAL_BUCKETS * 2)
+
+        base = 3
+        for _, bucket_seconds, buckets in WINDOWS:
+            epoch = now // bucket_seconds
+            position = base + (epoch % buckets) * 2
+            if values[position] == epoch:
+                values[position + 1] += 1
+            else:
+                values[position] = epoch
+                values[position + 1] = 1
+            base += buckets * 2
+
+        values[1] = max(values[1], now)
+        SLOT.pack_into(mm, offset, *values)
+
+    def record(self, entities: Dict[str, str], timestamp: float = None):
+        """
+        Count one transaction against each of its entities (entity name -> value)
+        """
+        keys = [self._key_hash(entity, value) for entity, value in entities.items() if value]
+        if not keys:
+            return
+
+        mm = self._map()
+        now = int(timestamp if timestamp is not None else time.time())
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            for key_hash in keys:
+                self._increment(mm, key_hash, now)
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def counts(self, entity: str, value: str, timestamp: float = None) -> Dict[str, int]:
+        """
+        Transactions seen for an entity in each window, as of the given time
+        """
+        result = {name: 0 for name, _, _ in WINDOWS}
+        if not value:
+            return result
+
+        mm = self._map()
+        key_hash = self._key_hash(entity, value)
+        offset = self._find_slot(mm, key_hash, create=False)
+        if offset is None:
+            return result
+
+        values = SLOT.unpack_from(mm, offset)
+        if values[0] != key_hash:
+            return result
+
+        now = int(timestamp if timestamp is not None else time.time())
+        base = 3
+        for name, bucket_seconds, buckets in WINDOWS:
+            oldest_epoch = now // bucket_seconds - buckets
+            ring = values[base:base + buckets * 2]
+            result[name] = sum(
+                count for epoch, count in zip(ring[0::2], ring[1::2]) if epoch > oldest_epoch
+            )
+            base += buckets * 2
+
+        return result
+
+    @property
+    def warmed_at(self) -> float:
+        return HEADER.unpack_from(self._map(), 0)[3]
+
+    def warm(self, rows: Iterable[Dict], warmed_at: float = None):
+        """
+        Load historical transactions (dicts of ENTITIES plus 'created_at') into the counters
+        """
+        count = 0
+        for row in rows:
+            created_at = row['created_at']
+            self.record({entity: row.get(entity) for entity in ENTITIES}, calendar.timegm(created_at.utctimetuple()))
+            count += 1
+
+        mm = self._map()
+        struct.pack_into('<d', mm, HEADER.size - 8, warmed_at or time.time())
+        logger.info(f"Velocity store warmed with {count} transactions")
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_velocity_store() -> VelocityStore:
+    """
+    Return the process-wide velocity store (VELOCITY_STORE_PATH, or velocity.bin in the data directory)
+    """
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = VelocityStore(os.environ.get('VELOCITY_STORE_PATH') or data_path('velocity.bin'))
+    return _store
+
+def init_velocity_store(app):
+    """
+    Warm the shared velocity counters from the last 24 hours of payments.
+    Only the first worker to start against a fresh counter file does this.
+    """
+    from src.database import db
+    from src.models.payment import Payment
+
+    store = get_velocity_store()
+
+    # Workers start concurrently; the warm-up lock makes the others wait and then skip
+    lock_fd = os.open(store.path + '.lock', os.O_RDWR | os.O_CREAT, 0o600)
+    fcntl.flock(lock_fd, fcntl.LOCK_EX)
+    try:
+        if store.warmed_at > 0:
+            return store
+
+        with app.app_context():
+            since = datetime.utcnow() - timedelta(hours=24)
+            query = db.session.query(
+                Payment.merchant_id, Payment.card_token, Payment.customer_email,
+                Payment.ip_address, Payment.created_at
+            ).filter(Payment.created_at >= since).execution_options(yield_per=5000)
+            store.warm(row._asdict() for row in query)
+    except Exception as e:
+        logger.error(f"Error warming velocity store: {str(e)}")
+    finally:
+        fcntl.flock(lock_fd, fcntl.LOCK_UN)
+        os.close(lock_fd)
+
+    return store
@@ -0,0 +1,35 @@
+"""
+Hot queries must stay index-backed: explains every query in src.query_plans against a
+freshly initialized SQLite database and fails on any full table scan
+"""
+
+import pytest
+from flask import Flask
+from sqlalchemy import select
+
+from src.database import db, init_db
+from src.query_plans import FULL_SCAN, check_query_plans, explain
+
+@pytest.fixture(scope='module')
+def engine(tmp_path_factory):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{tmp_path_factory.mktemp('db') / 'query_plans.db'}"
+    init_db(app)
+    with app.app_context():
+        yield db.engine
+        db.session.remove()
+        db.engine.dispose()
+
+def test_hot_queries_are_index_backed(engine):
+    results = check_query_plans(engine)
+    assert results
+    full_scans = {result['name']: result['full_scans'] for result in results if not result['ok']}
+    assert not full_scans, f"Hot queries with a full table scan: {full_scans}"
+
+def test_full_scan_is_detected(engine):
+    # Guards the check itself: a query on an unindexed column must be reported
+    from src.models.payment import Payment
+
+    with engine.connect() as connection:
+        plan = explain(connection, select(Payment.id).where(Payment.description == 'x'))
+    assert any(FULL_SCAN.match(step) for step in plan)